@@ -1,44 +1,198 @@
 import abc
-import copy
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import csv
+import hashlib
 import json
 import logging
+import os
+import queue
 import re
+import shlex
+import signal
+import socket
+import sqlite3
 import sys
 import time
 import traceback
 import typing
+import urllib.parse
 
-import bs4
+import lxml.etree
 import requests
+import requests.adapters
+import urllib3.util
 import toml
 import threading
 import typing_extensions
+import weakref
+
+import jobqueue
+import metrics
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
 
 
-class HashableDict(dict):
-    def __hash__(self):
-        return hash(tuple(sorted(self.items())))
+class PostKey(typing.NamedTuple):
+    """帖子和回复的唯一标识"""
+    tid: str
+    pid: str
+
+
+class ForumKey(typing.NamedTuple):
+    """关注的吧的唯一标识"""
+    fid: str
+
+
+class UserKey(typing.NamedTuple):
+    """关注的人和粉丝的唯一标识"""
+    portrait: str
+
+
+EntityKey = typing.Union[PostKey, ForumKey, UserKey]
 
 
 class ModuleConfig(typing_extensions.TypedDict):
     enable: bool
     start_page: int
     max_error_count: int
+    concurrency: int
+    rate_per_sec: float
+    burst: int
+    batch_size: int
+    max_pages: int
 
 
 default_module_config: ModuleConfig = {
     'enable': False,  # 默认禁用
     'start_page': 1,  # 默认从第一页开始
-    'max_error_count': 3  # 默认最大错误次数为 3
+    'max_error_count': 3,  # 默认最大错误次数为 3
+    'concurrency': 1,  # 默认单线程删除
+    'rate_per_sec': 1.0,  # 默认每秒删除一次
+    'burst': 1,  # 默认不允许突发
+    'batch_size': 1,  # 默认每次提交一个
+    'max_pages': 0  # 每次最多检查的页数, 0 为不限制
+}
+
+
+class HttpConfig(typing_extensions.TypedDict):
+    pool_size: int
+    connect_timeout: float
+    read_timeout: float
+    retries: int
+    backoff_factor: float
+    http2: bool
+
+
+default_http_config: HttpConfig = {
+    'pool_size': 0,  # 0 代表根据各模块的并发数自动计算
+    'connect_timeout': 5,
+    'read_timeout': 15,
+    'retries': 3,
+    'backoff_factor': 0.5,
+    'http2': False  # 需要安装 httpx[http2]
+}
+
+
+class BatchConfig(typing_extensions.TypedDict):
+    cookie_files: typing.List[str]
+    cookie_dir: str
+    max_workers: int
+    max_concurrency_per_account: int
+
+
+default_batch_config: BatchConfig = {
+    'cookie_files': [],  # 需要批量处理的 Cookie 文件
+    'cookie_dir': '',  # 或者处理这个目录下所有的 .txt 文件
+    'max_workers': 4,  # 同时处理的账号数
+    'max_concurrency_per_account': 4  # 每个账号每个模块的删除并发上限
+}
+
+
+class MetricsConfig(typing_extensions.TypedDict):
+    json_file: str
+    interval: float
+    prometheus_port: int
+
+
+default_metrics_config: MetricsConfig = {
+    'json_file': '',  # 定期保存指标快照的文件, 留空不保存
+    'interval': 10,  # 保存间隔 (秒)
+    'prometheus_port': 0  # 本地 Prometheus 接口端口, 0 为不开启
+}
+
+
+class AdaptiveConfig(typing_extensions.TypedDict):
+    enable: bool
+    min_rate: float
+    max_rate: float
+    increase: float
+    decrease: float
+    limit_cooldown: float
+    max_limit_waits: int
+    resume_learned: bool
+
+
+default_adaptive_config: AdaptiveConfig = {
+    'enable': False,
+    'min_rate': 0.1,  # 速度下限 (次/秒)
+    'max_rate': 10.0,  # 速度上限 (次/秒)
+    'increase': 0.05,  # 每次删除成功后提高的速度
+    'decrease': 0.5,  # 失败或遇到上限时速度乘以这个系数
+    'limit_cooldown': 600,  # 遇到 220034 后暂停的时间 (秒)
+    'max_limit_waits': 3,  # 最多暂停几次, 超过后停止模块
+    'resume_learned': True  # 从 journal 中上次学到的速度开始, 命令行指定了 --rate 时不使用
+}
+
+
+class QueueConfig(typing_extensions.TypedDict):
+    url: str
+    lease_seconds: float
+    max_attempts: int
+    batch_size: int
+    concurrency: int
+    poll_interval: float
+    retry_delay: float
+
+
+default_queue_config: QueueConfig = {
+    'url': './queue.sqlite3',  # SQLite 文件, 或者 redis://host:port/db
+    'lease_seconds': 120,  # worker 租用任务后需要在这个时间内完成, 否则任务会分配给其他 worker
+    'max_attempts': 5,  # 任务最多失败几次
+    'batch_size': 20,  # worker 每次租用的任务数
+    'concurrency': 4,  # worker 同时执行的任务数
+    'poll_interval': 5,  # 没有可以执行的任务时等待的时间 (秒)
+    'retry_delay': 30  # 删除失败的任务多久之后重试 (秒)
 }
 
 
+class EndpointLimit(typing_extensions.TypedDict):
+    rate_per_sec: float
+    burst: int
+
+
 class GlobalConfig(typing_extensions.TypedDict):
     user_agent: str
     cookie_file: str
+    base_url: str
+    tbs_ttl: int
+    page_cache_size: int
+    stream_pages: bool
+    journal_file: str
+    http: HttpConfig
+    batch: BatchConfig
+    parallel_modules: bool
+    engine: str
+    inventory: bool
+    inventory_concurrency: int
+    endpoint_limits: typing.Dict[str, EndpointLimit]
+    metrics: MetricsConfig
+    adaptive: AdaptiveConfig
+    filter: str
+    queue: QueueConfig
 
     thread: ModuleConfig
     reply: ModuleConfig
@@ -47,260 +201,2372 @@ class GlobalConfig(typing_extensions.TypedDict):
     fan: ModuleConfig
 
 
+module_names = ('thread', 'reply', 'followed_ba', 'concern', 'fan')
+default_base_url = 'https://tieba.baidu.com'
+tbs_fresh_seconds = 10  # 这么短的时间内获取的 tbs 被拒绝时不再刷新, 错误和 tbs 无关
+
+
+class TbsCache:
+    """同一个 session 共享的 tbs, 过期或者被服务器拒绝时才重新获取"""
+    _session: requests.Session
+    _ttl: float
+    _max_retries: int
+    _backoff_base: float
+    _backoff_max: float
+
+    def __init__(self, session: requests.Session, ttl: float = 300, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 8, base_url: str = default_base_url):
+        self._session = session
+        self._base_url = base_url
+        self._ttl = ttl
+        self._max_retries = max_retries
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        self._tbs = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> str:
+        with self._lock:
+            if self._tbs is None or time.monotonic() - self._fetched_at > self._ttl:
+                self._tbs = self._fetch()
+                self._fetched_at = time.monotonic()
+            return self._tbs
+
+    def is_fresh(self, tbs: str, within: float) -> bool:
+        """tbs 是否是 within 秒内刚获取的"""
+        with self._lock:
+            return tbs == self._tbs and time.monotonic() - self._fetched_at <= within
+
+    def invalidate(self, tbs: typing.Optional[str] = None):
+        # 只作废传入的那个 tbs, 避免并发时把别人刚刷新的 tbs 也作废掉
+        with self._lock:
+            if tbs is None or tbs == self._tbs:
+                self._tbs = None
+
+    def _fetch(self) -> str:
+        delay = self._backoff_base
+        for attempt in range(1, self._max_retries + 1):
+            try:
+                with metrics.registry.timer('tieba_tbs_fetch_seconds'):
+                    resp = self._session.get(f"{self._base_url}/dc/common/tbs", timeout=5)
+                return resp.json()["tbs"]
+            except Exception:
+                if attempt == self._max_retries:
+                    raise
+                logger.warning(f'failed to get tbs (attempt {attempt}/{self._max_retries}), retry in {delay}s')
+                traceback.print_exc()
+                time.sleep(delay)
+                delay = min(delay * 2, self._backoff_max)
+
+
+_tbs_caches: 'weakref.WeakKeyDictionary[requests.Session, TbsCache]' = weakref.WeakKeyDictionary()
+_tbs_caches_lock = threading.Lock()
+
+
+def get_tbs_cache(session: requests.Session, ttl: float = 300, base_url: str = default_base_url) -> TbsCache:
+    with _tbs_caches_lock:
+        cache = _tbs_caches.get(session)
+        if cache is None:
+            cache = TbsCache(session, ttl=ttl, base_url=base_url)
+            _tbs_caches[session] = cache
+        return cache
+
+
+class CancellationToken:
+    """协作式取消, 调用 cancel 后各模块不再收集和提交新的删除, 已经发出的请求完成后返回"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def wait(self, timeout: typing.Optional[float] = None) -> bool:
+        """等待 timeout 秒, 期间被取消时提前返回 True"""
+        return self._event.wait(timeout)
+
+
+class TokenBucket:
+    """令牌桶限速, 出错时指数退避, 成功后恢复"""
+    _rate: float
+    _burst: int
+    _max_backoff: float
+
+    def __init__(self, rate: float, burst: int = 1, max_backoff: float = 60):
+        self._rate = rate
+        self._burst = max(burst, 1)
+        self._max_backoff = max_backoff
+        self._tokens = float(self._burst)
+        self._updated_at = time.monotonic()
+        self._backoff = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: int = 1) -> float:
+        """不等待, 拿到令牌时返回 0, 否则返回还需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated_at) * self._rate)
+            self._updated_at = now
+
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self._rate
+
+    def acquire(self, tokens: int = 1, cancel_token: typing.Optional[CancellationToken] = None) -> bool:
+        """等待拿到令牌, 等待期间被取消时返回 False"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if cancel_token is None:
+                time.sleep(wait)
+            elif cancel_token.wait(wait):
+                return False
+
+    async def acquire_async(self, tokens: int = 1, cancel_token: typing.Optional[CancellationToken] = None) -> bool:
+        """acquire 的异步版本, 等待时不占用线程"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return True
+            if cancel_token is not None and cancel_token.cancelled:
+                return False
+            # 分段等待, 及时响应取消
+            await asyncio.sleep(min(wait, 0.5))
+
+    def penalize(self):
+        # 每次失败退避时间翻倍, 退避期间不发放令牌
+        with self._lock:
+            self._backoff = min(max(self._backoff * 2, 1 / self._rate), self._max_backoff)
+            self._paused_until = time.monotonic() + self._backoff
+            self._tokens = 0
+
+    def reward(self):
+        with self._lock:
+            self._backoff = 0.0
+
+    def pause(self, seconds: float):
+        """暂停发放令牌 seconds 秒"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def set_rate(self, rate: float, burst: typing.Optional[int] = None):
+        """运行中调整速度, 已经积累的令牌不超过新的 burst"""
+        with self._lock:
+            self._rate = rate
+            if burst is not None:
+                self._burst = max(burst, 1)
+            self._tokens = min(self._tokens, self._burst)
+
+
+class AdaptiveRate:
+    """
+    AIMD 速度控制, 删除成功时线性提高令牌桶的速度, 失败时按比例降低
+    遇到 220034 时降低速度并暂停 limit_cooldown 秒等上限恢复, 最多暂停 max_limit_waits 次
+    """
+    _name: str
+    _bucket: TokenBucket
+    _config: AdaptiveConfig
+
+    def __init__(self, name: str, bucket: TokenBucket, config: AdaptiveConfig, rate: float):
+        self._name = name
+        self._bucket = bucket
+        self._config = config
+        self._lock = threading.Lock()
+        self._limit_waits = 0
+        self._cooldown_until = 0.0
+        self._limited_rate: typing.Optional[float] = None  # 最近一次遇到上限后降低到的速度
+        self._rate = self._clamp(rate)
+        self._bucket.set_rate(self._rate)
+
+    def _clamp(self, rate: float) -> float:
+        return min(max(rate, self._config['min_rate']), self._config['max_rate'])
+
+    def _set_rate(self, rate: float):
+        self._rate = self._clamp(rate)
+        self._bucket.set_rate(self._rate)
+        metrics.registry.set('tieba_adaptive_rate', self._rate, module=self._name)
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def safe_rate(self) -> float:
+        """下次运行的起始速度, 遇到过上限时为最近一次降低后的速度, 否则为当前速度"""
+        with self._lock:
+            return self._rate if self._limited_rate is None else min(self._rate, self._limited_rate)
+
+    def set_rate(self, rate: float):
+        """手动指定当前速度, 之后仍然按照成功和失败调整"""
+        with self._lock:
+            self._set_rate(rate)
+
+    def on_success(self):
+        with self._lock:
+            self._set_rate(self._rate + self._config['increase'])
+
+    def on_error(self):
+        with self._lock:
+            self._set_rate(self._rate * self._config['decrease'])
+
+    def on_limit(self) -> bool:
+        """遇到 220034, 返回 False 表示暂停次数已经用完, 应该停止"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._cooldown_until:
+                # 暂停前已经发出的请求, 不重复计算
+                return True
+            if self._limit_waits >= self._config['max_limit_waits']:
+                return False
+
+            self._limit_waits += 1
+            self._set_rate(self._rate * self._config['decrease'])
+            self._limited_rate = self._rate
+            self._cooldown_until = now + self._config['limit_cooldown']
+            self._bucket.pause(self._config['limit_cooldown'])
+            logger.warning(f"limit exceeded, rate lowered to {self._rate:.2f}/s, resume in "
+                           f"{self._config['limit_cooldown']}s ({self._limit_waits}/{self._config['max_limit_waits']})")
+            return True
+
+
+_endpoint_buckets: 'weakref.WeakKeyDictionary[requests.Session, typing.Dict[str, TokenBucket]]' = \
+    weakref.WeakKeyDictionary()
+_endpoint_buckets_lock = threading.Lock()
+
+
+def get_endpoint_bucket(session: requests.Session, group: str, limit: EndpointLimit) -> TokenBucket:
+    """同一个账号访问同一组接口的模块共用一个令牌桶"""
+    with _endpoint_buckets_lock:
+        buckets = _endpoint_buckets.setdefault(session, {})
+        bucket = buckets.get(group)
+        if bucket is None:
+            bucket = TokenBucket(limit.get('rate_per_sec', 1.0), limit.get('burst', 1))
+            buckets[group] = bucket
+        return bucket
+
+
+class PageEntry(typing.NamedTuple):
+    digest: bytes
+    entities: typing.List[typing.Dict[str, str]]
+    etag: typing.Optional[str]
+    last_modified: typing.Optional[str]
+
+
+class PageCache:
+    """
+    最近收集过的列表页面, 按 (模块, 页数) 保存响应内容的摘要, ETag/Last-Modified 和解析结果
+    内容和上次完全相同或者服务器返回 304 时直接使用上次的解析结果, 超过 max_size 时淘汰最久没有用过的页面
+    """
+    _max_size: int
+
+    def __init__(self, max_size: int = 64):
+        self._max_size = max_size
+        self._entries: 'collections.OrderedDict[typing.Tuple[str, int], PageEntry]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: typing.Tuple[str, int]) -> typing.Optional[PageEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def validators(self, key: typing.Tuple[str, int]) -> typing.Dict[str, str]:
+        """条件请求头, 服务器支持时内容没有变化会返回 304"""
+        entry = self._get(key)
+        headers = {}
+        if entry is not None and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry is not None and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def parse(self, key: typing.Tuple[str, int], resp: requests.Response,
+              parser: typing.Callable[[], typing.List[typing.Dict[str, str]]]) \
+            -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        """
+        返回页面的实体, 没有命中缓存时调用 parser 解析并保存, 返回的列表和字典都是副本, 可以随意修改
+        服务器返回 304 但缓存已经被淘汰时返回 None, 需要重新完整请求
+        """
+        if resp.status_code == 304:
+            return self.not_modified(key)
+
+        entry = self._get(key)
+        digest = hashlib.blake2b(resp.content, digest_size=16).digest()
+        if entry is not None and entry.digest == digest:
+            metrics.registry.inc('tieba_page_cache_total', module=key[0], result='hit')
+            return [dict(entity) for entity in entry.entities]
+        return self.store(key, digest, resp, parser())
+
+    def not_modified(self, key: typing.Tuple[str, int]) -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        """服务器返回 304 时上次的解析结果, 缓存已经被淘汰时返回 None"""
+        entry = self._get(key)
+        if entry is None:
+            return None
+        metrics.registry.inc('tieba_page_cache_total', module=key[0], result='not_modified')
+        return [dict(entity) for entity in entry.entities]
+
+    def store(self, key: typing.Tuple[str, int], digest: bytes, resp: requests.Response,
+              entities: typing.List[typing.Dict[str, str]]) -> typing.List[typing.Dict[str, str]]:
+        """保存新解析的页面, 返回 entities"""
+        metrics.registry.inc('tieba_page_cache_total', module=key[0], result='miss')
+        entry = PageEntry(digest, [dict(entity) for entity in entities],
+                          resp.headers.get('ETag'), resp.headers.get('Last-Modified'))
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+        return entities
+
+
+_page_caches: 'weakref.WeakKeyDictionary[requests.Session, PageCache]' = weakref.WeakKeyDictionary()
+_page_caches_lock = threading.Lock()
+
+
+def get_page_cache(session: requests.Session, max_size: int = 64) -> PageCache:
+    """同一个账号的模块共用一个页面缓存, 每次运行新建的模块也可以用上之前收集的结果"""
+    with _page_caches_lock:
+        cache = _page_caches.get(session)
+        if cache is None:
+            cache = PageCache(max_size)
+            _page_caches[session] = cache
+        return cache
+
+
+class Scheduler:
+    """删除任务调度器, submit 提交实体, wait 等待未完成的实体数降到指定数量以下"""
+
+    @abc.abstractmethod
+    def submit(self, entity: typing.Dict[str, str]):
+        raise NotImplementedError("")
+
+    @abc.abstractmethod
+    def pending(self) -> int:
+        raise NotImplementedError("")
+
+    @abc.abstractmethod
+    def wait(self, max_pending: int = 0):
+        raise NotImplementedError("")
+
+    @abc.abstractmethod
+    def close(self):
+        raise NotImplementedError("")
+
+    @abc.abstractmethod
+    def resize(self, concurrency: int):
+        raise NotImplementedError("")
+
+    def join(self):
+        self.wait(0)
+
+
+class ThreadPoolScheduler(Scheduler):
+    """线程池调度器, 每个工作线程一次最多从队列中取出 batch_size 个实体交给 handler"""
+    _handler: typing.Callable[[typing.List[typing.Dict[str, str]]], None]
+    _batch_size: int
+    _workers: typing.List[threading.Thread]
+
+    def __init__(self, handler: typing.Callable[[typing.List[typing.Dict[str, str]]], None],
+                 concurrency: int = 1, queue_size: int = 64, batch_size: int = 1):
+        self._handler = handler
+        self._batch_size = max(batch_size, 1)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = 0
+        self._pending_changed = threading.Condition()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+        self._concurrency = 0
+        self._retiring = 0  # 缩减线程数后还需要退出的线程数
+        self._started = 0
+        self.resize(concurrency)
+
+    def _take_batch(self) -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        entity = self._queue.get()
+        if entity is None:
+            return None
+
+        batch = [entity]
+        while len(batch) < self._batch_size:
+            try:
+                entity = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entity is None:
+                # 把退出标记放回去唤醒别的线程, 队列满时不用放回, 处理完这一批后会检查 _retiring
+                try:
+                    self._queue.put_nowait(None)
+                except queue.Full:
+                    pass
+                break
+            batch.append(entity)
+        return batch
+
+    def _retire(self) -> bool:
+        """还有需要退出的线程时由当前线程退出"""
+        with self._workers_lock:
+            if self._retiring <= 0:
+                return False
+            self._retiring -= 1
+            self._workers.remove(threading.current_thread())
+            return True
+
+    def _work(self):
+        while True:
+            if self._retire():
+                return
+            batch = self._take_batch()
+            if batch is None:
+                # 退出标记只用来唤醒空闲的线程, 对应的名额可能已经被别的线程用掉了
+                continue
+            try:
+                self._handler(batch)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                with self._pending_changed:
+                    self._pending -= len(batch)
+                    self._pending_changed.notify_all()
+
+    def submit(self, entity: typing.Dict[str, str]):
+        with self._pending_changed:
+            self._pending += 1
+        self._queue.put(entity)
+
+    def pending(self) -> int:
+        with self._pending_changed:
+            return self._pending
+
+    def wait(self, max_pending: int = 0):
+        with self._pending_changed:
+            self._pending_changed.wait_for(lambda: self._pending <= max_pending)
+
+    def close(self):
+        with self._workers_lock:
+            workers = list(self._workers)
+            self._concurrency = 0
+            self._retiring = len(workers)
+        for _ in workers:
+            # 队列满时没有空闲的线程需要唤醒, 正在处理的线程处理完手上的一批后会检查 _retiring
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in workers:
+            worker.join()
+
+    def resize(self, concurrency: int):
+        """
+        运行中调整工作线程数, 减少时多出的线程处理完手上的一批后退出
+        不会阻塞, 可以在图形界面的线程中调用
+        """
+        concurrency = max(concurrency, 1)
+        with self._workers_lock:
+            added = concurrency - self._concurrency
+            if added > 0:
+                # 先取消还没退出的线程, 不够再启动新的
+                kept = min(added, self._retiring)
+                self._retiring -= kept
+                added -= kept
+            for _ in range(added):
+                worker = threading.Thread(target=self._work, name=f'delete-worker-{self._started}', daemon=True)
+                self._started += 1
+                worker.start()
+                self._workers.append(worker)
+            removed = self._concurrency - concurrency
+            if removed > 0:
+                self._retiring += removed
+            self._concurrency = concurrency
+        # 放入退出标记唤醒空闲的线程, 队列满时所有线程都在忙, 取下一批之前会检查 _retiring
+        for _ in range(removed):
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+
+class AsyncioScheduler:
+    """ThreadPoolScheduler 的 asyncio 版本, 用协程代替工作线程, 只能在创建它的事件循环中使用"""
+    _handler: typing.Callable[[typing.List[typing.Dict[str, str]]], typing.Awaitable[None]]
+    _batch_size: int
+    _workers: typing.List['asyncio.Task[None]']
+
+    def __init__(self, handler: typing.Callable[[typing.List[typing.Dict[str, str]]], typing.Awaitable[None]],
+                 concurrency: int = 1, queue_size: int = 64, batch_size: int = 1):
+        self._handler = handler
+        self._batch_size = max(batch_size, 1)
+        self._queue = asyncio.Queue(maxsize=max(queue_size, concurrency))
+        self._pending = 0
+        self._pending_changed = asyncio.Condition()
+        self._workers = []
+        self._concurrency = 0
+        self.resize(concurrency)
+
+    async def _take_batch(self) -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        entity = await self._queue.get()
+        if entity is None:
+            return None
+
+        batch = [entity]
+        while len(batch) < self._batch_size:
+            try:
+                entity = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if entity is None:
+                self._queue.put_nowait(None)
+                break
+            batch.append(entity)
+        return batch
+
+    async def _work(self):
+        while True:
+            batch = await self._take_batch()
+            if batch is None:
+                self._workers.remove(asyncio.current_task())
+                return
+            try:
+                await self._handler(batch)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                async with self._pending_changed:
+                    self._pending -= len(batch)
+                    self._pending_changed.notify_all()
+
+    async def submit(self, entity: typing.Dict[str, str]):
+        self._pending += 1
+        await self._queue.put(entity)
+
+    def pending(self) -> int:
+        return self._pending
+
+    async def wait(self, max_pending: int = 0):
+        async with self._pending_changed:
+            await self._pending_changed.wait_for(lambda: self._pending <= max_pending)
+
+    async def join(self):
+        await self.wait(0)
+
+    async def close(self):
+        workers = list(self._workers)
+        self._concurrency = 0
+        for _ in workers:
+            await self._queue.put(None)
+        await asyncio.gather(*workers)
+
+    def resize(self, concurrency: int):
+        concurrency = max(concurrency, 1)
+        for _ in range(concurrency - self._concurrency):
+            self._workers.append(asyncio.ensure_future(self._work()))
+        for _ in range(self._concurrency - concurrency):
+            asyncio.ensure_future(self._queue.put(None))
+        self._concurrency = concurrency
+
+
+def _class_xpath(tag: str, class_name: str) -> lxml.etree.XPath:
+    # 和 BeautifulSoup 的 class 匹配规则一致, class 中任意一项相同即可
+    return lxml.etree.XPath(f"//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_name} ')]")
+
+
+_thread_title_xpath = _class_xpath("a", "thread_title")
+_reply_xpath = _class_xpath("a", "b_reply")
+_span_xpath = lxml.etree.XPath("//span")
+_unfollow_xpath = _class_xpath("input", "btn_unfollow")
+_follow_xpath = _class_xpath("input", "btn_follow")
+
+_tid_exp = re.compile(r"/([0-9]+)")
+_pid_exp = re.compile(r"pid=([0-9]+)")  # 主题贴和回复都为 pid
+_cid_exp = re.compile(r"cid=([0-9]+)")  # 楼中楼为 cid
+_fan_tbs_exp = re.compile(rb"tbs : '([0-9a-zA-Z]{16})'")  # 居然还有一个短版 tbs.... 绝了
+
+# 建立索引用的吧名, 时间和标题, 只在同一条记录的容器内查找, 找不到时为空字符串
+_container_xpath = lxml.etree.XPath(
+    "ancestor::div[contains(concat(' ', normalize-space(@class), ' '), ' simple_block_container ')][1]")
+_forum_link_xpath = lxml.etree.XPath(".//a[starts-with(@href, '/f?kw=')]")
+_time_xpath = lxml.etree.XPath(".//span[contains(@class, 'time') or contains(@class, 'date')]")
+_reply_content_xpath = lxml.etree.XPath(".//div[contains(@class, 'reply_content')]")
+
+_full_time_exp = re.compile(r"(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?(?:\s*(\d{1,2}):(\d{2}))?")
+_short_time_exp = re.compile(r"(\d{1,2})[-/.月](\d{1,2})日?(?:\s*(\d{1,2}):(\d{2}))?")
+_clock_time_exp = re.compile(r"^(\d{1,2}):(\d{2})$")
+
+index_fields = ('forum', 'time', 'title')  # 只用于索引和筛选, 删除时不提交
+title_length = 60
+stream_chunk_size = 16 * 1024  # stream_pages 时每次读取的字节数
+
+_html_parsers: typing.Dict[typing.Optional[str], lxml.etree.HTMLParser] = {}
+
+
+def _parse_html(content: bytes, encoding: typing.Optional[str] = None) -> typing.Optional[lxml.etree._Element]:
+    """解析页面, 没有指定编码时由 lxml 根据 meta 自行判断"""
+    parser = _html_parsers.get(encoding)
+    if parser is None:
+        parser = _html_parsers.setdefault(encoding, lxml.etree.HTMLParser(encoding=encoding))
+    return lxml.etree.fromstring(content, parser) if content.strip() else None
+
+
+def _response_encoding(resp: requests.Response) -> typing.Optional[str]:
+    # 响应头里没有声明 charset 时 requests 会默认 ISO-8859-1, 这种情况交给 lxml 自己判断
+    if 'charset' in resp.headers.get('Content-Type', '').lower():
+        return resp.encoding
+    return None
+
+
+def _iter_body(resp: requests.Response, chunk_size: int = stream_chunk_size) -> typing.Iterator[bytes]:
+    """逐块读取 stream=True 的响应内容, HttpxSession 返回的 httpx 响应没有 iter_content"""
+    if isinstance(resp, requests.Response):
+        return resp.iter_content(chunk_size)
+    return resp.iter_bytes(chunk_size)
+
+
+def normalize_time(text: str, now: typing.Optional[time.struct_time] = None) -> str:
+    """把页面上的时间统一成 YYYY-MM-DD HH:MM, 省略的年份和日期按 now 补全, 无法识别时为空字符串"""
+    text = text.strip()
+    now = now or time.localtime()
+    match = _full_time_exp.search(text)
+    if match:
+        year, month, day, hour, minute = match.groups()
+    else:
+        match = _short_time_exp.search(text)
+        if match:
+            year, (month, day, hour, minute) = now.tm_year, match.groups()
+        else:
+            match = _clock_time_exp.match(text)
+            if not match:
+                return ''
+            year, month, day, (hour, minute) = now.tm_year, now.tm_mon, now.tm_mday, match.groups()
+    return f'{int(year):04d}-{int(month):02d}-{int(day):02d} {int(hour or 0):02d}:{int(minute or 0):02d}'
+
+
+def _element_text(element: lxml.etree._Element) -> str:
+    return ' '.join(''.join(element.itertext()).split())
+
+
+def _entity_container(element: lxml.etree._Element) -> typing.Optional[lxml.etree._Element]:
+    """实体所在的记录, 没有记录容器时为父元素"""
+    container = _container_xpath(element)
+    return container[0] if container else element.getparent()
+
+
+def _entity_meta(element: lxml.etree._Element, title: str) -> typing.Dict[str, str]:
+    """从实体所在的记录中找出吧名和时间, title 截取前 title_length 个字符"""
+    container = _entity_container(element)
+    forum, when = '', ''
+    if container is not None:
+        links = _forum_link_xpath(container)
+        if links:
+            query = urllib.parse.urlsplit(links[0].get('href')).query
+            forum = urllib.parse.parse_qs(query).get('kw', [''])[0] or _element_text(links[0])
+        times = _time_xpath(container)
+        if times:
+            when = normalize_time(_element_text(times[0]))
+    return {'forum': forum, 'time': when, 'title': title[:title_length]}
+
+
+def _thread_entity(element: lxml.etree._Element) -> typing.Optional[typing.Dict[str, str]]:
+    thread = element.get("href")
+    thread_dict = dict()
+    thread_dict["tid"] = _tid_exp.findall(thread)[0]
+    thread_dict["pid"] = _pid_exp.findall(thread)[0]
+    thread_dict.update(_entity_meta(element, element.get("title") or _element_text(element)))
+    return thread_dict
+
+
+def _reply_entity(element: lxml.etree._Element) -> typing.Optional[typing.Dict[str, str]]:
+    reply = element.get("href")
+    if reply.find("pid") == -1:
+        return None
+
+    tid = _tid_exp.findall(reply)
+    pid = _pid_exp.findall(reply)
+    cid = _cid_exp.findall(reply)
+    reply_dict = dict()
+    reply_dict["tid"] = tid[0]
+
+    if cid and cid[0] != "0":  # 如果 cid != 0, 这个回复是楼中楼, 否则是一整楼的回复
+        reply_dict["pid"] = cid[0]
+    else:
+        reply_dict["pid"] = pid[0]
+
+    container = _container_xpath(element)
+    content_element = _reply_content_xpath(container[0]) if container else []
+    reply_dict.update(_entity_meta(element, _element_text(content_element[0]) if content_element else ''))
+    return reply_dict
+
+
+def _followed_ba_entity(element: lxml.etree._Element) -> typing.Optional[typing.Dict[str, str]]:
+    ba_dict = dict()
+    ba_dict["fid"] = element.get("balvid")
+    ba_dict["tbs"] = element.get("tbs")
+    ba_dict["fname"] = element.get("balvname")
+    ba_dict.update(forum=ba_dict["fname"] or '', time='', title=ba_dict["fname"] or '')
+    return ba_dict
+
+
+def _concern_entity(element: lxml.etree._Element) -> typing.Optional[typing.Dict[str, str]]:
+    concern_dict = dict()
+    concern_dict["cmd"] = "unfollow"
+    concern_dict["tbs"] = element.get("tbs")
+    concern_dict["id"] = element.get("portrait")
+    return concern_dict
+
+
+def _fan_entity(element: lxml.etree._Element, tbs: str = '') -> typing.Optional[typing.Dict[str, str]]:
+    fan_dict = dict()
+    fan_dict["cmd"] = "add_black_list"
+    fan_dict["tbs"] = tbs
+    fan_dict["portrait"] = element.get("portrait")
+    return fan_dict
+
+
+def _extract(elements: typing.Iterable[lxml.etree._Element],
+             extractor: typing.Callable[[lxml.etree._Element], typing.Optional[typing.Dict[str, str]]]) \
+        -> typing.List[typing.Dict[str, str]]:
+    return [entity for entity in map(extractor, elements) if entity is not None]
+
+
+def parse_thread_page(content: bytes, encoding: typing.Optional[str] = None) -> typing.List[typing.Dict[str, str]]:
+    html = _parse_html(content, encoding)
+    return _extract(_thread_title_xpath(html), _thread_entity) if html is not None else []
+
+
+def parse_reply_page(content: bytes, encoding: typing.Optional[str] = None) -> typing.List[typing.Dict[str, str]]:
+    html = _parse_html(content, encoding)
+    return _extract(_reply_xpath(html), _reply_entity) if html is not None else []
+
+
+def parse_followed_ba_page(content: bytes, encoding: typing.Optional[str] = None) -> typing.List[typing.Dict[str, str]]:
+    html = _parse_html(content, encoding)
+    return _extract(_span_xpath(html), _followed_ba_entity) if html is not None else []
+
+
+def parse_concern_page(content: bytes, encoding: typing.Optional[str] = None) -> typing.List[typing.Dict[str, str]]:
+    html = _parse_html(content, encoding)
+    return _extract(_unfollow_xpath(html), _concern_entity) if html is not None else []
+
+
+def parse_fan_page(content: bytes, encoding: typing.Optional[str] = None) -> typing.List[typing.Dict[str, str]]:
+    match = _fan_tbs_exp.search(content)
+    if match is None:
+        raise ValueError('tbs not found in fan page')
+    tbs = match.group(1).decode()
+    html = _parse_html(content, encoding)
+    return _extract(_follow_xpath(html), lambda element: _fan_entity(element, tbs)) if html is not None else []
+
+
+class PageStream:
+    """
+    边下载边解析列表页面, feed 传入收到的数据, close 返回页面中的实体
+    实体元素按 _class_xpath 相同的规则在开始标签处匹配 (嵌套时和 XPath 一样按文档顺序),
+    所在的记录 (_entity_container) 结束后立即提取, 然后清空这条记录和之前的兄弟元素,
+    同时只保留还没处理完的记录, 内存占用不随页面大小增长
+    """
+    _tag: str
+    _class_name: typing.Optional[str]
+
+    def __init__(self, tag: str, class_name: typing.Optional[str],
+                 extractor: typing.Callable[[lxml.etree._Element], typing.Optional[typing.Dict[str, str]]],
+                 encoding: typing.Optional[str] = None):
+        self._tag = tag
+        self._class_name = class_name
+        self._extractor = extractor
+        self._parser = lxml.etree.HTMLPullParser(events=('start', 'end'), encoding=encoding)
+        # 匹配到的实体元素, 所在的记录, 记录是否已经结束
+        self._pending: typing.List[typing.Tuple[lxml.etree._Element, typing.Optional[lxml.etree._Element], bool]] = []
+        self._entities: typing.List[typing.Dict[str, str]] = []
+        self._hash = hashlib.blake2b(digest_size=16)
+        self._empty = True
+
+    def _matches(self, element: lxml.etree._Element) -> bool:
+        if element.tag != self._tag:
+            return False
+        return self._class_name is None or self._class_name in (element.get('class') or '').split()
+
+    def _flush(self, pending: typing.List[typing.Tuple[lxml.etree._Element, typing.Optional[lxml.etree._Element], bool]]):
+        for element, _, _ in pending:
+            entity = self._extractor(element)
+            if entity is not None:
+                self._entities.append(entity)
+
+    def _release(self, element: lxml.etree._Element):
+        # 和 iterparse 的常见做法相同, 处理完的元素连同之前的兄弟元素一起删除
+        element.clear(keep_tail=True)
+        parent = element.getparent()
+        if parent is not None:
+            while element.getprevious() is not None:
+                del parent[0]
+
+    def _drain(self):
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if self._matches(element):
+                    self._pending.append((element, _entity_container(element), False))
+                continue
+
+            if element.tag in ('script', 'style'):
+                element.clear(keep_tail=True)
+            elif self._pending and any(container is element for _, container, _ in self._pending):
+                self._pending = [(item, container, finished or container is element)
+                                 for item, container, finished in self._pending]
+                # 嵌套的记录可能比前面的记录先结束, 只提取前面已经结束的部分, 保持文档顺序
+                done = 0
+                while done < len(self._pending) and self._pending[done][2]:
+                    done += 1
+                self._flush(self._pending[:done])
+                self._pending = self._pending[done:]
+                if not self._pending:
+                    self._release(element)
+
+    def feed(self, chunk: bytes):
+        if not chunk:
+            return
+        self._hash.update(chunk)
+        if self._empty:
+            if not chunk.strip():
+                return
+            self._empty = False
+        self._parser.feed(chunk)
+        self._drain()
+
+    def close(self) -> typing.List[typing.Dict[str, str]]:
+        if not self._empty:
+            self._parser.close()
+            self._drain()
+            # 没有容器的实体 (根元素) 在页面结束后提取
+            self._flush(self._pending)
+            self._pending = []
+        return self._entities
+
+    def digest(self) -> bytes:
+        """已经读取的内容的摘要, 和 PageCache 对完整内容计算的摘要相同"""
+        return self._hash.digest()
+
+
+class FanPageStream(PageStream):
+    """粉丝页面还需要在原始内容中找出短版 tbs, 只保留上一块数据的末尾用来匹配跨块的 tbs"""
+    _tail_size = 64
+
+    def __init__(self, encoding: typing.Optional[str] = None):
+        super().__init__('input', 'btn_follow', _fan_entity, encoding)
+        self._tbs: typing.Optional[str] = None
+        self._tail = b''
+
+    def feed(self, chunk: bytes):
+        if self._tbs is None:
+            window = self._tail + chunk
+            match = _fan_tbs_exp.search(window)
+            if match:
+                self._tbs = match.group(1).decode()
+            self._tail = window[-self._tail_size:]
+        super().feed(chunk)
+
+    def close(self) -> typing.List[typing.Dict[str, str]]:
+        fan_list = super().close()
+        if self._tbs is None:
+            raise ValueError('tbs not found in fan page')
+        for fan_dict in fan_list:
+            fan_dict["tbs"] = self._tbs
+        return fan_list
+
+
+def thread_page_stream(encoding: typing.Optional[str] = None) -> PageStream:
+    return PageStream('a', 'thread_title', _thread_entity, encoding)
+
+
+def reply_page_stream(encoding: typing.Optional[str] = None) -> PageStream:
+    return PageStream('a', 'b_reply', _reply_entity, encoding)
+
+
+def followed_ba_page_stream(encoding: typing.Optional[str] = None) -> PageStream:
+    return PageStream('span', None, _followed_ba_entity, encoding)
+
+
+def concern_page_stream(encoding: typing.Optional[str] = None) -> PageStream:
+    return PageStream('input', 'btn_unfollow', _concern_entity, encoding)
+
+
+def fan_page_stream(encoding: typing.Optional[str] = None) -> PageStream:
+    return FanPageStream(encoding)
+
+
+def _filter_date(value: str) -> str:
+    """筛选条件中的日期可以只写年或年月, 补全成和 normalize_time 相同的格式用于比较"""
+    match = re.fullmatch(r"(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?", value)
+    if not match:
+        raise ValueError(f'invalid date in filter: {value!r}, expected YYYY, YYYY-MM or YYYY-MM-DD')
+    year, month, day = match.groups()
+    return f'{int(year):04d}-{int(month or 1):02d}-{int(day or 1):02d} 00:00'
+
+
+class EntityFilter(typing.NamedTuple):
+    """
+    按吧名, 时间和标题关键词选择要删除的实体, 同一类条件之间为或, 不同类条件之间为且
+    before/after 为 normalize_time 格式, 设置了时间条件时没有时间的实体不会被选中
+    """
+    forums: typing.Tuple[str, ...] = ()
+    keywords: typing.Tuple[str, ...] = ()
+    before: str = ''
+    after: str = ''
+
+    def matches(self, entity: typing.Dict[str, str]) -> bool:
+        if self.forums and entity.get('forum', '') not in self.forums:
+            return False
+        if self.keywords and not any(keyword in entity.get('title', '') for keyword in self.keywords):
+            return False
+        when = entity.get('time', '')
+        if (self.before or self.after) and not when:
+            return False
+        if self.before and when >= self.before:
+            return False
+        if self.after and when < self.after:
+            return False
+        return True
+
+    def to_sql(self) -> typing.Tuple[str, typing.List[str]]:
+        """和 matches 相同的条件, 用于查询 entity 表"""
+        clauses, params = [], []
+        if self.forums:
+            clauses.append(f"forum IN ({', '.join('?' * len(self.forums))})")
+            params.extend(self.forums)
+        if self.keywords:
+            clauses.append('(' + ' OR '.join("instr(title, ?) > 0" for _ in self.keywords) + ')')
+            params.extend(self.keywords)
+        if self.before or self.after:
+            clauses.append("time != ''")
+        if self.before:
+            clauses.append('time < ?')
+            params.append(self.before)
+        if self.after:
+            clauses.append('time >= ?')
+            params.append(self.after)
+        return ' AND '.join(clauses) or '1', params
+
+
+def parse_filter(expression: str) -> typing.Optional[EntityFilter]:
+    """
+    解析筛选表达式, 由空格分隔的 key:value 组成, 例如 'forum:某某吧 before:2020 keyword:"两个 词"'
+    forum 和 keyword 可以重复, before 不包含当天, after 包含当天, 表达式为空时返回 None
+    """
+    forums, keywords, before, after = [], [], '', ''
+    for term in shlex.split(expression or ''):
+        key, sep, value = term.partition(':')
+        if not sep or not value:
+            raise ValueError(f'invalid filter term: {term!r}, expected key:value')
+        if key == 'forum':
+            forums.append(value)
+        elif key == 'keyword':
+            keywords.append(value)
+        elif key == 'before':
+            before = _filter_date(value)
+        elif key == 'after':
+            after = _filter_date(value)
+        else:
+            raise ValueError(f'unknown filter key: {key!r}, expected forum, keyword, before or after')
+    entity_filter = EntityFilter(tuple(forums), tuple(keywords), before, after)
+    return entity_filter if entity_filter != EntityFilter() else None
+
+
+class ProgressJournal:
+    """
+    记录已经删除的实体和最后一次有新实体的页数, 中断后可以直接从上次的位置继续
+    收集到的实体同时写入 entity 表, 之后可以按吧名和时间直接查询, 不需要重新逐页收集
+    """
+    _path: str
+    _conn: sqlite3.Connection
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS deleted ('
+                               'account TEXT NOT NULL, module TEXT NOT NULL, entity TEXT NOT NULL, '
+                               'deleted_at REAL NOT NULL, PRIMARY KEY (account, module, entity)) WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS progress ('
+                               'account TEXT NOT NULL, module TEXT NOT NULL, page INTEGER NOT NULL, '
+                               'updated_at REAL NOT NULL, PRIMARY KEY (account, module)) WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS rate ('
+                               'account TEXT NOT NULL, endpoint TEXT NOT NULL, rate REAL NOT NULL, '
+                               'updated_at REAL NOT NULL, PRIMARY KEY (account, endpoint)) WITHOUT ROWID')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS entity ('
+                               'account TEXT NOT NULL, module TEXT NOT NULL, entity TEXT NOT NULL, '
+                               "forum TEXT NOT NULL DEFAULT '', time TEXT NOT NULL DEFAULT '', "
+                               "title TEXT NOT NULL DEFAULT '', data TEXT NOT NULL, collected_at REAL NOT NULL, "
+                               'PRIMARY KEY (account, module, entity)) WITHOUT ROWID')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entity_forum ON entity (account, module, forum)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS entity_time ON entity (account, module, time)')
+
+    def deleted(self, account: str, module: str) -> typing.Set[str]:
+        with self._lock:
+            rows = self._conn.execute('SELECT entity FROM deleted WHERE account = ? AND module = ?', (account, module))
+            return {row[0] for row in rows}
+
+    def is_deleted(self, account: str, module: str, entity: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM deleted WHERE account = ? AND module = ? AND entity = ?',
+                                      (account, module, entity)).fetchone() is not None
+
+    def record_deleted(self, account: str, module: str, entity: str):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR IGNORE INTO deleted VALUES (?, ?, ?, ?)', (account, module, entity, time.time()))
+
+    def last_page(self, account: str, module: str) -> typing.Optional[int]:
+        with self._lock:
+            row = self._conn.execute('SELECT page FROM progress WHERE account = ? AND module = ?',
+                                     (account, module)).fetchone()
+            return row[0] if row else None
+
+    def record_page(self, account: str, module: str, page: typing.Optional[int]):
+        with self._lock, self._conn:
+            if page is None:
+                self._conn.execute('DELETE FROM progress WHERE account = ? AND module = ?', (account, module))
+            else:
+                self._conn.execute('INSERT OR REPLACE INTO progress VALUES (?, ?, ?, ?)',
+                                   (account, module, page, time.time()))
+
+    def finish(self, account: str, module: str):
+        """
+        模块已经全部删除干净, 清除进度和删除记录, 之后重新关注的吧和用户不会被当成已经删除
+        索引中已经删除的实体一起清除, 避免 --from-index 再次选中
+        """
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM entity WHERE account = ? AND module = ? AND entity IN ('
+                               'SELECT entity FROM deleted WHERE account = ? AND module = ?)',
+                               (account, module, account, module))
+            self._conn.execute('DELETE FROM deleted WHERE account = ? AND module = ?', (account, module))
+            self._conn.execute('DELETE FROM progress WHERE account = ? AND module = ?', (account, module))
+
+    def forget_deleted(self, account: str, module: str, entities: typing.List[str]):
+        """列表中又出现的实体不再视为已经删除"""
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM deleted WHERE account = ? AND module = ? AND entity = ?',
+                                   [(account, module, entity) for entity in entities])
+
+    def learned_rate(self, account: str, endpoint: str) -> typing.Optional[float]:
+        with self._lock:
+            row = self._conn.execute('SELECT rate FROM rate WHERE account = ? AND endpoint = ?',
+                                     (account, endpoint)).fetchone()
+            return row[0] if row else None
+
+    def record_rate(self, account: str, endpoint: str, rate: float):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO rate VALUES (?, ?, ?, ?)', (account, endpoint, rate, time.time()))
+
+    def index_entities(self, account: str, module: str, entities: typing.List[typing.Tuple[str, typing.Dict[str, str]]]):
+        """保存收集到的 (key, 实体), tbs 很快会失效, 不保存"""
+        now = time.time()
+        rows = [(account, module, key, entity.get('forum', ''), entity.get('time', ''), entity.get('title', ''),
+                 json.dumps({k: v for k, v in entity.items() if k != 'tbs'}, ensure_ascii=False), now)
+                for key, entity in entities]
+        with self._lock, self._conn:
+            self._conn.executemany('INSERT OR REPLACE INTO entity VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def indexed(self, account: str, module: str,
+                entity_filter: typing.Optional[EntityFilter] = None) -> typing.List[typing.Dict[str, str]]:
+        """查询索引中还没有删除的实体, 按时间从旧到新排列"""
+        where, params = (entity_filter or EntityFilter()).to_sql()
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT data FROM entity e WHERE account = ? AND module = ? AND NOT EXISTS ('
+                'SELECT 1 FROM deleted d WHERE d.account = e.account AND d.module = e.module AND d.entity = e.entity) '
+                f'AND {where} ORDER BY time', [account, module, *params]).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def flush(self):
+        """把 WAL 中的记录写回数据库文件, 中断前调用"""
+        with self._lock:
+            self._conn.execute('PRAGMA wal_checkpoint(PASSIVE)')
+
+
+_journals: typing.Dict[str, ProgressJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def open_journal(path: str) -> ProgressJournal:
+    # 同一个文件只打开一次, 多个模块共用同一个连接
+    with _journals_lock:
+        journal = _journals.get(path)
+        if journal is None:
+            journal = ProgressJournal(path)
+            _journals[path] = journal
+        return journal
+
+
+def account_id(session: requests.Session) -> str:
+    """用 BDUSS 的摘要区分账号, 日志中不保存 Cookie 本身"""
+    bduss = session.cookies.get('BDUSS') or ';'.join(sorted(f'{k}={v}' for k, v in session.cookies.items()))
+    return hashlib.sha256(bduss.encode()).hexdigest()[:16]
+
+
+class ProgressEvent(typing.NamedTuple):
+    """模块的运行进度, found 为目前收集到的待删除实体数, 后面的页面还没收集时会继续增加"""
+    module: str
+    page: int
+    found: int
+    deleted: int
+    failed: int
+    rate: float
+    finished: bool
+
+    @property
+    def remaining(self) -> int:
+        return max(self.found - self.deleted - self.failed, 0)
+
+    @property
+    def eta(self) -> typing.Optional[float]:
+        """按当前速度删除完已收集实体还需要的秒数, 还没有速度时为 None"""
+        if self.rate <= 0:
+            return None
+        return self.remaining / self.rate
+
+
+ProgressCallback = typing.Callable[[ProgressEvent], None]
+
+
+class ModuleResult(typing.NamedTuple):
+    """
+    模块的运行结果, status 为:
+    disabled: 没有启用; finished: 全部删除干净; stopped: 达到上限或错误次数; cancelled: 被取消
+    """
+    module: str
+    status: str
+    deleted: int
+    failed: int
+    page: int
+
+    @property
+    def ok(self) -> bool:
+        return self.status in ('disabled', 'finished')
+
+
 class Module:
     _name: str
     _session: requests.Session
     _config: GlobalConfig
     _module_config: ModuleConfig
     _max_error_count: int
+    _bucket: TokenBucket
+    _buckets: typing.List[TokenBucket]
+    _key_type: typing.Type[EntityKey]
+    _endpoint_group: str
+    _list_path: str
+    _delete_path: str
+    _with_tbs = False  # 删除时是否需要带上 tbs
+    _parse_page: typing.Callable[[bytes, typing.Optional[str]], typing.List[typing.Dict[str, str]]]
+    _page_stream: typing.Callable[[typing.Optional[str]], PageStream]
 
     def __init__(self, name: str, session: requests.Session, config: GlobalConfig):
         self._name = name
         self._session = session
         self._config = config
+        self._base_url = self._config.get('base_url', default_base_url)
         self._module_config = self._config.get(self._name, default_module_config)
         self._max_error_count = self._module_config.get('max_error_count', 3)
+        self._bucket = TokenBucket(self._module_config.get('rate_per_sec', 1.0), self._module_config.get('burst', 1))
+        self._buckets = [self._bucket]
+
+        self._endpoint_bucket: typing.Optional[TokenBucket] = None
+        endpoint_limit = self._config.get('endpoint_limits', {}).get(self._endpoint_group)
+        if endpoint_limit is not None and self._config.get('parallel_modules', False):
+            # 同时运行的模块如果访问同一组接口, 还要共同遵守这组接口的限速, 顺序运行时只受 rate_per_sec 限制
+            self._endpoint_bucket = get_endpoint_bucket(self._session, self._endpoint_group, endpoint_limit)
+            self._buckets.append(self._endpoint_bucket)
+
+        self._state_lock = threading.Lock()
+        self._error_count = 0
+        self._stopped = False
+        self._deleted_count = 0
+        self._failed_count = 0
+        self._rate_meter = metrics.RateMeter()
+
+        self._concurrency = self._module_config.get('concurrency', 1)
+        self._scheduler: typing.Optional[Scheduler] = None
+        self._progress_callback: typing.Optional[ProgressCallback] = None
+        self._current_page = self._module_config.get('start_page', 1)
+        self._found_count = 0
+        self._finished = False
+        self._cancel_token = CancellationToken()
+        self._client: typing.Optional['httpx.AsyncClient'] = None  # 只在 run_async 中使用
+
+        journal_file = self._config.get('journal_file', '')
+        self._journal = open_journal(journal_file) if journal_file else None
+        self._account = account_id(self._session)
+        self._filter = parse_filter(self._config.get('filter', ''))
+        self._max_pages = self._module_config.get('max_pages', 0)
+        self._work_tbs: typing.Optional[str] = None  # delete_entity 使用的页面 tbs
+        self._work_tbs_at = 0.0
+        self._work_tbs_lock = threading.Lock()
+        self._tbs_unrelated_errors: typing.Set[int] = set()  # 换了 tbs 也一样失败的错误码
+
+        page_cache_size = self._config.get('page_cache_size', 64)
+        self._page_cache = get_page_cache(self._session, page_cache_size) if page_cache_size > 0 else None
+        self._stream_pages = self._config.get('stream_pages', False)
+
+        self._adaptive: typing.Optional[AdaptiveRate] = None
+        self._retry: typing.List[typing.Dict[str, str]] = []  # 暂停前遇到上限的实体, 恢复后重新删除
+        adaptive_config: AdaptiveConfig = {**default_adaptive_config, **self._config.get('adaptive', {})}
+        if adaptive_config['enable']:
+            rate = self._module_config.get('rate_per_sec', 1.0)
+            learned = None
+            if self._journal is not None and adaptive_config['resume_learned']:
+                # 从上次运行学到的速度开始, 同一组接口的上限相同
+                learned = self._journal.learned_rate(self._account, self._endpoint_group)
+            if learned is not None:
+                logger.info(f'[{self._name}] starting from learned rate {learned:.2f}/s instead of rate_per_sec {rate}')
+                rate = learned
+            self._adaptive = AdaptiveRate(self._name, self._bucket, adaptive_config, rate)
 
     @property
     def session(self):
         return self._session
 
-    def _get_tbs(self):
-        success = False
-        resp = None
-        while not success:
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def enabled(self) -> bool:
+        return self._module_config.get('enable', False)
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped
+
+    @property
+    def deleted_count(self) -> int:
+        return self._deleted_count
+
+    @property
+    def failed_count(self) -> int:
+        return self._failed_count
+
+    def set_progress_callback(self, callback: typing.Optional[ProgressCallback]):
+        """callback 会在收集线程和删除线程中调用, 需要自己保证线程安全"""
+        self._progress_callback = callback
+
+    def progress(self) -> ProgressEvent:
+        with self._state_lock:
+            return ProgressEvent(self._name, self._current_page, self._found_count, self._deleted_count,
+                                 self._failed_count, self._rate_meter.rate(), self._finished)
+
+    def _emit_progress(self):
+        if self._progress_callback is not None:
             try:
-                resp = self._session.get("https://tieba.baidu.com/dc/common/tbs", timeout=5)
-                success = True
+                self._progress_callback(self.progress())
             except Exception:
                 traceback.print_exc()
 
-        tbs = resp.json()["tbs"]
-        return tbs
+    def set_rate(self, rate_per_sec: float, burst: typing.Optional[int] = None):
+        """运行中调整本模块的删除速度, 同时运行时 endpoint_limits 中这组接口的共同限速也改为这个速度"""
+        self._bucket.set_rate(rate_per_sec, burst)
+        if self._endpoint_bucket is not None:
+            self._endpoint_bucket.set_rate(rate_per_sec, burst)
+        if self._adaptive is not None:
+            self._adaptive.set_rate(rate_per_sec)
+        logger.info(f'module [{self._name}] rate changed to {rate_per_sec}/s')
+
+    def set_concurrency(self, concurrency: int):
+        """运行中调整删除线程数"""
+        self._concurrency = max(concurrency, 1)
+        scheduler = self._scheduler
+        if scheduler is not None:
+            scheduler.resize(self._concurrency)
+        logger.info(f'module [{self._name}] concurrency changed to {self._concurrency}')
+
+    def _url(self, path: str) -> str:
+        return self._base_url + path
+
+    @staticmethod
+    def _form(entity: typing.Dict[str, str]) -> typing.Dict[str, str]:
+        """删除时提交的表单, 去掉只用于索引的字段"""
+        return {k: v for k, v in entity.items() if k not in index_fields}
+
+    def _get_tbs(self) -> str:
+        return get_tbs_cache(self._session, self._config.get('tbs_ttl', 300), self._base_url).get()
+
+    def _post_with_tbs(self, url: str, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
+        """带上缓存的 tbs 提交, tbs 被拒绝时刷新一次再重试"""
+        resp, err_code = None, None
+        for attempt in range(2):
+            post_data = dict(self._form(entity), tbs=self._get_tbs())
+            resp = self._session.post(url, data=post_data)
+            err_code = self._tbs_result(attempt, err_code, resp.json()["err_code"])
+            if not self._refresh_tbs(attempt, post_data["tbs"], err_code):
+                break
+
+        return resp, err_code == 220034
+
+    def _tbs_result(self, attempt: int, previous: typing.Optional[int], err_code: int) -> int:
+        if attempt > 0 and err_code == previous and err_code not in (0, 220034):
+            # 换了新的 tbs 还是同样的错误, 以后遇到这个错误码不再刷新 tbs
+            self._tbs_unrelated_errors.add(err_code)
+        return err_code
+
+    def _refresh_tbs(self, attempt: int, tbs: str, err_code: int) -> bool:
+        """
+        删除失败时判断是不是 tbs 被拒绝, 是的话作废缓存, 返回 True 用新的 tbs 再试一次
+        刚获取的 tbs 被拒绝, 或者这个错误码之前换了 tbs 也没用, 说明是已经删除, 没有权限等和 tbs 无关的错误,
+        不再重试, 也不作废其他线程正在用的 tbs
+        """
+        if attempt > 0 or err_code in (0, 220034) or err_code in self._tbs_unrelated_errors:
+            return False
+        cache = get_tbs_cache(self._session)
+        if cache.is_fresh(tbs, tbs_fresh_seconds):
+            return False
+        cache.invalidate(tbs)
+        return True
+
+    def _create_scheduler(self) -> Scheduler:
+        return ThreadPoolScheduler(self._handle_batch, self._concurrency,
+                                   batch_size=self._module_config.get('batch_size', 1))
+
+    def _handle_batch(self, entities: typing.List[typing.Dict[str, str]]):
+        """在工作线程中删除一批实体, 并把每个实体的结果分别计入进度和错误计数"""
+        if self._stopped or self._cancel_token.cancelled:
+            # 已经决定停止, 剩下排队的实体不再删除
+            return
+
+        results = self._delete_batch(entities)
+        for entity, (resp, stop) in zip(entities, results):
+            self._handle_result(entity, resp, stop)
+        self._requeue(entities[len(results):])
+
+    def _requeue(self, entities: typing.List[typing.Dict[str, str]]):
+        """
+        一批中没有结果的实体还没有处理过, 放回 _retry 之后重新提交
+        这些实体已经加入 deleted_entity, 逐页收集时不会再出现, 停止或取消后 _take_retry 会直接丢弃
+        """
+        if entities:
+            with self._state_lock:
+                self._retry.extend(entities)
+
+    def _handle_result(self, entity: typing.Dict[str, str], resp: typing.Optional[requests.Response],
+                       stop: bool) -> str:
+        """返回 deleted, retry (遇到上限, adaptive 暂停后重新删除), limited (遇到上限) 或 failed"""
+        success = False
+        # 处理响应，解码错误信息
+        if resp is not None:
+            try:
+                response_json = resp.json()
+                if response_json.get('no') == 0:
+                    logger.info(f"Successfully deleted: {self._entity_key(entity)}")
+                    success = True
+                else:
+                    logger.error(f"Failed to delete: {self._entity_key(entity)},  full response: {response_json}")
+            except json.JSONDecodeError:
+                logger.error(f"Failed to parse response for: {self._entity_key(entity)}, response: {resp.text}")
+        else:
+            logger.error(f"Failed to delete: {self._entity_key(entity)}, no response received.")
+
+        metrics.registry.inc('tieba_deletes_total', module=self._name, result='success' if success else 'failure')
+        if stop:
+            metrics.registry.inc('tieba_limit_hits_total', module=self._name)
+        if success:
+            self._rate_meter.mark()
+        metrics.registry.set('tieba_delete_rate', self._rate_meter.rate(), module=self._name)
+
+        # 开启 adaptive 时遇到上限先暂停, 恢复后重新删除这个实体, 不计入错误
+        retry = stop and self._adaptive is not None and self._adaptive.on_limit()
+        if retry:
+            stop = False
+        limited = stop
+
+        with self._state_lock:
+            if success:
+                if self._journal is not None:
+                    self._journal.record_deleted(self._account, self._name, self.entity_id(entity))
+                self._error_count = 0
+                self._deleted_count += 1
+                for bucket in self._buckets:
+                    bucket.reward()
+                if self._adaptive is not None:
+                    self._adaptive.on_success()
+            elif retry:
+                self._retry.append(entity)
+            else:
+                self._error_count += 1
+                self._failed_count += 1
+                for bucket in self._buckets:
+                    bucket.penalize()
+                if self._adaptive is not None:
+                    self._adaptive.on_error()
+
+            # 检查是否超过最大错误次数
+            if self._error_count >= self._max_error_count:
+                logger.error(f"Reached maximum error count ({self._max_error_count}), stopping execution.")
+                stop = True  # 设置 stop 为 True，立即停止
+
+            if stop:
+                self._stopped = True
+
+        self._emit_progress()
+        if success:
+            return 'deleted'
+        return 'retry' if retry else 'limited' if limited else 'failed'
+
+    def _result(self, status: str) -> ModuleResult:
+        if status != 'disabled' and self._adaptive is not None and self._journal is not None:
+            self._journal.record_rate(self._account, self._endpoint_group, self._adaptive.safe_rate)
+        return ModuleResult(self._name, status, self._deleted_count, self._failed_count, self._current_page)
+
+    def _take_retry(self) -> typing.List[typing.Dict[str, str]]:
+        """取出遇到上限后等待重新删除的实体, 取消或停止后不再重试"""
+        with self._state_lock:
+            retry, self._retry = self._retry, []
+        if self._stopped or self._cancel_token.cancelled:
+            return []
+        return retry
+
+    def _resubmit(self, scheduler: Scheduler) -> bool:
+        retry = self._take_retry()
+        for entity in retry:
+            scheduler.submit(entity)
+        return len(retry) > 0
+
+    async def _resubmit_async(self, scheduler: AsyncioScheduler) -> bool:
+        retry = self._take_retry()
+        for entity in retry:
+            await scheduler.submit(entity)
+        return len(retry) > 0
+
+    @property
+    def _resumable(self) -> bool:
+        """
+        是否读取和记录继续删除的页数, 限制了检查页数时每次都从 start_page 开始
+        设置了筛选条件时记录的页数只对这个条件有效, 不读取也不记录, 避免之后不带条件运行时跳过前面的页面
+        """
+        return not self._max_pages and self._filter is None
+
+    def _start_state(self) -> typing.Tuple[int, typing.Set[EntityKey]]:
+        """开始的页数和已经删除过的实体, 开启 journal_file 时从上次的位置继续"""
+        current_page = self._module_config.get('start_page', 1)
+        deleted_entity: typing.Set[EntityKey] = set()
+
+        if self._journal is not None:
+            # 上次没有完成时跳过已经删除的实体, 并从上次最后有新实体的页面继续
+            # 上次已经完成时删除记录已经清除, 之后重新关注的吧和用户会再次删除
+            last_page = self._journal.last_page(self._account, self._name)
+            if last_page is not None:
+                deleted_entity = {self._key_type(*json.loads(i))
+                                  for i in self._journal.deleted(self._account, self._name)}
+            if last_page is not None and last_page > current_page and self._resumable:
+                logger.info(f'resume module [{self._name}] from page [{last_page}], '
+                            f'{len(deleted_entity)} entity already deleted')
+                current_page = last_page
+        return current_page, deleted_entity
+
+    def _select_new(self, entities: typing.List[typing.Dict[str, str]],
+                    deleted_entity: typing.Set[EntityKey]) -> typing.List[typing.Dict[str, str]]:
+        """去掉已经提交过的和不符合筛选条件的实体, 检查过的 key 同时加入 deleted_entity"""
+        new_entity = []
+        for entity in entities:
+            key = self._entity_key(entity)
+            if key not in deleted_entity:
+                deleted_entity.add(key)
+                if self._filter is None or self._filter.matches(entity):
+                    new_entity.append(entity)
+        return new_entity
+
+    def _index(self, entities: typing.List[typing.Dict[str, str]]):
+        if self._journal is not None and entities:
+            self._journal.index_entities(self._account, self._name,
+                                         [(self.entity_id(entity), entity) for entity in entities])
+
+    def indexed_entities(self) -> typing.List[typing.Dict[str, str]]:
+        """之前收集时保存在 journal_file 中, 还没有删除并且符合筛选条件的实体, 可以作为 run 的 work"""
+        if self._journal is None:
+            raise ValueError('journal_file is required to use the entity index')
+        return self._journal.indexed(self._account, self._name, self._filter)
+
+    def _collect_page(self, page: int) -> typing.List[typing.Dict[str, str]]:
+        with metrics.registry.timer('tieba_collect_seconds', module=self._name):
+            entities = self._collect(page)
+        metrics.registry.inc('tieba_pages_scanned_total', module=self._name)
+        self._index(entities)
+        return entities
+
+    async def _collect_page_async(self, page: int) -> typing.List[typing.Dict[str, str]]:
+        with metrics.registry.timer('tieba_collect_seconds', module=self._name):
+            entities = await self._collect_async(page)
+        metrics.registry.inc('tieba_pages_scanned_total', module=self._name)
+        self._index(entities)
+        return entities
 
-    def run(self):
+    @property
+    def _inventory_window(self) -> int:
+        return max(self._config.get('inventory_concurrency', 8), 1)
+
+    def _inventory_pages(self, window: typing.List[typing.List[typing.Dict[str, str]]],
+                         pages: typing.List[typing.List[typing.Dict[str, str]]]) -> bool:
+        """把一组同时收集的页面加入 pages, 遇到空页面说明已经到了最后一页, 返回 True"""
+        for entities in window:
+            if len(entities) == 0:
+                return True
+            pages.append(entities)
+        return False
+
+    def _inventory_done(self, start_page: int, pages: typing.List[typing.List[typing.Dict[str, str]]],
+                        deleted_entity: typing.Set[EntityKey]) -> typing.List[typing.Dict[str, str]]:
+        work = self._select_new([entity for entities in pages for entity in entities], deleted_entity)
+        with self._state_lock:
+            self._found_count += len(work)
+        logger.info(f'inventory of module [{self._name}]: page [{start_page}] to [{start_page + len(pages) - 1}], '
+                    f'{len(work)} entity to delete')
+        self._emit_progress()
+        return work
+
+    def _inventory(self, start_page: int, deleted_entity: typing.Set[EntityKey]) -> typing.List[typing.Dict[str, str]]:
+        """同时收集 inventory_concurrency 个页面, 直到遇到空页面, 返回去重后的全部待删除实体"""
+        size = self._inventory_window
+        pages: typing.List[typing.List[typing.Dict[str, str]]] = []
+        with concurrent.futures.ThreadPoolExecutor(size, thread_name_prefix=f'inventory-{self._name}') as executor:
+            page = start_page
+            while not self._cancel_token.cancelled:
+                if self._inventory_pages(list(executor.map(self._collect_page, range(page, page + size))), pages):
+                    break
+                page += size
+        return self._inventory_done(start_page, pages, deleted_entity)
+
+    async def _inventory_async(self, start_page: int,
+                               deleted_entity: typing.Set[EntityKey]) -> typing.List[typing.Dict[str, str]]:
+        size = self._inventory_window
+        pages: typing.List[typing.List[typing.Dict[str, str]]] = []
+        page = start_page
+        while not self._cancel_token.cancelled:
+            window = await asyncio.gather(*(self._collect_page_async(i) for i in range(page, page + size)))
+            if self._inventory_pages(list(window), pages):
+                break
+            page += size
+        return self._inventory_done(start_page, pages, deleted_entity)
+
+    def _next_page(self, current_page: int) -> int:
+        # 当前页面全部都是已经删除过的, 跳到下一页, (百度的神奇 BUG, 只有帖子/回复会出现这种情况)
+        logger.info(f'no more new entity in page [{current_page}], switch to page [{current_page + 1}]')
+        return current_page + 1
+
+    def _record_found(self, current_page: int, new_entity: typing.List[typing.Dict[str, str]]):
+        if self._journal is not None and self._resumable:
+            self._journal.record_page(self._account, self._name, current_page)
+
+        with self._state_lock:
+            self._found_count += len(new_entity)
+        self._emit_progress()
+
+    def iter_entities(self, cancel_token: typing.Optional[CancellationToken] = None) \
+            -> typing.Iterator[typing.Dict[str, str]]:
+        """
+        只收集不删除, 从 start_page 开始逐页返回符合筛选条件的实体
+        只保留上一页的 key 用于去重, 内存占用不随实体数增长
+        """
+        page = self._module_config.get('start_page', 1)
+        previous_keys: typing.Set[EntityKey] = set()
+        while cancel_token is None or not cancel_token.cancelled:
+            entities = self._collect_page(page)
+            if len(entities) == 0:
+                return
+
+            keys = set()
+            for entity in entities:
+                key = self._entity_key(entity)
+                keys.add(key)
+                if key not in previous_keys and (self._filter is None or self._filter.matches(entity)):
+                    yield entity
+            previous_keys = keys
+            page += 1
+
+    def _work_entities(self, work: typing.Iterable[typing.Dict[str, str]], deleted_entity: typing.Set[EntityKey],
+                       tbs: typing.Optional[str]) -> typing.Iterator[typing.Dict[str, str]]:
+        """导入的待删除列表, 跳过已经删除的实体, 需要页面 tbs 的模块换上刚收集到的 tbs"""
+        for entity in work:
+            if self._select_new([entity], deleted_entity):
+                with self._state_lock:
+                    self._found_count += 1
+                yield entity if tbs is None else dict(entity, tbs=tbs)
+
+    @staticmethod
+    def _page_tbs(entities: typing.List[typing.Dict[str, str]]) -> typing.Optional[str]:
+        return entities[0].get('tbs') if entities else None
+
+    def _work_tbs_found(self, tbs: typing.Optional[str]) -> bool:
+        if tbs is None:
+            logger.warning(f'no tbs found on page [{self._module_config.get("start_page", 1)}] of module '
+                           f'[{self._name}], the list is empty, skip the work list')
+        return tbs is not None
+
+    def _all_deleted(self) -> ModuleResult:
+        logger.info(f'all entity in module [{self._name}] are all deleted')
+        if self._journal is not None and self._filter is None:
+            # 下次运行重新从头开始检查, 有筛选条件时不符合条件的实体还在, 保留记录
+            self._journal.finish(self._account, self._name)
+        return self._result('finished')
+
+    def _end_page(self, current_page: int) -> typing.Optional[int]:
+        return current_page + self._max_pages if self._max_pages else None
+
+    def _pages_checked(self) -> ModuleResult:
+        logger.info(f'first {self._max_pages} pages of module [{self._name}] are checked')
+        return self._result('finished')
+
+    def _work_result(self, current_page: int) -> ModuleResult:
+        if self._stopped or self._cancel_token.cancelled:
+            return self._interrupted(current_page)
+        logger.info(f'all entity in work list of module [{self._name}] are processed')
+        return self._result('finished')
+
+    def _interrupted(self, current_page: int) -> ModuleResult:
+        """达到上限或被取消, 进行中的请求已经完成, 保存进度后返回"""
+        if self._journal is not None:
+            self._journal.flush()
+        if self._stopped:
+            logger.info(f"limit exceeded in [{self._name}], exiting")
+            return self._result('stopped')
+        logger.info(f"module [{self._name}] cancelled at page [{current_page}]")
+        return self._result('cancelled')
+
+    def run(self, cancel_token: typing.Optional[CancellationToken] = None,
+            work: typing.Optional[typing.Iterable[typing.Dict[str, str]]] = None) -> ModuleResult:
+        """
+        运行到全部删除干净, 达到上限或者 cancel_token 被取消为止
+        取消时不再提交新的删除, 等已经发出的请求完成并写入进度记录后返回, 下次运行从这里继续
+        传入 work 时只删除其中的实体, 不再逐页收集
+        """
         # 没有配置启动, 直接返回
         if not self._module_config.get('enable', False):
-            return
+            return self._result('disabled')
 
-        def remove_tbs(temp_entity: typing.Dict[str, str]) -> typing.Dict[str, str]:
-            # tbs 是随机生成的, 需要去掉之后再去重
-            temp_entity = copy.deepcopy(temp_entity)
-            if 'tbs' in temp_entity:
-                del temp_entity['tbs']
-            return temp_entity
+        if cancel_token is not None:
+            self._cancel_token = cancel_token
 
-        current_page = self._module_config.get('start_page', 1)
-        deleted_entity = set()
-        error_count = 0
+        current_page, deleted_entity = self._start_state()
 
         logger.info(f'current in module [{self._name}]')
-        while True:
-            current_page_entity = self._collect(current_page)
+        scheduler = self._scheduler = self._create_scheduler()
+        try:
+            if work is not None:
+                # 删除时需要页面上的 tbs 的模块只收集一页用来获取 tbs, 页面为空说明已经没有可删除的了
+                # 页面 tbs 从 start_page 获取, 上次中断的页面现在可能已经是空的
+                tbs = None if self._with_tbs else self._page_work_tbs()
+                if self._with_tbs or self._work_tbs_found(tbs):
+                    for entity in self._work_entities(work, deleted_entity, tbs):
+                        if self._stopped or self._cancel_token.cancelled:
+                            break
+                        scheduler.submit(entity)
+                    scheduler.join()
+                    while self._resubmit(scheduler):
+                        scheduler.join()
+                return self._work_result(current_page)
+
+            if self._config.get('inventory', False) and not self._max_pages:
+                # 先收集全部页面再删除, 删除完成后下面的逐页检查只需要处理遗漏的实体
+                for entity in self._inventory(current_page, deleted_entity):
+                    if self._stopped or self._cancel_token.cancelled:
+                        break
+                    scheduler.submit(entity)
+                scheduler.join()
+
+            end_page = self._end_page(current_page)
+            while not self._stopped and not self._cancel_token.cancelled:
+                self._resubmit(scheduler)
+                if end_page is not None and current_page >= end_page:
+                    # 只检查前 max_pages 页, 等这些页面的删除完成后结束
+                    scheduler.join()
+                    if self._retry:
+                        continue
+                    if not self._stopped and not self._cancel_token.cancelled:
+                        return self._pages_checked()
+                    break
+
+                self._current_page = current_page
+                current_page_entity = self._collect_page(current_page)
+
+                if len(current_page_entity) == 0:
+                    # 全部删除干净了
+                    scheduler.join()
+                    if self._retry:
+                        continue
+                    if not self._stopped and not self._cancel_token.cancelled:
+                        return self._all_deleted()
+                    break
+
+                new_entity = self._select_new(current_page_entity, deleted_entity)
+                if len(new_entity) == 0:
+                    if scheduler.pending() > 0:
+                        # 收集时还有删除没完成, 页面内容可能还没更新, 等删除全部完成后重新收集这一页
+                        scheduler.join()
+                        continue
+
+                    current_page = self._next_page(current_page)
+                    continue
+
+                self._record_found(current_page, new_entity)
+                for entity in new_entity:
+                    logger.debug(f"now deleting [{self._entity_key(entity)}], in page [{current_page}]")
+                    scheduler.submit(entity)
+
+                # 剩余未完成的删除数降到并发数时就开始收集下一批, 让收集页面和删除重叠进行
+                scheduler.wait(self._concurrency)
+
+            # 排队中的实体会被直接跳过, 这里只等已经发出的请求完成
+            scheduler.join()
+            return self._interrupted(current_page)
+        finally:
+            self._scheduler = None
+            scheduler.close()
+            self._finished = True
+            self._emit_progress()
+
+    async def run_async(self, client: 'httpx.AsyncClient', cancel_token: typing.Optional[CancellationToken] = None,
+                        work: typing.Optional[typing.Iterable[typing.Dict[str, str]]] = None) -> ModuleResult:
+        """
+        run 的 asyncio 版本, 收集和删除使用 client 发出的异步请求, 删除由协程而不是线程并发执行
+        去重, 进度记录和结果处理与 run 完全相同
+        """
+        if not self._module_config.get('enable', False):
+            return self._result('disabled')
 
-            if len(current_page_entity) == 0:
-                # 全部删除干净了
-                logger.info(f'all entity in module [{self._name}] are all deleted')
-                return
+        if cancel_token is not None:
+            self._cancel_token = cancel_token
+        self._client = client
 
-            if len(set([HashableDict(remove_tbs(i)) for i in current_page_entity]).difference(deleted_entity)) == 0:
-                # 当前页面全部都是已经删除过的, 跳到下一页, (百度的神奇 BUG, 只有帖子/回复会出现这种情况)
-                current_page += 1
-                logger.info(f'no more new entity in page [{current_page - 1}], switch to page [{current_page}]')
-                continue
+        current_page, deleted_entity = self._start_state()
 
-            for entity in current_page_entity:
-                no_tbs_entity = HashableDict(remove_tbs(entity))
+        logger.info(f'current in module [{self._name}] (async)')
+        scheduler = self._scheduler = AsyncioScheduler(self._handle_batch_async, self._concurrency,
+                                                       batch_size=self._module_config.get('batch_size', 1))
+        try:
+            if work is not None:
+                tbs = None if self._with_tbs else self._page_tbs(
+                    await self._collect_page_async(self._module_config.get('start_page', 1)))
+                if self._with_tbs or self._work_tbs_found(tbs):
+                    for entity in self._work_entities(work, deleted_entity, tbs):
+                        if self._stopped or self._cancel_token.cancelled:
+                            break
+                        await scheduler.submit(entity)
+                    await scheduler.join()
+                    while await self._resubmit_async(scheduler):
+                        await scheduler.join()
+                return self._work_result(current_page)
+
+            if self._config.get('inventory', False) and not self._max_pages:
+                for entity in await self._inventory_async(current_page, deleted_entity):
+                    if self._stopped or self._cancel_token.cancelled:
+                        break
+                    await scheduler.submit(entity)
+                await scheduler.join()
+
+            end_page = self._end_page(current_page)
+            while not self._stopped and not self._cancel_token.cancelled:
+                await self._resubmit_async(scheduler)
+                if end_page is not None and current_page >= end_page:
+                    await scheduler.join()
+                    if self._retry:
+                        continue
+                    if not self._stopped and not self._cancel_token.cancelled:
+                        return self._pages_checked()
+                    break
+
+                self._current_page = current_page
+                current_page_entity = await self._collect_page_async(current_page)
+
+                if len(current_page_entity) == 0:
+                    await scheduler.join()
+                    if self._retry:
+                        continue
+                    if not self._stopped and not self._cancel_token.cancelled:
+                        return self._all_deleted()
+                    break
+
+                new_entity = self._select_new(current_page_entity, deleted_entity)
+                if len(new_entity) == 0:
+                    if scheduler.pending() > 0:
+                        await scheduler.join()
+                        continue
+
+                    current_page = self._next_page(current_page)
+                    continue
+
+                self._record_found(current_page, new_entity)
+                for entity in new_entity:
+                    logger.debug(f"now deleting [{self._entity_key(entity)}], in page [{current_page}]")
+                    await scheduler.submit(entity)
+
+                await scheduler.wait(self._concurrency)
+
+            await scheduler.join()
+            return self._interrupted(current_page)
+        finally:
+            self._scheduler = None
+            await scheduler.close()
+            self._finished = True
+            self._emit_progress()
+
+    def entity_id(self, entity: typing.Dict[str, str]) -> str:
+        """实体 key 的 JSON, 用于进度记录, 实体索引和任务队列"""
+        return json.dumps(self._entity_key(entity))
+
+    def forget_deleted(self, entity_ids: typing.List[str]):
+        """收集时在列表中又出现的实体已经重新关注, 从进度记录中去掉, delete_entity 才会再次删除"""
+        if self._journal is not None and entity_ids:
+            self._journal.forget_deleted(self._account, self._name, entity_ids)
+
+    def _page_work_tbs(self) -> typing.Optional[str]:
+        """需要页面 tbs 的模块单独删除实体时, 重新收集第一页获取 tbs, 缓存 tbs_ttl 秒"""
+        with self._work_tbs_lock:
+            if self._work_tbs is None or time.monotonic() - self._work_tbs_at > self._config.get('tbs_ttl', 300):
+                self._work_tbs = self._page_tbs(self._collect_page(self._module_config.get('start_page', 1)))
+                self._work_tbs_at = time.monotonic()
+            return self._work_tbs
+
+    def delete_entity(self, entity: typing.Dict[str, str],
+                      cancel_token: typing.Optional[CancellationToken] = None) -> str:
+        """
+        单独删除一个实体, 用于执行任务队列中的任务, 遵守本模块的限速, 结果计入进度, 错误计数和进度记录
+        返回值和 _handle_result 相同, 已经删除过的实体直接返回 deleted, 被取消时返回 retry
+        """
+        if cancel_token is not None:
+            self._cancel_token = cancel_token
+        if self._journal is not None and self._journal.is_deleted(self._account, self._name, self.entity_id(entity)):
+            return 'deleted'
+
+        if not self._with_tbs and 'tbs' not in entity:
+            tbs = self._page_work_tbs()
+            if tbs is None:
+                # 列表已经为空, 这个实体也已经不在了
+                return 'deleted'
+            entity = dict(entity, tbs=tbs)
+
+        results = self._delete_batch([entity])
+        if not results:
+            return 'retry'
+        outcome = self._handle_result(entity, *results[0])
+        if outcome == 'failed' and not self._with_tbs:
+            with self._work_tbs_lock:
+                self._work_tbs = None  # 页面 tbs 可能已经失效
+        return outcome
 
-                if no_tbs_entity not in deleted_entity:
-                    deleted_entity.add(no_tbs_entity)
+    @abc.abstractmethod
+    def _entity_key(self, entity: typing.Dict[str, str]) -> EntityKey:
+        """实体的唯一标识, 不包含每次随机生成的 tbs, 用于去重和记录进度"""
+        raise NotImplementedError("")
 
-                    logger.info(f"now deleting [{entity}], in page [{current_page}]")
-                    resp, stop = self._delete(entity)
-                    # 处理响应，解码错误信息
-                    if resp is not None:
-                        try:
-                            response_json = resp.json()
-                            if response_json.get('no') == 0:
-                                logger.info(f"Successfully deleted user: {entity['id']}")
-                                error_count = 0
-                            else:
-                                logger.error(f"Failed to delete user: {entity['id']},  full response: {response_json}")
-                                error_count += 1
-                        except json.JSONDecodeError:
-                            logger.error(f"Failed to parse response for user: {entity['id']}, response: {resp.text}")
-                            error_count += 1
-                    else:
-                        logger.error(f"Failed to delete user: {entity['id']}, no response received.")
-                        error_count += 1
-                    # 检查是否超过最大错误次数
-                    if error_count >= self._max_error_count:
-                        logger.error(f"Reached maximum error count ({self._max_error_count}), stopping execution.")
-                        stop = True  # 设置 stop 为 True，立即停止
-
-                    if stop:
-                        logger.info(f"limit exceeded in [{self._name}], exiting")
-                        sys.exit(-1)
-
-                    # 间隔调用接口
-                    time.sleep(1)
+    def _parsed(self, page: int, entities: typing.List[typing.Dict[str, str]]) -> typing.List[typing.Dict[str, str]]:
+        """解析完一个页面后调用, 返回 entities"""
+        return entities
+
+    def _parse_list(self, page: int, resp: requests.Response) -> typing.List[typing.Dict[str, str]]:
+        return self._parsed(page, self._parse_page(resp.content, _response_encoding(resp)))
+
+    def _validators(self, page: int) -> typing.Dict[str, str]:
+        return self._page_cache.validators((self._name, page)) if self._page_cache is not None else {}
+
+    def _open_stream(self, page: int, resp: requests.Response) \
+            -> typing.Tuple[typing.Optional[typing.List[typing.Dict[str, str]]], typing.Optional[PageStream]]:
+        """返回 304 时为 (缓存的实体, None), 否则为 (None, 用来逐块解析内容的 PageStream)"""
+        if resp.status_code == 304:
+            entities = self._page_cache.not_modified((self._name, page)) if self._page_cache is not None else None
+            return entities, None
+        return None, self._page_stream(_response_encoding(resp))
+
+    def _close_stream(self, page: int, resp: requests.Response,
+                      stream: PageStream) -> typing.List[typing.Dict[str, str]]:
+        entities = self._parsed(page, stream.close())
+        if self._page_cache is not None:
+            self._page_cache.store((self._name, page), stream.digest(), resp, entities)
+        return entities
+
+    def _collect_once(self, page: int, headers: typing.Dict[str, str]) \
+            -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        url = self._url(self._list_path)
+        if not self._stream_pages:
+            resp = self._session.get(url, params={'pn': page}, headers=headers)
+            return self._page_cache.parse((self._name, page), resp, lambda: self._parse_list(page, resp))
+
+        resp = self._session.get(url, params={'pn': page}, headers=headers, stream=True)
+        try:
+            entities, stream = self._open_stream(page, resp)
+            if stream is not None:
+                for chunk in _iter_body(resp):
+                    stream.feed(chunk)
+                entities = self._close_stream(page, resp, stream)
+            return entities
+        finally:
+            resp.close()
 
-    @abc.abstractmethod
     def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        raise NotImplementedError("")
+        if self._page_cache is None and not self._stream_pages:
+            resp = self._session.get(self._url(self._list_path), params={'pn': page})
+            return self._parse_list(page, resp)
 
-    @abc.abstractmethod
-    def _delete(self, entity: typing.Any) -> typing.Tuple[requests.Response, bool]:
-        raise NotImplementedError("")
+        entities = self._collect_once(page, self._validators(page))
+        if entities is None:
+            # 发出条件请求后缓存被淘汰了, 重新完整请求一次
+            entities = self._collect_once(page, {})
+        return entities
 
+    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
+        url = self._url(self._delete_path)
+        if self._with_tbs:
+            return self._post_with_tbs(url, entity)
+        resp = self._session.post(url, data=self._form(entity))
+        return resp, False
 
-class ThreadModule(Module):
-    def __init__(self, session: requests.Session, config: GlobalConfig):
-        super().__init__("thread", session, config)
+    async def _collect_once_async(self, page: int, headers: typing.Dict[str, str]) \
+            -> typing.Optional[typing.List[typing.Dict[str, str]]]:
+        url = self._url(self._list_path)
+        if not self._stream_pages:
+            resp = await self._client.get(url, params={'pn': page}, headers=headers)
+            return self._page_cache.parse((self._name, page), resp, lambda: self._parse_list(page, resp))
+
+        async with self._client.stream('GET', url, params={'pn': page}, headers=headers) as resp:
+            entities, stream = self._open_stream(page, resp)
+            if stream is not None:
+                async for chunk in resp.aiter_bytes(stream_chunk_size):
+                    stream.feed(chunk)
+                entities = self._close_stream(page, resp, stream)
+            return entities
+
+    async def _collect_async(self, page: int) -> typing.List[typing.Dict[str, str]]:
+        if self._page_cache is None and not self._stream_pages:
+            resp = await self._client.get(self._url(self._list_path), params={'pn': page})
+            return self._parse_list(page, resp)
+
+        entities = await self._collect_once_async(page, self._validators(page))
+        if entities is None:
+            entities = await self._collect_once_async(page, {})
+        return entities
+
+    async def _delete_async(self, entity: typing.Dict[str, str]) -> typing.Tuple['httpx.Response', bool]:
+        url = self._url(self._delete_path)
+        if not self._with_tbs:
+            resp = await self._client.post(url, data=self._form(entity))
+            return resp, False
+
+        resp, err_code = None, None
+        for attempt in range(2):
+            # tbs 缓存很少需要真正请求, 放到线程中获取, 和同步的模块共用同一个缓存
+            post_data = dict(self._form(entity), tbs=await asyncio.to_thread(self._get_tbs))
+            resp = await self._client.post(url, data=post_data)
+            err_code = self._tbs_result(attempt, err_code, resp.json()["err_code"])
+            if not self._refresh_tbs(attempt, post_data["tbs"], err_code):
+                break
+
+        return resp, err_code == 220034
+
+    def _delete_batch(self, entities: typing.List[typing.Dict[str, str]]) \
+            -> typing.List[typing.Tuple[typing.Optional[requests.Response], bool]]:
+        """
+        删除一批实体, 按顺序返回每个实体的 (响应, 是否达到上限), 可以少于传入的数量, 没有结果的实体视为未处理
+        接口支持一次提交多个 id 的模块可以重写这个方法, 默认在同一个工作线程的连接上逐个调用 _delete
+        """
+        results = []
+        for entity in entities:
+            if not all(bucket.acquire(cancel_token=self._cancel_token) for bucket in self._buckets):
+                break
+            try:
+                with metrics.registry.timer('tieba_delete_seconds', module=self._name):
+                    resp, stop = self._delete(entity)
+            except Exception as e:
+                logger.error(f"Failed to delete: {self._entity_key(entity)}, {e!r}")
+                resp, stop = None, False
+            results.append((resp, stop))
 
-    def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        tid_exp = re.compile(r"/([0-9]+)")
-        pid_exp = re.compile(r"pid=([0-9]+)")
+            if stop or self._stopped or self._cancel_token.cancelled:
+                break
+        return results
+
+    async def _handle_batch_async(self, entities: typing.List[typing.Dict[str, str]]):
+        if self._stopped or self._cancel_token.cancelled:
+            return
 
-        resp = self._session.get("https://tieba.baidu.com/i/i/my_tie", params={'pn': page})
+        for index, entity in enumerate(entities):
+            if not all([await bucket.acquire_async(cancel_token=self._cancel_token) for bucket in self._buckets]):
+                self._requeue(entities[index:])
+                break
+            try:
+                with metrics.registry.timer('tieba_delete_seconds', module=self._name):
+                    resp, stop = await self._delete_async(entity)
+            except Exception as e:
+                logger.error(f"Failed to delete: {self._entity_key(entity)}, {e!r}")
+                resp, stop = None, False
+            self._handle_result(entity, resp, stop)
 
-        html = bs4.BeautifulSoup(resp.text, "lxml")
-        elements = html.find_all(name="a", attrs={"class": "thread_title"})
+            if stop or self._stopped or self._cancel_token.cancelled:
+                self._requeue(entities[index + 1:])
+                break
 
-        current_page_thread = []
-        for element in elements:
-            thread = element.get("href")
-            thread_dict = dict()
-            thread_dict["tid"] = tid_exp.findall(thread)[0]
-            thread_dict["pid"] = pid_exp.findall(thread)[0]
-            current_page_thread.append(thread_dict)
-        return current_page_thread
 
-    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
-        url = "https://tieba.baidu.com/f/commit/post/delete"
+class ThreadModule(Module):
+    _key_type = PostKey
+    _endpoint_group = 'post'
+    _list_path = '/i/i/my_tie'
+    _delete_path = '/f/commit/post/delete'
+    _with_tbs = True
+    _parse_page = staticmethod(parse_thread_page)
+    _page_stream = staticmethod(thread_page_stream)
 
-        post_data = copy.deepcopy(entity)
-        post_data["tbs"] = self._get_tbs()
-        resp = self._session.post(url, data=post_data)
+    def __init__(self, session: requests.Session, config: GlobalConfig):
+        super().__init__("thread", session, config)
 
-        return resp, resp.json()["err_code"] == 220034
+    def _entity_key(self, entity: typing.Dict[str, str]) -> PostKey:
+        return PostKey(entity['tid'], entity['pid'])
 
 
 class ReplyModule(Module):
+    _key_type = PostKey
+    _endpoint_group = 'post'
+    _list_path = '/i/i/my_reply'
+    _delete_path = '/f/commit/post/delete'
+    _with_tbs = True
+    _parse_page = staticmethod(parse_reply_page)
+    _page_stream = staticmethod(reply_page_stream)
+
     def __init__(self, session: requests.Session, config: GlobalConfig):
         super().__init__("reply", session, config)
 
-    def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        tid_exp = re.compile(r"/([0-9]+)")
-        pid_exp = re.compile(r"pid=([0-9]+)")  # 主题贴和回复都为 pid
-        cid_exp = re.compile(r"cid=([0-9]+)")  # 楼中楼为 cid
-
-        resp = self._session.get("https://tieba.baidu.com/i/i/my_reply", params={'pn': page})
-
-        html = bs4.BeautifulSoup(resp.text, "lxml")
-        elements = html.find_all(name="a", attrs={"class": "b_reply"})
-        current_page_reply = []
-
-        for element in elements:
-            reply = element.get("href")
-            if reply.find("pid") != -1:
-                tid = tid_exp.findall(reply)
-                pid = pid_exp.findall(reply)
-                cid = cid_exp.findall(reply)
-                reply_dict = dict()
-                reply_dict["tid"] = tid[0]
-
-                if cid and cid[0] != "0":  # 如果 cid != 0, 这个回复是楼中楼, 否则是一整楼的回复
-                    reply_dict["pid"] = cid[0]
-                else:
-                    reply_dict["pid"] = pid[0]
-                current_page_reply.append(reply_dict)
-        return current_page_reply
-
-    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
-        url = "https://tieba.baidu.com/f/commit/post/delete"
-
-        post_data = copy.deepcopy(entity)
-        post_data["tbs"] = self._get_tbs()
-        resp = self._session.post(url, data=post_data)
-        return resp, resp.json()["err_code"] == 220034
+    def _entity_key(self, entity: typing.Dict[str, str]) -> PostKey:
+        return PostKey(entity['tid'], entity['pid'])
 
 
 class FollowedBaModule(Module):
+    _key_type = ForumKey
+    _endpoint_group = 'forum'
+    _list_path = '/f/like/mylike'
+    _delete_path = '/f/like/commit/delete'
+    _parse_page = staticmethod(parse_followed_ba_page)
+    _page_stream = staticmethod(followed_ba_page_stream)
+
     def __init__(self, session: requests.Session, config: GlobalConfig):
         super().__init__("followed_ba", session, config)
 
-    def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        ba_list = []
-        resp = self._session.get("https://tieba.baidu.com/f/like/mylike", params={'pn': page})
-
-        html = bs4.BeautifulSoup(resp.text, "lxml")
-        elements = html.find_all(name="span")
-        for element in elements:
-            ba_dict = dict()
-            ba_dict["fid"] = element.get("balvid")
-            ba_dict["tbs"] = element.get("tbs")
-            ba_dict["fname"] = element.get("balvname")
-            ba_list.append(ba_dict)
-        return ba_list
-
-    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
-        url = "https://tieba.baidu.com/f/like/commit/delete"
-        resp = self._session.post(url, data=entity)
-        return resp, False
+    def _entity_key(self, entity: typing.Dict[str, str]) -> ForumKey:
+        return ForumKey(entity['fid'])
 
 
 class ConcernModule(Module):
+    _key_type = UserKey
+    _endpoint_group = 'concern'
+    _list_path = '/i/i/concern'
+    _delete_path = '/home/post/unfollow'
+    _parse_page = staticmethod(parse_concern_page)
+    _page_stream = staticmethod(concern_page_stream)
+
     def __init__(self, session: requests.Session, config: GlobalConfig):
         super().__init__("concern", session, config)
 
-    def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        concern_list = []
-
-        resp = self._session.get("https://tieba.baidu.com/i/i/concern", params={'pn': page})
+    def _parsed(self, page: int, entities: typing.List[typing.Dict[str, str]]) -> typing.List[typing.Dict[str, str]]:
+        logger.info(f'Page {page} - Found {len(entities)} concern users')
+        return entities
 
-        html = bs4.BeautifulSoup(resp.text, "lxml")
-        elements = html.find_all(name="input", attrs={"class": "btn_unfollow"})
-        logger.info(f'Page {page} - Found {len(elements)} concern users')
-        for element in elements:
-            concern_dict = dict()
-            concern_dict["cmd"] = "unfollow"
-            concern_dict["tbs"] = element.get("tbs")
-            concern_dict["id"] = element.get("portrait")
-            concern_list.append(concern_dict)
-        return concern_list
-
-    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
-        url = "https://tieba.baidu.com/home/post/unfollow"
-        resp = self._session.post(url, data=entity)
-        return resp, False
+    def _entity_key(self, entity: typing.Dict[str, str]) -> UserKey:
+        return UserKey(entity['id'])
 
 
 class FanModule(Module):
+    _key_type = UserKey
+    _endpoint_group = 'fan'
+    _list_path = '/i/i/fans'
+    _delete_path = '/i/commit'
+    _parse_page = staticmethod(parse_fan_page)
+    _page_stream = staticmethod(fan_page_stream)
+
     def __init__(self, session: requests.Session, config: GlobalConfig):
         super().__init__("fan", session, config)
 
-    def _collect(self, page: int) -> typing.List[typing.Dict[str, str]]:
-        fan_list = []
-        tbs_exp = re.compile(r"tbs : '([0-9a-zA-Z]{16})'")  # 居然还有一个短版 tbs.... 绝了
-
-        resp = self._session.get("https://tieba.baidu.com/i/i/fans", params={'pn': page})
-
-        tbs = tbs_exp.findall(resp.text)[0]
-        html = bs4.BeautifulSoup(resp.text, "lxml")
-        elements = html.find_all(name="input", attrs={"class": "btn_follow"})
-        for element in elements:
-            fan_dict = dict()
-            fan_dict["cmd"] = "add_black_list"
-            fan_dict["tbs"] = tbs
-            fan_dict["portrait"] = element.get("portrait")
-            fan_list.append(fan_dict)
-        return fan_list
+    def _entity_key(self, entity: typing.Dict[str, str]) -> UserKey:
+        return UserKey(entity['portrait'])
 
-    def _delete(self, entity: typing.Dict[str, str]) -> typing.Tuple[requests.Response, bool]:
-        url = "https://tieba.baidu.com/i/commit"
-        resp = self._session.post(url, data=entity)
-        return resp, False
+
+class TimeoutSession(requests.Session):
+    """没有单独指定 timeout 的请求使用默认的连接/读取超时"""
+    _timeout: typing.Tuple[float, float]
+
+    def __init__(self, timeout: typing.Tuple[float, float]):
+        super().__init__()
+        self._timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self._timeout)
+        return super().request(method, url, **kwargs)
+
+
+class HttpxSession:
+    """基于 httpx 的 HTTP/2 session, 只实现了本程序用到的 requests.Session 接口"""
+
+    def __init__(self, pool_size: int, timeout: typing.Tuple[float, float], retries: int):
+        import httpx
+
+        # httpx 默认会把每个请求都打在 INFO 日志里
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self._client = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+            transport=httpx.HTTPTransport(http2=True, retries=retries, limits=limits),
+        )
+
+    @property
+    def headers(self):
+        return self._client.headers
+
+    @property
+    def cookies(self):
+        return self._client.cookies
+
+    def request(self, method: str, url: str, allow_redirects: bool = True, stream: bool = False, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs.pop('timeout', None)
+        if stream:
+            # 和 requests 一样只读取响应头, 内容由调用方逐块读取后 close
+            request = self._client.build_request(method, url, **kwargs)
+            return self._client.send(request, stream=True, follow_redirects=allow_redirects)
+        return self._client.request(method, url, follow_redirects=allow_redirects, **kwargs)
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+module_constructors: typing.List[typing.Callable[[requests.Session, GlobalConfig], Module]] = [
+    ThreadModule, ReplyModule, FollowedBaModule, ConcernModule, FanModule
+]
+
+
+export_fields = ('module', 'tid', 'pid', 'fid', 'fname', 'cmd', 'id', 'portrait') + index_fields
+
+
+def export_entities(modules: typing.List[Module], path: typing.Optional[str] = None,
+                    cancel_token: typing.Optional[CancellationToken] = None) -> typing.Dict[str, int]:
+    """
+    只收集不删除, 把启用的模块的实体逐条写入 path, 以 .csv 结尾时为 CSV, 否则为 JSONL, path 为空时只计数
+    tbs 很快会失效, 不写入文件, 返回每个模块的实体数
+    """
+    counts: typing.Dict[str, int] = {}
+    with open(path or os.devnull, 'w', newline='', encoding='utf-8') as f:
+        if path and path.lower().endswith('.csv'):
+            writer = csv.DictWriter(f, export_fields, restval='', extrasaction='ignore')
+            writer.writeheader()
+            write = writer.writerow
+        else:
+            def write(row: typing.Dict[str, str]):
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+        for module in modules:
+            if not module.enabled:
+                continue
+            counts[module.name] = 0
+            for entity in module.iter_entities(cancel_token):
+                write({'module': module.name, **{k: v for k, v in entity.items() if k != 'tbs'}})
+                counts[module.name] += 1
+            logger.info(f'module [{module.name}] {counts[module.name]} entity found')
+    return counts
+
+
+def read_work_list(path: str, module_name: str) -> typing.Iterator[typing.Dict[str, str]]:
+    """逐行读取 export_entities 导出的文件中属于 module_name 的实体"""
+    with open(path, 'r', newline='', encoding='utf-8') as f:
+        if path.lower().endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            if row.pop('module', None) == module_name:
+                yield {k: v for k, v in row.items() if v}
+
+
+def start_metrics(config: GlobalConfig) -> typing.Optional[metrics.JsonReporter]:
+    """按照 [metrics] 配置开启 JSON 快照和 Prometheus 接口, 返回的 reporter 需要在结束时 stop"""
+    metrics_config: MetricsConfig = {**default_metrics_config, **config.get('metrics', {})}
+
+    if metrics_config['prometheus_port']:
+        metrics.start_prometheus_server(metrics_config['prometheus_port'])
+
+    reporter = None
+    if metrics_config['json_file']:
+        reporter = metrics.JsonReporter(metrics_config['json_file'], metrics_config['interval'])
+        reporter.start()
+    return reporter
+
+
+def build_modules(session: requests.Session, config: GlobalConfig) -> typing.List[Module]:
+    return [module_constructor(session, config) for module_constructor in module_constructors]
+
+
+def module_work(module: Module, work_list: typing.Optional[str],
+                from_index: bool) -> typing.Optional[typing.Iterable[typing.Dict[str, str]]]:
+    """模块只需要删除的实体, 来自导出的文件或者实体索引, 都没有指定时为 None, 逐页收集"""
+    if work_list:
+        return read_work_list(work_list, module.name)
+    if from_index and module.enabled:
+        return module.indexed_entities()
+    return None
+
+
+def run_modules(modules: typing.List[Module], config: GlobalConfig,
+                cancel_token: typing.Optional[CancellationToken] = None,
+                work_list: typing.Optional[str] = None, from_index: bool = False) -> typing.List[ModuleResult]:
+    """
+    运行一个账号的所有模块, 开启 parallel_modules 时各模块在各自的线程中同时运行, 共用同一个 session
+    顺序执行时有模块停止或被取消, 后面的模块不再运行
+    work_list 为 export_entities 导出的文件, 指定时各模块只删除文件中的实体
+    from_index 为 True 时各模块只删除 journal_file 索引中符合筛选条件的实体, 不再逐页收集
+    """
+    cancel_token = cancel_token or CancellationToken()
+    if config.get('engine', 'threads') == 'async':
+        return asyncio.run(run_modules_async(modules, config, cancel_token, work_list, from_index))
+
+    def work(module: Module) -> typing.Optional[typing.Iterable[typing.Dict[str, str]]]:
+        return module_work(module, work_list, from_index)
+
+    if not config.get('parallel_modules', False):
+        results = []
+        for module in modules:
+            result = module.run(cancel_token, work(module))
+            results.append(result)
+            if not result.ok:
+                break
+        return results
+
+    results: typing.Dict[str, ModuleResult] = {}
+    errors: typing.List[Exception] = []
+
+    def run_module(module: Module):
+        try:
+            results[module.name] = module.run(cancel_token, work(module))
+        except Exception as e:
+            # 和顺序执行一样把异常交给调用方, 账号才会被标记为失败
+            errors.append(e)
+
+    threads = []
+    for module in modules:
+        if module.enabled:
+            thread = threading.Thread(target=run_module, args=(module,), name=f'module-{module.name}')
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return [results[module.name] for module in modules if module.name in results]
+
+
+def _pool_size(config: GlobalConfig, http_config: HttpConfig) -> int:
+    pool_size = http_config['pool_size']
+    if pool_size <= 0:
+        # 每个删除线程一个连接, 再加上收集页面用的连接
+        pool_size = sum(config.get(name, {}).get('concurrency', 1) + 1 for name in module_names)
+        if config.get('inventory', False):
+            pool_size += config.get('inventory_concurrency', 8)
+    return pool_size
+
+
+async def run_modules_async(modules: typing.List[Module], config: GlobalConfig, cancel_token: CancellationToken,
+                            work_list: typing.Optional[str] = None,
+                            from_index: bool = False) -> typing.List[ModuleResult]:
+    """run_modules 的 asyncio 版本, 同一个账号的模块共用一个异步客户端"""
+    if not modules:
+        return []
+
+    def work(module: Module) -> typing.Optional[typing.Iterable[typing.Dict[str, str]]]:
+        return module_work(module, work_list, from_index)
+
+    async with create_async_client(config, modules[0].session) as client:
+        if config.get('parallel_modules', False):
+            # 等所有模块结束后再抛出异常, 不在其他模块运行中关闭 client
+            gathered = await asyncio.gather(*(module.run_async(client, cancel_token, work(module))
+                                              for module in modules if module.enabled), return_exceptions=True)
+            for result in gathered:
+                if isinstance(result, BaseException):
+                    raise result
+            return list(gathered)
+
+        results = []
+        for module in modules:
+            result = await module.run_async(client, cancel_token, work(module))
+            results.append(result)
+            if not result.ok:
+                break
+        return results
+
+
+def create_async_client(config: GlobalConfig, session: requests.Session) -> 'httpx.AsyncClient':
+    """engine = "async" 时使用的 httpx 异步客户端, Cookie 和请求头从 session 复制"""
+    import httpx
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    http_config: HttpConfig = {**default_http_config, **config.get('http', {})}
+    pool_size = _pool_size(config, http_config)
+
+    http2 = http_config['http2']
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning('h2 is not installed, fall back to HTTP/1.1')
+            http2 = False
+
+    limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+    return httpx.AsyncClient(
+        http2=http2,
+        timeout=httpx.Timeout(http_config['read_timeout'], connect=http_config['connect_timeout']),
+        transport=httpx.AsyncHTTPTransport(http2=http2, retries=http_config['retries'], limits=limits),
+        headers=dict(session.headers),
+        cookies=dict(session.cookies.items()),
+        follow_redirects=True,
+    )
+
+
+def create_session(config: GlobalConfig, raw_cookie: str) -> requests.Session:
+    """按照 [http] 配置创建 session, 连接池大小和各模块的并发数匹配, 并加载 Cookie 和 User-Agent"""
+    http_config: HttpConfig = {**default_http_config, **config.get('http', {})}
+
+    pool_size = _pool_size(config, http_config)
+    timeout = (http_config['connect_timeout'], http_config['read_timeout'])
+
+    session = None
+    if http_config['http2']:
+        try:
+            session = HttpxSession(pool_size, timeout, http_config['retries'])
+        except ImportError:
+            logger.warning('httpx is not installed, fall back to requests (HTTP/1.1)')
+
+    if session is None:
+        session = TimeoutSession(timeout)
+        retry = urllib3.util.Retry(total=http_config['retries'], backoff_factor=http_config['backoff_factor'],
+                                   status_forcelist=(500, 502, 503, 504))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                                max_retries=retry)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+    session = load_cookie(session, raw_cookie)
+
+    user_agent = config.get('user_agent', None)
+    if user_agent:
+        session.headers["User-Agent"] = user_agent
+    return session
 
 
 def load_cookie(session: requests.Session, raw_cookie: str) -> requests.Session:
@@ -313,16 +2579,40 @@ def load_cookie(session: requests.Session, raw_cookie: str) -> requests.Session:
     return session
 
 
-def validate_cookie(session: requests.Session):
-    resp = session.get('https://tieba.baidu.com/i/i/my_tie', allow_redirects=False)
+def validate_cookie(session: requests.Session, base_url: str = default_base_url):
+    resp = session.get(f'{base_url}/i/i/my_tie', allow_redirects=False)
     return resp.status_code == 200
 
+
+cookie_check_ttl = 600  # Cookie 检查通过后的缓存时间 (秒)
+_cookie_checks: typing.Dict[typing.Tuple[str, str], float] = {}
+_cookie_checks_lock = threading.Lock()
+
+
+def validate_cookie_cached(session: requests.Session, base_url: str = default_base_url,
+                           ttl: float = cookie_check_ttl) -> bool:
+    """同一个账号检查通过后 ttl 秒内不再请求, 没有通过的每次都重新检查"""
+    key = (account_id(session), base_url)
+    with _cookie_checks_lock:
+        checked_at = _cookie_checks.get(key)
+    if checked_at is not None and time.monotonic() - checked_at < ttl:
+        return True
+
+    if not validate_cookie(session, base_url):
+        return False
+    with _cookie_checks_lock:
+        _cookie_checks[key] = time.monotonic()
+    return True
+
 class DeleteMyHistory:
-    def __init__(self, log_callback=None):
+    def __init__(self, log_callback=None, progress_callback=None):
         self.session = None
         self.config = None
         self.running = False
         self.log_callback = log_callback  # 用于将日志输出到 GUI 或控制台
+        self.progress_callback = progress_callback  # 用于在 GUI 中显示各模块的进度
+        self.modules: typing.Dict[str, Module] = {}  # 正在运行的模块, 用于运行中调整速度和并发
+        self.cancel_token = CancellationToken()
 
     def load_config(self, config_path: str, raw_cookie: str):
         """加载配置文件和 Cookie"""
@@ -330,14 +2620,9 @@ class DeleteMyHistory:
             with open(config_path, 'r') as f:
                 self.config = toml.load(f)
 
-            self.session = requests.session()
-            self.session = load_cookie(self.session, raw_cookie)  # 直接使用传入的 Cookie 字符串
+            self.session = create_session(self.config, raw_cookie)  # 直接使用传入的 Cookie 字符串
 
-            user_agent = self.config.get('user_agent', None)
-            if user_agent:
-                self.session.headers["User-Agent"] = user_agent
-
-            if not validate_cookie(self.session):
+            if not validate_cookie_cached(self.session, self.config.get('base_url', default_base_url)):
                 self.log("cookie expired, please update it", level="fatal")
                 raise ValueError("Cookie 已过期，请更新 Cookie")
 
@@ -359,11 +2644,11 @@ class DeleteMyHistory:
         if self.log_callback:
             self.log_callback(message)
 
-    def run_module(self, module_name: str):
-        """根据模块名称运行对应的模块"""
+    def run_module(self, module_name: str) -> typing.Optional[ModuleResult]:
+        """根据模块名称运行对应的模块, 返回运行结果"""
         if not self.running:
             self.log("请先启动任务", level="error")
-            return
+            return None
 
         module_mapping = {
             "ThreadModule": ThreadModule,
@@ -375,24 +2660,44 @@ class DeleteMyHistory:
 
         if module_name not in module_mapping:
             self.log(f"未知模块: {module_name}", level="error")
-            return
+            return None
 
         module_class = module_mapping[module_name]
-        module = module_class(self.session, self.config)
+        # 图形界面中每个模块在各自的线程中同时运行, 和 parallel_modules 一样要共同遵守 endpoint_limits
+        module = module_class(self.session, {**self.config, 'parallel_modules': True})
+        module.set_progress_callback(self.progress_callback)
+        self.modules[module_name] = module
 
         self.log(f"开始运行模块: {module_name}")
-        module.run()
+        result = module.run(self.cancel_token)
+        self.modules.pop(module_name, None)
+        self.log(f"模块 {module_name} 结束: {result.status}, 已删除 {result.deleted}, 失败 {result.failed}, "
+                 f"最后处理到第 {result.page} 页")
+        return result
+
+    def set_rate(self, rate_per_sec: float):
+        """调整所有正在运行的模块的删除速度"""
+        for module in list(self.modules.values()):
+            module.set_rate(rate_per_sec)
+        self.log(f"删除速度已调整为 {rate_per_sec} 次/秒")
+
+    def set_concurrency(self, concurrency: int):
+        """调整所有正在运行的模块的删除线程数"""
+        for module in list(self.modules.values()):
+            module.set_concurrency(concurrency)
+        self.log(f"并发数已调整为 {concurrency}")
 
     def start(self):
         """启动任务"""
+        self.cancel_token = CancellationToken()
         self.running = True
         self.log("任务启动")
 
     def stop(self):
-        """终止任务"""
+        """终止任务, 正在运行的模块等已经发出的请求完成并保存进度后结束, 不会阻塞调用方"""
         self.running = False
-        self.log("任务终止")
-        sys.exit(0)
+        self.cancel_token.cancel()
+        self.log("任务终止, 等待进行中的请求完成")
 
     def run_module_in_thread(self, module_name: str):
         """在单独的线程中运行模块"""
@@ -400,33 +2705,428 @@ class DeleteMyHistory:
         thread.start()
 
 
-def main():
-    with open('config.toml', 'r') as f:
-        config: GlobalConfig = toml.load(f)
+class AccountSummary(typing.NamedTuple):
+    cookie_file: str
+    ok: bool
+    message: str
+    deleted: typing.Dict[str, int]
+    failed: typing.Dict[str, int]
 
-    cookie_file = config.get('cookie_file', './cookie.txt')
+
+def open_account(config: GlobalConfig, cookie_file: str) -> typing.List[Module]:
+    """读取账号的 Cookie, 检查是否有效, 并为这个账号创建独立 session 的各个模块"""
     with open(cookie_file, 'r') as f:
         raw_cookie = f.read()
 
-    session = requests.session()
-    session = load_cookie(session, raw_cookie)
+    session = create_session(config, raw_cookie)
+    if not validate_cookie(session, config.get('base_url', default_base_url)):
+        raise ValueError('cookie expired, please update it')
+    return build_modules(session, config)
+
+
+def account_summary(cookie_file: str, modules: typing.List[Module], results: typing.List[ModuleResult],
+                    error: typing.Optional[Exception] = None) -> AccountSummary:
+    ok, message = True, 'done'
+    if error is not None:
+        ok, message = False, repr(error)
+    elif any(result.status == 'stopped' for result in results):
+        ok, message = False, 'limit exceeded'
+    elif any(result.status == 'cancelled' for result in results):
+        ok, message = False, 'cancelled'
+
+    return AccountSummary(
+        cookie_file, ok, message,
+        {module.name: module.deleted_count for module in modules},
+        {module.name: module.failed_count for module in modules},
+    )
+
+
+def run_account(config: GlobalConfig, cookie_file: str,
+                cancel_token: typing.Optional[CancellationToken] = None) -> AccountSummary:
+    """在独立的 session 中处理一个账号的所有模块"""
+    if cancel_token is not None and cancel_token.cancelled:
+        return AccountSummary(cookie_file, False, 'cancelled', {}, {})
+
+    modules: typing.List[Module] = []
+    try:
+        modules = open_account(config, cookie_file)
+        return account_summary(cookie_file, modules, run_modules(modules, config, cancel_token))
+    except Exception as e:
+        traceback.print_exc()
+        return account_summary(cookie_file, modules, [], e)
+
+
+async def run_account_async(config: GlobalConfig, cookie_file: str,
+                            cancel_token: CancellationToken) -> AccountSummary:
+    """run_account 的 asyncio 版本, 检查 Cookie 等同步操作放在线程中执行"""
+    if cancel_token.cancelled:
+        return AccountSummary(cookie_file, False, 'cancelled', {}, {})
+
+    modules: typing.List[Module] = []
+    try:
+        modules = await asyncio.to_thread(open_account, config, cookie_file)
+        return account_summary(cookie_file, modules, await run_modules_async(modules, config, cancel_token))
+    except Exception as e:
+        traceback.print_exc()
+        return account_summary(cookie_file, modules, [], e)
+
+
+async def run_accounts_async(config: GlobalConfig, cookie_files: typing.List[str], max_workers: int,
+                             cancel_token: CancellationToken) -> typing.List[AccountSummary]:
+    # 所有账号在同一个事件循环中运行, 同时运行的账号数不超过 max_workers
+    semaphore = asyncio.Semaphore(max_workers)
+
+    async def run_one(cookie_file: str) -> AccountSummary:
+        async with semaphore:
+            return await run_account_async(config, cookie_file, cancel_token)
+
+    return list(await asyncio.gather(*(run_one(cookie_file) for cookie_file in cookie_files)))
+
+
+def list_cookie_files(batch_config: BatchConfig) -> typing.List[str]:
+    cookie_files = list(batch_config.get('cookie_files', []))
+    cookie_dir = batch_config.get('cookie_dir', '')
+    if cookie_dir:
+        cookie_files.extend(os.path.join(cookie_dir, name) for name in sorted(os.listdir(cookie_dir))
+                            if name.endswith('.txt'))
+    return cookie_files
+
+
+def run_accounts(config: GlobalConfig, cookie_files: typing.List[str],
+                 cancel_token: typing.Optional[CancellationToken] = None) -> typing.List[AccountSummary]:
+    """同时处理多个账号, 每个账号单独一个 session, 最后汇总每个账号的结果"""
+    batch_config: BatchConfig = {**default_batch_config, **config.get('batch', {})}
+
+    # 限制每个账号的并发, 避免账号数乘以并发数把连接数撑爆
+    max_concurrency = batch_config['max_concurrency_per_account']
+    account_config = dict(config)
+    for name in module_names:
+        if name in config:
+            account_config[name] = {
+                **config[name], 'concurrency': min(config[name].get('concurrency', 1), max_concurrency)
+            }
+
+    if config.get('engine', 'threads') == 'async':
+        summaries = asyncio.run(run_accounts_async(account_config, cookie_files, batch_config['max_workers'],
+                                                   cancel_token or CancellationToken()))
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=batch_config['max_workers']) as executor:
+            futures = [executor.submit(run_account, account_config, cookie_file, cancel_token)
+                       for cookie_file in cookie_files]
+            summaries = [future.result() for future in futures]
+
+    logger.info(f'batch finished, {sum(s.ok for s in summaries)}/{len(summaries)} account succeeded')
+    for summary in summaries:
+        logger.info(f'[{summary.cookie_file}] {summary.message}, deleted: {sum(summary.deleted.values())} '
+                    f'{summary.deleted}, failed: {sum(summary.failed.values())} {summary.failed}')
+    return summaries
+
+
+def account_cookie_files(config: GlobalConfig) -> typing.List[str]:
+    return list_cookie_files(config.get('batch', default_batch_config)) or [config.get('cookie_file', './cookie.txt')]
+
+
+def open_job_queue(config: GlobalConfig) -> jobqueue.JobQueue:
+    queue_config: QueueConfig = {**default_queue_config, **config.get('queue', {})}
+    return jobqueue.open_queue(queue_config['url'], queue_config['max_attempts'])
+
+
+def enqueue_accounts(config: GlobalConfig, cookie_files: typing.List[str], job_queue: jobqueue.JobQueue,
+                     cancel_token: typing.Optional[CancellationToken] = None) -> typing.Dict[str, int]:
+    """
+    协调进程: 逐页收集每个账号启用的模块的实体写入任务队列, 不执行删除, 返回每个模块新增的任务数
+    tbs 很快会失效, 不写入队列, 由 worker 删除时重新获取
+    """
+    added: typing.Dict[str, int] = {}
+    for cookie_file in cookie_files:
+        try:
+            modules = open_account(config, cookie_file)
+        except Exception as e:
+            logger.error(f'[{cookie_file}] skipped: {e!r}')
+            continue
 
-    user_agent = config.get('user_agent', None)
-    if user_agent:
-        session.headers["User-Agent"] = user_agent
+        account = account_id(modules[0].session)
+        for module in modules:
+            if not module.enabled or (cancel_token is not None and cancel_token.cancelled):
+                continue
+            jobs, count = [], 0
+            for entity in module.iter_entities(cancel_token):
+                jobs.append((account, module.name, module.entity_id(entity),
+                             {k: v for k, v in entity.items() if k != 'tbs'}))
+                if len(jobs) >= 100:
+                    module.forget_deleted([job[2] for job in jobs])
+                    count += job_queue.put(jobs)
+                    jobs = []
+            module.forget_deleted([job[2] for job in jobs])
+            count += job_queue.put(jobs)
+            added[module.name] = added.get(module.name, 0) + count
+            logger.info(f'[{cookie_file}] module [{module.name}] {count} new job')
+    return added
+
+
+class QueueWorker:
+    """
+    从任务队列租用任务并删除, 只租用自己有 Cookie 的账号的任务
+    同一个账号同一个模块的任务共用一个 Module, 遵守它的限速; 模块遇到上限或错误次数过多停止后,
+    这个模块的任务暂停一段时间 (limit_cooldown 或 retry_delay), 之后换一个新的 Module 继续
+    """
+    _config: GlobalConfig
+    _queue: jobqueue.JobQueue
+    _name: str
+
+    def __init__(self, config: GlobalConfig, job_queue: jobqueue.JobQueue,
+                 cancel_token: typing.Optional[CancellationToken] = None, name: typing.Optional[str] = None):
+        self._config = config
+        self._queue_config: QueueConfig = {**default_queue_config, **config.get('queue', {})}
+        self._queue = job_queue
+        self._cancel_token = cancel_token or CancellationToken()
+        self._name = name or f'{socket.gethostname()}-{os.getpid()}'
+        self._sessions: typing.Dict[str, requests.Session] = {}
+        self._modules: typing.Dict[typing.Tuple[str, str], Module] = {}
+        self._paused: typing.Dict[typing.Tuple[str, str], float] = {}
+        self._lock = threading.Lock()
+        self.outcomes: typing.Dict[str, int] = {}
+
+    @property
+    def name(self) -> str:
+        return self._name
 
-    if not validate_cookie(session):
+    def add_account(self, cookie_file: str) -> bool:
+        try:
+            session = open_account(self._config, cookie_file)[0].session
+        except Exception as e:
+            logger.error(f'[{cookie_file}] skipped: {e!r}')
+            return False
+        self._sessions[account_id(session)] = session
+        return True
+
+    def _module(self, account: str, name: str) -> Module:
+        with self._lock:
+            module = self._modules.get((account, name))
+            if module is None or module.stopped:
+                constructor = dict(zip(module_names, module_constructors))[name]
+                module = self._modules[(account, name)] = constructor(self._sessions[account], self._config)
+            return module
+
+    def _pause(self, key: typing.Tuple[str, str], seconds: float):
+        with self._lock:
+            self._paused[key] = max(self._paused.get(key, 0), time.monotonic() + seconds)
+
+    def _execute(self, job: jobqueue.Job):
+        key = (job.account, job.module)
+        with self._lock:
+            remaining = self._paused.get(key, 0) - time.monotonic()
+        if remaining > 0:
+            self._queue.release(job, self._name, remaining)
+            return
+
+        module = self._module(job.account, job.module)
+        try:
+            outcome = module.delete_entity(job.entity, self._cancel_token)
+        except Exception as e:
+            logger.error(f'job [{job.id}] of module [{job.module}] failed: {e!r}')
+            outcome = 'failed'
+
+        cooldown = {**default_adaptive_config, **self._config.get('adaptive', {})}['limit_cooldown']
+        retry_delay = self._queue_config['retry_delay']
+        if outcome == 'deleted':
+            self._queue.ack(job, self._name)
+        elif outcome == 'retry':
+            self._queue.release(job, self._name)
+        elif outcome == 'limited':
+            self._queue.release(job, self._name, cooldown)
+        else:
+            self._queue.release(job, self._name, retry_delay, failed=True)
+
+        if module.stopped:
+            self._pause(key, cooldown if outcome == 'limited' else retry_delay)
+        with self._lock:
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def run(self) -> typing.Dict[str, int]:
+        """执行任务直到队列中没有等待和进行中的任务, 或者被取消, 返回各结果的次数"""
+        accounts = list(self._sessions)
+        if not accounts:
+            logger.error(f'worker [{self._name}] has no valid account')
+            return self.outcomes
+
+        logger.info(f'worker [{self._name}] started with {len(accounts)} account')
+        concurrency = max(self._queue_config['concurrency'], 1)
+        with concurrent.futures.ThreadPoolExecutor(concurrency, thread_name_prefix='worker') as executor:
+            while not self._cancel_token.cancelled:
+                jobs = self._queue.lease(self._name, self._queue_config['batch_size'],
+                                         self._queue_config['lease_seconds'], accounts)
+                if jobs:
+                    list(executor.map(self._execute, jobs))
+                    continue
+
+                # 只看自己有 cookie 的账号, 其他账号的任务留给别的 worker
+                counts = self._queue.counts(accounts)
+                if counts['pending'] + counts['leased'] == 0:
+                    break
+                # 剩下的任务还没到重试时间, 或者正在被其他 worker 执行
+                self._cancel_token.wait(self._queue_config['poll_interval'])
+
+        logger.info(f'worker [{self._name}] finished: {self.outcomes}, queue: {self._queue.counts()}')
+        return self.outcomes
+
+
+def install_interrupt_handler(cancel_token: CancellationToken):
+    """第一次 Ctrl+C 取消任务, 等已经发出的请求完成后退出, 再按一次立即退出"""
+    def handler(signum, frame):
+        if cancel_token.cancelled:
+            raise KeyboardInterrupt
+        logger.info('cancelling, waiting for in-flight requests (press Ctrl+C again to quit now)')
+        cancel_token.cancel()
+
+    signal.signal(signal.SIGINT, handler)
+
+
+def _positive_float(value: str) -> float:
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f'must be greater than 0: {value}')
+    return number
+
+
+def parse_args(argv: typing.Optional[typing.List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='删除贴吧的回复, 主题帖, 关注的吧, 关注和粉丝')
+    parser.add_argument('-c', '--config', default='config.toml', metavar='PATH', help='配置文件, 默认为 config.toml')
+    parser.add_argument('--cookie', metavar='PATH', help='Cookie 文件, 覆盖 cookie_file, 指定时忽略 [batch]')
+    parser.add_argument('--journal', metavar='PATH', help='进度记录文件, 覆盖 journal_file, 为空字符串时不记录')
+    parser.add_argument('-m', '--modules', nargs='+', choices=module_names, metavar='MODULE',
+                        help=f'只运行这些模块, 忽略配置中的 enable, 可选 {", ".join(module_names)}')
+    parser.add_argument('--start-page', type=int, metavar='N', help='覆盖各模块的 start_page')
+    parser.add_argument('--concurrency', type=int, metavar='N', help='覆盖各模块的 concurrency')
+    parser.add_argument('--rate', type=_positive_float, metavar='PER_SEC', help='覆盖各模块的 rate_per_sec')
+    parser.add_argument('--engine', choices=('threads', 'async'), help='覆盖 engine')
+    parser.add_argument('--filter', metavar='EXPR',
+                        help='只删除符合条件的实体, 覆盖 filter, 例如 "forum:某某吧 before:2020 keyword:词"')
+    parser.add_argument('--from-index', action='store_true',
+                        help='只删除之前收集时保存在 journal_file 中并且符合 --filter 的实体, 不再逐页收集')
+    parser.add_argument('--watch', type=float, metavar='SECONDS',
+                        help='每隔 SECONDS 秒重新运行一次, 每次只检查前 --watch-pages 页, Ctrl+C 结束')
+    parser.add_argument('--watch-pages', type=int, default=2, metavar='N', help='--watch 时每次检查的页数, 默认为 2')
+    parser.add_argument('--enqueue', action='store_true',
+                        help='协调进程: 收集各账号启用的模块的实体写入 [queue] 任务队列, 不执行删除')
+    parser.add_argument('--worker', action='store_true',
+                        help='从 [queue] 任务队列租用任务并删除, 队列中没有等待和进行中的任务后退出')
+    parser.add_argument('--queue', metavar='URL', help='覆盖 [queue] 的 url, SQLite 文件或者 redis://host:port/db')
+    parser.add_argument('--dry-run', action='store_true', help='只收集不删除, 输出各模块的数量')
+    parser.add_argument('--export', metavar='PATH',
+                        help='只收集不删除, 把实体逐条写入 PATH, 以 .csv 结尾时为 CSV, 否则为 JSONL')
+    parser.add_argument('--work-list', metavar='PATH', help='只删除 --export 导出的文件中的实体, 不再逐页收集')
+    return parser.parse_args(argv)
+
+
+def apply_args(config: GlobalConfig, args: argparse.Namespace) -> GlobalConfig:
+    """用命令行参数覆盖配置文件, 返回新的配置"""
+    config = dict(config)
+    if args.cookie:
+        config['cookie_file'] = args.cookie
+        config['batch'] = {}
+    if args.journal is not None:
+        config['journal_file'] = args.journal
+    if args.engine:
+        config['engine'] = args.engine
+    if args.filter is not None:
+        config['filter'] = args.filter
+    if args.queue:
+        config['queue'] = {**config.get('queue', {}), 'url': args.queue}
+
+    if args.rate is not None:
+        # 命令行指定的速度优先于上次运行学到的速度
+        config['adaptive'] = {**config.get('adaptive', {}), 'resume_learned': False}
+    if args.rate is not None and config.get('endpoint_limits'):
+        # --rate 覆盖所有模块的速度, 各组接口的共同限速也一起覆盖, 否则同时运行时仍然被原来的限速卡住
+        config['endpoint_limits'] = {group: {**limit, 'rate_per_sec': args.rate}
+                                     for group, limit in config['endpoint_limits'].items()}
+    overrides = {'start_page': args.start_page, 'concurrency': args.concurrency, 'rate_per_sec': args.rate}
+    if args.watch:
+        overrides['max_pages'] = args.watch_pages
+    for name in module_names:
+        module_config = dict(config.get(name, {}))
+        if args.modules is not None:
+            module_config['enable'] = name in args.modules
+        module_config.update({key: value for key, value in overrides.items() if value is not None})
+        config[name] = module_config
+    return config
+
+
+def run_once(config: GlobalConfig, args: argparse.Namespace, cancel_token: CancellationToken) -> int:
+    """按照配置和命令行参数运行一次, 返回退出码"""
+    if args.enqueue or args.worker:
+        job_queue = open_job_queue(config)
+        try:
+            if args.enqueue:
+                enqueue_accounts(config, account_cookie_files(config), job_queue, cancel_token)
+                logger.info(f'queue: {job_queue.counts()}')
+            else:
+                worker = QueueWorker(config, job_queue, cancel_token)
+                for cookie_file in account_cookie_files(config):
+                    worker.add_account(cookie_file)
+                worker.run()
+        finally:
+            job_queue.close()
+        return 0 if not cancel_token.cancelled else -1
+
+    cookie_files = list_cookie_files(config.get('batch', default_batch_config))
+    collect_only = args.dry_run or args.export
+    if cookie_files and not collect_only and not args.work_list and not args.from_index:
+        summaries = run_accounts(config, cookie_files, cancel_token)
+        return 0 if all(summary.ok for summary in summaries) else -1
+
+    cookie_file = config.get('cookie_file', './cookie.txt')
+    with open(cookie_file, 'r') as f:
+        raw_cookie = f.read()
+
+    session = create_session(config, raw_cookie)
+
+    if not validate_cookie(session, config.get('base_url', default_base_url)):
         logger.fatal('cookie expired, please update it')
+        return -1
+
+    if collect_only:
+        export_entities(build_modules(session, config), args.export, cancel_token)
+        return 0 if not cancel_token.cancelled else -1
+
+    results = run_modules(build_modules(session, config), config, cancel_token, args.work_list, args.from_index)
+    for result in results:
+        if result.status == 'disabled':
+            continue
+        logger.info(f'module [{result.module}] {result.status}, deleted: {result.deleted}, failed: {result.failed}')
+    return 0 if all(result.ok for result in results) else -1
+
+
+def main(argv: typing.Optional[typing.List[str]] = None):
+    args = parse_args(argv)
+    with open(args.config, 'r') as f:
+        config: GlobalConfig = apply_args(toml.load(f), args)
+    try:
+        parse_filter(config.get('filter', ''))  # 表达式有误时在开始前就报错
+    except ValueError as e:
+        logger.fatal(e)
+        sys.exit(-1)
+    if args.from_index and not config.get('journal_file', ''):
+        logger.fatal('--from-index needs journal_file (or --journal) to read the entity index')
         sys.exit(-1)
 
-    module_constructors: typing.List[typing.Callable[[requests.Session, GlobalConfig], Module]] = [
-        ThreadModule, ReplyModule, FollowedBaModule, ConcernModule, FanModule
-    ]
-
-    for module_constructor in module_constructors:
-        module = module_constructor(session, config)
-        module.run()
+    cancel_token = CancellationToken()
+    install_interrupt_handler(cancel_token)
 
+    reporter = start_metrics(config)
+    try:
+        while True:
+            code = run_once(config, args, cancel_token)
+            if not args.watch or cancel_token.cancelled:
+                sys.exit(code)
+            # 定时模式下单次失败 (例如达到上限) 不退出, 下一轮再继续
+            logger.info(f'next run in {args.watch} seconds')
+            if cancel_token.wait(args.watch):
+                sys.exit(code)
+    finally:
+        if reporter is not None:
+            reporter.stop()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,158 @@
+"""
+离线性能测试, 对每个模块在本地模拟服务器上完整跑一遍删除, 输出删除速度, 单页解析耗时和内存峰值
+
+    python -m bench.benchmark --count 200 --concurrency 4 --rate 1000
+    python -m bench.benchmark --latency 0.05 --json bench_result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+import tracemalloc
+import typing
+
+import DeleteMyHistory
+from bench.mock_server import MockTieba, ServerProcess
+
+list_pages = {
+    'thread': ('/i/i/my_tie', DeleteMyHistory.parse_thread_page),
+    'reply': ('/i/i/my_reply', DeleteMyHistory.parse_reply_page),
+    'followed_ba': ('/f/like/mylike', DeleteMyHistory.parse_followed_ba_page),
+    'concern': ('/i/i/concern', DeleteMyHistory.parse_concern_page),
+    'fan': ('/i/i/fans', DeleteMyHistory.parse_fan_page),
+}
+
+
+class BenchmarkResult(typing.NamedTuple):
+    module: str
+    deleted: int
+    failed: int
+    seconds: float
+    deletes_per_sec: float
+    parse_ms_per_page: float
+    peak_memory_kb: float
+    requests: typing.Dict[str, int]
+
+
+def measure_parse(args: argparse.Namespace, name: str, rounds: int) -> float:
+    """解析一个完整的第一页, 页面由单独的 MockTieba 生成, 不受删除后页面变空的影响"""
+    path, parse = list_pages[name]
+    content = MockTieba(args.count, args.per_page).render(path, 1).encode('utf-8')
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parse(content, 'utf-8')
+    return (time.perf_counter() - start) / rounds * 1000
+
+
+async def run_async(module: DeleteMyHistory.Module, config: dict):
+    async with DeleteMyHistory.create_async_client(config, module.session) as client:
+        await module.run_async(client)
+
+
+warm_up_path = '/warm-up'  # 预热请求的路径, 不计入请求数
+
+
+async def warm_up_async(config: dict, session):
+    async with DeleteMyHistory.create_async_client(config, session) as client:
+        await client.get(config['base_url'] + warm_up_path)
+
+
+def run_benchmark(name: str, module_constructor, args: argparse.Namespace) -> BenchmarkResult:
+    # 服务器在子进程中运行, tracemalloc 的峰值只包含被测模块自己的内存
+    server = ServerProcess(args.count, args.per_page, args.latency, args.error_rate, args.limit_after, args.stale,
+                           limit_reset=args.limit_reset, etag=args.etag)
+
+    try:
+        config = {
+            'base_url': f'http://127.0.0.1:{server.server_port}',
+            'journal_file': '',
+            'page_cache_size': args.page_cache_size,
+            'stream_pages': args.stream,
+            'adaptive': {
+                'enable': args.adaptive,
+                'max_rate': args.rate,
+                'limit_cooldown': args.limit_reset or 0,
+                'max_limit_waits': args.max_limit_waits,
+            },
+            name: {
+                'enable': True,
+                'max_error_count': args.max_error_count,
+                'concurrency': args.concurrency,
+                'rate_per_sec': args.rate / 10 if args.adaptive else args.rate,
+                'burst': args.burst,
+                'batch_size': args.batch_size,
+            },
+        }
+        session = DeleteMyHistory.create_session(config, 'BDUSS=benchmark')
+        module = module_constructor(session, config)
+
+        if args.engine == 'async':
+            # 第一次创建客户端和发出请求时才会导入 httpx, h2 等模块, 先预热一次, 避免把导入模块的内存算进峰值
+            asyncio.run(warm_up_async(config, session))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        if args.engine == 'async':
+            asyncio.run(run_async(module, config))
+        else:
+            module.run()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        requests = server.stop()
+        requests.pop(warm_up_path, None)
+
+    return BenchmarkResult(
+        name, module.deleted_count, module.failed_count, seconds,
+        module.deleted_count / seconds if seconds else 0.0,
+        measure_parse(args, name, args.parse_rounds), peak / 1024, requests,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='离线性能测试')
+    parser.add_argument('--count', type=int, default=100, help='每个模块需要删除的实体数量')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='模拟服务器每个请求的延迟 (秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--limit-after', type=int, default=None)
+    parser.add_argument('--limit-reset', type=float, default=None, help='上限每隔多少秒恢复')
+    parser.add_argument('--adaptive', action='store_true', help='开启 AIMD 速度控制, 从 --rate 的 1/10 开始')
+    parser.add_argument('--max-limit-waits', type=int, default=3)
+    parser.add_argument('--stale', action='store_true', help='模拟删除后帖子/回复仍然出现在列表中的 BUG')
+    parser.add_argument('--etag', action='store_true', help='模拟服务器的列表页面支持 ETag/304')
+    parser.add_argument('--page-cache-size', type=int, default=64, help='page_cache_size, 0 为关闭页面缓存')
+    parser.add_argument('--stream', action='store_true', help='stream_pages, 边下载边解析列表页面')
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=1000.0, help='rate_per_sec')
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--max-error-count', type=int, default=3)
+    parser.add_argument('--engine', default='threads', choices=('threads', 'async'))
+    parser.add_argument('--parse-rounds', type=int, default=200, help='测量解析耗时时每页重复解析的次数')
+    parser.add_argument('--modules', nargs='*', default=list(list_pages), choices=list(list_pages))
+    parser.add_argument('--json', dest='json_path', default=None, help='将结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    logging.getLogger(DeleteMyHistory.__name__).setLevel(logging.WARNING)
+
+    results = []
+    for name, module_constructor in zip(DeleteMyHistory.module_names, DeleteMyHistory.module_constructors):
+        if name in args.modules:
+            results.append(run_benchmark(name, module_constructor, args))
+
+    print(f"{'module':<12}{'deleted':>9}{'failed':>8}{'seconds':>10}{'deletes/s':>11}{'parse ms':>10}{'peak KB':>10}")
+    for result in results:
+        print(f'{result.module:<12}{result.deleted:>9}{result.failed:>8}{result.seconds:>10.2f}'
+              f'{result.deletes_per_sec:>11.1f}{result.parse_ms_per_page:>10.3f}{result.peak_memory_kb:>10.1f}')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+"""
+bench/startup.py 测量窗口时间用的入口, 和 gui.main 一样创建窗口, 窗口显示后立即退出
+
+    python -m bench.gui_probe
+
+打包后的程序用 DMH_BUILD_PROBE=1 pyinstaller build.spec 生成 dist/DeleteMyHistoryGUIProbe.exe,
+打包设置和 DeleteMyHistoryGUI.exe 相同
+"""
+import tkinter as tk
+
+import gui
+
+
+def main():
+    root = tk.Tk()
+    gui.GUI(root)
+    root.after_idle(root.destroy)
+    root.mainloop()
+
+
+if __name__ == '__main__':
+    main()
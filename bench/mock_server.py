@@ -0,0 +1,254 @@
+"""
+本地模拟的贴吧服务器, 用于离线测试和性能测试
+
+列表页面由 fixtures 目录下的模板生成, 删除接口会真的把实体从列表中移除,
+可以设置每个请求的延迟, 删除失败的概率, 以及删除多少条之后返回 220034 (limit exceeded), 上限可以在一段时间后恢复
+
+    python -m bench.mock_server --port 8080 --count 200
+
+之后在 config.toml 中设置 base_url = "http://127.0.0.1:8080" 即可让程序连接到模拟服务器
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import string
+import threading
+import time
+import typing
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+fixtures_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name: str) -> string.Template:
+    with open(os.path.join(fixtures_dir, name), 'r', encoding='utf-8') as f:
+        return string.Template(f.read())
+
+
+class MockTieba:
+    """模拟服务器的状态, 所有列表和计数都由 _lock 保护"""
+
+    def __init__(self, count: int = 100, per_page: int = 20, latency: float = 0.0, error_rate: float = 0.0,
+                 limit_after: typing.Optional[int] = None, stale: bool = False, seed: int = 0,
+                 limit_reset: typing.Optional[float] = None, etag: bool = False):
+        self.per_page = per_page
+        self.latency = latency
+        self.error_rate = error_rate
+        self.limit_after = limit_after
+        self.limit_reset = limit_reset  # 每隔多少秒重新计算 limit_after, None 为不恢复
+        self.stale = stale  # 模拟百度的 BUG, 删除后的帖子/回复仍然出现在列表中
+        self.etag = etag  # 列表页面是否返回 ETag 并支持 If-None-Match
+
+        self.threads = [(str(7000000000 + i), str(130000000000 + i)) for i in range(count)]
+        self.replies = [(str(8000000000 + i), str(140000000000 + i), str(150000000000 + i) if i % 3 == 0 else '0')
+                        for i in range(count)]
+        self.forums = [(str(100000 + i), f'模拟吧{i}') for i in range(count)]
+        self.concerns = [f'tb.1.concern{i:08x}' for i in range(count)]
+        self.fans = [f'tb.1.fan{i:08x}' for i in range(count)]
+
+        self.deleted = 0
+        self._window_start = time.monotonic()
+        self._window_deleted = 0
+        self.requests: typing.Dict[str, int] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        self._layout = load_fixture('layout.html')
+        self._items = {
+            '/i/i/my_tie': load_fixture('my_tie_item.html'),
+            '/i/i/my_reply': load_fixture('my_reply_item.html'),
+            '/f/like/mylike': load_fixture('mylike_item.html'),
+            '/i/i/concern': load_fixture('concern_item.html'),
+            '/i/i/fans': load_fixture('fans_item.html'),
+        }
+
+    @staticmethod
+    def _post_meta(index: int) -> typing.Dict[str, str]:
+        # 帖子和回复分布在 5 个吧, 时间从 2015 年到 2024 年, 用于测试按吧名和时间筛选
+        fname = f'模拟吧{index % 5}'
+        return {'fname': fname, 'fname_q': urllib.parse.quote(fname), 'time': f'{2015 + index % 10}-05-01 12:00'}
+
+    def _page(self, entities: list, page: int) -> list:
+        return entities[(page - 1) * self.per_page:page * self.per_page]
+
+    def render(self, path: str, page: int) -> str:
+        item = self._items[path]
+        with self._lock:
+            if path == '/i/i/my_tie':
+                items = [item.substitute(tid=tid, pid=pid, **self._post_meta(int(tid) - 7000000000))
+                         for tid, pid in self._page(self.threads, page)]
+            elif path == '/i/i/my_reply':
+                items = [item.substitute(tid=tid, pid=pid, cid=cid, **self._post_meta(int(tid) - 8000000000))
+                         for tid, pid, cid in self._page(self.replies, page)]
+            elif path == '/f/like/mylike':
+                items = [item.substitute(fid=fid, fname=fname, tbs='mocklongtbs0123456789')
+                         for fid, fname in self._page(self.forums, page)]
+            elif path == '/i/i/concern':
+                items = [item.substitute(portrait=portrait, tbs='mocklongtbs0123456789')
+                         for portrait in self._page(self.concerns, page)]
+            else:
+                items = [item.substitute(portrait=portrait) for portrait in self._page(self.fans, page)]
+
+        return self._layout.substitute(title=path, short_tbs='mockshorttbs0123', items='\n'.join(items),
+                                       prev_page=max(page - 1, 1), next_page=page + 1)
+
+    def delete(self, path: str, form: typing.Dict[str, str]) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            if self.limit_reset is not None and now - self._window_start >= self.limit_reset:
+                self._window_start, self._window_deleted = now, 0
+            if self.limit_after is not None and self._window_deleted >= self.limit_after:
+                return {'no': 220034, 'err_code': 220034, 'error': 'limit exceeded'}
+            if self._random.random() < self.error_rate:
+                return {'no': 1, 'err_code': 1, 'error': 'mock error'}
+
+            if path == '/f/commit/post/delete':
+                if not self.stale:
+                    self.threads = [i for i in self.threads if (i[0], i[1]) != (form.get('tid'), form.get('pid'))]
+                    self.replies = [i for i in self.replies
+                                    if i[0] != form.get('tid') or form.get('pid') not in (i[1], i[2])]
+            elif path == '/f/like/commit/delete':
+                self.forums = [i for i in self.forums if i[0] != form.get('fid')]
+            elif path == '/home/post/unfollow':
+                self.concerns = [i for i in self.concerns if i != form.get('id')]
+            elif path == '/i/commit':
+                self.fans = [i for i in self.fans if i != form.get('portrait')]
+
+            self.deleted += 1
+            self._window_deleted += 1
+            return {'no': 0, 'err_code': 0, 'error': '', 'data': {}}
+
+    def count_request(self, path: str):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+
+list_paths = ('/i/i/my_tie', '/i/i/my_reply', '/f/like/mylike', '/i/i/concern', '/i/i/fans')
+delete_paths = ('/f/commit/post/delete', '/f/like/commit/delete', '/home/post/unfollow', '/i/commit')
+
+
+def make_handler(state: MockTieba) -> typing.Type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _send(self, body: str, content_type: str, etag: bool = False):
+            data = body.encode('utf-8')
+            if etag:
+                # 列表页面支持条件请求, 内容没有变化时返回 304
+                tag = f'"{hashlib.sha1(data).hexdigest()[:16]}"'
+                if state.etag and self.headers.get('If-None-Match') == tag:
+                    self.send_response(304)
+                    self.send_header('ETag', tag)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+            self.send_response(200)
+            self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            if etag and state.etag:
+                self.send_header('ETag', tag)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urllib.parse.urlparse(self.path)
+            state.count_request(url.path)
+            time.sleep(state.latency)
+
+            if url.path == '/dc/common/tbs':
+                self._send(json.dumps({'tbs': 'mocklongtbs0123456789', 'is_login': 1}), 'application/json')
+            elif url.path in list_paths:
+                page = int(urllib.parse.parse_qs(url.query).get('pn', ['1'])[0])
+                self._send(state.render(url.path, page), 'text/html', etag=True)
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            url = urllib.parse.urlparse(self.path)
+            state.count_request(url.path)
+            length = int(self.headers.get('Content-Length', 0))
+            form = dict(urllib.parse.parse_qsl(self.rfile.read(length).decode('utf-8')))
+            time.sleep(state.latency)
+
+            if url.path in delete_paths:
+                self._send(json.dumps(state.delete(url.path, form)), 'application/json')
+            else:
+                self.send_error(404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(state: MockTieba, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """在后台线程中启动服务器, port 为 0 时随机选择端口"""
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-tieba', daemon=True).start()
+    return server
+
+
+def _serve_process(conn, args: tuple, kwargs: dict):
+    state = MockTieba(*args, **kwargs)
+    server = start_server(state)
+    conn.send(server.server_port)
+    conn.recv()
+    server.shutdown()
+    server.server_close()
+    conn.send(dict(state.requests))
+
+
+class ServerProcess:
+    """
+    在子进程中运行模拟服务器, 参数和 MockTieba 相同, 性能测试时服务器占用的内存和 CPU 不计入被测进程
+    stop 停止服务器并返回各个路径的请求数
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._conn, child = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_serve_process, args=(child, args, kwargs),
+                                                name='mock-tieba', daemon=True)
+        self._process.start()
+        self.server_port: int = self._conn.recv()
+
+    def stop(self) -> typing.Dict[str, int]:
+        self._conn.send('stop')
+        requests = self._conn.recv()
+        self._process.join()
+        self._conn.close()
+        return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的贴吧服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--count', type=int, default=100, help='每种实体的数量')
+    parser.add_argument('--per-page', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟 (秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='删除失败的概率')
+    parser.add_argument('--limit-after', type=int, default=None, help='删除多少条之后返回 220034')
+    parser.add_argument('--limit-reset', type=float, default=None, help='上限每隔多少秒恢复')
+    parser.add_argument('--stale', action='store_true', help='删除后的帖子/回复仍然出现在列表中')
+    parser.add_argument('--etag', action='store_true', help='列表页面返回 ETag, 内容没有变化时返回 304')
+    args = parser.parse_args()
+
+    state = MockTieba(args.count, args.per_page, args.latency, args.error_rate, args.limit_after, args.stale,
+                      limit_reset=args.limit_reset, etag=args.etag)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    print(f'mock tieba listening on http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+启动时间测试, 输出导入各个入口模块的耗时, 以及图形界面从启动进程到显示窗口的时间
+
+    python -m bench.startup --runs 5
+    python -m bench.startup --exe dist/DeleteMyHistoryGUIProbe.exe --json startup_result.json
+
+导入耗时来自 python -X importtime, 窗口时间为启动 bench/gui_probe.py (或 --exe 指定的打包程序, 见 gui_probe.py),
+窗口显示后立即退出的进程总耗时, 没有图形环境时跳过
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import typing
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# gui 在窗口显示之前不应该导入这些模块
+deferred_modules = ('DeleteMyHistory', 'requests', 'lxml', 'asyncio', 'metrics')
+
+
+class ImportResult(typing.NamedTuple):
+    module: str
+    total_ms: float
+    slowest: typing.List[typing.Tuple[str, float]]  # 自身耗时最多的几个模块
+    imported: typing.List[str]  # deferred_modules 中被导入的模块
+
+
+def import_times(module: str) -> typing.Dict[str, typing.Tuple[float, float]]:
+    """在新的进程中导入 module, 返回 python -X importtime 记录的 {模块: (自身耗时, 累计耗时)}, 单位为毫秒"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                          cwd=repo_dir, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        # import time:       self |  cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us) / 1000, int(cumulative_us) / 1000)
+    return times
+
+
+def measure_import(module: str, top: int) -> ImportResult:
+    times = import_times(module)
+    slowest = sorted(((name, self_ms) for name, (self_ms, _) in times.items()), key=lambda i: i[1], reverse=True)
+    imported = [name for name in deferred_modules if name in times]
+    return ImportResult(module, times[module][1], slowest[:top], imported)
+
+
+def measure_window(command: typing.List[str], runs: int) -> typing.Optional[typing.List[float]]:
+    """启动 runs 次图形界面, 返回每次显示窗口并退出的耗时 (秒), 无法显示窗口时返回 None"""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(command, cwd=repo_dir, capture_output=True, text=True)
+        if proc.returncode != 0 or 'TclError' in proc.stdout + proc.stderr:
+            return None
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='启动时间测试')
+    parser.add_argument('--runs', type=int, default=5, help='启动图形界面的次数, 取中位数')
+    parser.add_argument('--top', type=int, default=5, help='显示自身导入耗时最多的模块数')
+    parser.add_argument('--exe', default=None, help='测量打包后的 DeleteMyHistoryGUIProbe.exe 而不是 gui_probe.py')
+    parser.add_argument('--json', dest='json_path', default=None, help='将结果保存为 JSON 文件')
+    args = parser.parse_args()
+
+    results = {'imports': [], 'window': None}
+    for module in ('gui', 'DeleteMyHistory'):
+        result = measure_import(module, args.top)
+        results['imports'].append(result._asdict())
+        print(f'import {module:<16}{result.total_ms:>9.1f} ms')
+        for name, self_ms in result.slowest:
+            print(f'    {name:<28}{self_ms:>9.1f} ms')
+        if module == 'gui' and result.imported:
+            print(f'    warning: gui imports {", ".join(result.imported)} before the window is shown')
+
+    command = [args.exe] if args.exe else [sys.executable, '-m', 'bench.gui_probe']
+    seconds = measure_window(command, args.runs)
+    if seconds is None:
+        print('time to window: skipped (no display)')
+    else:
+        results['window'] = {'command': command, 'seconds': seconds, 'median': statistics.median(seconds)}
+        print(f'time to window: {statistics.median(seconds):.3f} s (median of {len(seconds)})')
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,62 @@
 # -*- mode: python ; coding: utf-8 -*-
+import os
 
 block_cipher = None
 
-a = Analysis(
-    ['DeleteMyHistory.py'],
-    pathex=[],
-    binaries=[],
-    datas=[],
-    hiddenimports=[],
-    hookspath=[],
-    runtime_hooks=[],
-    excludes=[],
-    win_no_prefer_redirects=False,
-    win_private_assemblies=False,
-    cipher=block_cipher,
-    noarchive=False,
-)
-pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
-
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
-    [],
-    name='DeleteMyHistory.exe',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=True,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+# 单文件程序每次启动都要先解压全部内容, 不打包用不到的模块可以缩短启动时间
+excludes = [
+    'bs4', 'unittest', 'pydoc', 'doctest', 'pdb',
+    'lxml.html', 'lxml.objectify', 'lxml.isoschematron',
+]
+
+
+def analysis(script, extra_excludes=(), pathex=()):
+    return Analysis(
+        [script],
+        pathex=list(pathex),
+        binaries=[],
+        datas=[],
+        hiddenimports=[],
+        hookspath=[],
+        runtime_hooks=[],
+        excludes=excludes + list(extra_excludes),
+        win_no_prefer_redirects=False,
+        win_private_assemblies=False,
+        cipher=block_cipher,
+        noarchive=False,
+    )
+
+
+def executable(a, name, console):
+    pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
+    return EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.zipfiles,
+        a.datas,
+        [],
+        name=name,
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,  # UPX 压缩过的文件每次启动还要再解压一次, 体积小一点但启动更慢
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=console,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+
+
+# 命令行版本用不到 Tcl/Tk, 不打包可以少解压几 MB
+cli = executable(analysis('DeleteMyHistory.py', extra_excludes=['tkinter']), 'DeleteMyHistory.exe', console=True)
+gui = executable(analysis('gui.py'), 'DeleteMyHistoryGUI.exe', console=False)
+
+if os.environ.get('DMH_BUILD_PROBE'):
+    # bench/startup.py --exe 使用, 打包设置和 DeleteMyHistoryGUI.exe 相同, 窗口显示后立即退出
+    probe = executable(analysis(os.path.join('bench', 'gui_probe.py'), pathex=[SPECPATH]),
+                       'DeleteMyHistoryGUIProbe.exe', console=False)
@@ -1,10 +1,11 @@
 import tkinter as tk
 import traceback
-from tkinter import scrolledtext, messagebox
+from tkinter import scrolledtext, messagebox, ttk
 import threading
 import logging
+import queue
 import toml
-from DeleteMyHistory import DeleteMyHistory  # 导入你的业务逻辑类
+# DeleteMyHistory 会加载 requests, lxml 等模块, 在窗口显示之后才导入, 见 GUI.history_manager
 
 logging.basicConfig(level=logging.INFO, format='[%(asctime)s] [%(levelname)s] %(message)s')
 logger = logging.getLogger(__name__)
@@ -17,12 +18,26 @@ class GUI:
         # 设置窗口最小尺寸
         self.root.minsize(500, 400)
 
-        # 创建 DeleteMyHistory 实例，并传入日志回调函数
-        self.history_manager = DeleteMyHistory(log_callback=self.log_to_gui)
+        # DeleteMyHistory 实例在第一次使用时才创建
+        self._history_manager = None
+        self._history_manager_lock = threading.Lock()
 
         # 配置文件路径
         self.config_path = './config.toml'
 
+        # 工作线程的日志先放进队列, 由 Tk 主线程定时批量写入日志窗口
+        self.log_queue = queue.Queue()
+        self.max_log_lines = 1000  # 日志窗口最多保留的行数
+        self.max_log_batch = 500  # 每次最多写入的日志条数
+        self.log_interval = 100  # 刷新间隔 (毫秒)
+        self.log_file = None  # 完整日志的保存位置, 日志窗口只保留最近的部分
+        self.call_queue = queue.Queue()  # 工作线程中需要在主线程执行的操作, 例如弹出错误提示
+
+        # 进度同样通过队列交给主线程, 每个模块只显示最新的一条
+        self.progress_queue = queue.Queue()
+        self.progress_interval = 250  # 进度刷新间隔 (毫秒)
+        self.progress_rows = {}  # 模块名 -> (进度条, 状态文字)
+
         # 创建多行文本框用于输入 Cookie
         self.cookie_label = tk.Label(root, text="请输入Cookie:")
         self.cookie_label.grid(row=0, column=0, padx=10, pady=10, sticky="e")  # 右对齐
@@ -71,6 +86,11 @@ class GUI:
         self.fan_check = tk.Checkbutton(self.module_frame, text="清理粉丝", variable=self.module_vars["FanModule"])
         self.fan_check.grid(row=1, column=1, padx=10, sticky="w")
 
+        # 创建进度面板, 每个运行中的模块一行
+        self.progress_frame = tk.Frame(root)
+        self.progress_frame.grid(row=2, column=0, columnspan=2, padx=10, sticky="we")
+        self.progress_frame.columnconfigure(1, weight=1)
+
         # 创建日志窗口
         self.log_text = scrolledtext.ScrolledText(root, width=60, height=10)
         self.log_text.grid(row=3, column=0, columnspan=2, padx=10, pady=10)
@@ -85,13 +105,145 @@ class GUI:
         self.stop_button = tk.Button(self.button_frame, text="终止执行", width=15, command=self.stop)
         self.stop_button.grid(row=0, column=1, padx=10)
 
+        # 运行中调整速度和并发, 不需要重新启动
+        self.control_frame = tk.Frame(root)
+        self.control_frame.grid(row=5, column=0, columnspan=2, pady=(0, 10))
+
+        tk.Label(self.control_frame, text="速度(次/秒):").grid(row=0, column=0, padx=5)
+        self.rate_var = tk.StringVar(value="1.0")
+        tk.Entry(self.control_frame, textvariable=self.rate_var, width=8).grid(row=0, column=1, padx=5)
+
+        tk.Label(self.control_frame, text="并发数:").grid(row=0, column=2, padx=5)
+        self.concurrency_var = tk.StringVar(value="1")
+        tk.Spinbox(self.control_frame, from_=1, to=32, textvariable=self.concurrency_var, width=5).grid(row=0, column=3, padx=5)
+
+        self.apply_button = tk.Button(self.control_frame, text="应用", width=8, command=self.apply_speed)
+        self.apply_button.grid(row=0, column=4, padx=10)
+
         # 初始化时加载配置文件
         self.load_config()
+        self.root.after(self.log_interval, self.drain_log_queue)
+        self.root.after(self.progress_interval, self.drain_progress_queue)
+        # 窗口显示后在后台提前导入业务逻辑, 第一次点击执行时不用再等待
+        self.root.after(self.log_interval, lambda: threading.Thread(target=self.preload, daemon=True).start())
+
+    @property
+    def history_manager(self):
+        """第一次使用时才导入 DeleteMyHistory 并创建实例, 可以在任意线程中调用"""
+        with self._history_manager_lock:
+            if self._history_manager is None:
+                from DeleteMyHistory import DeleteMyHistory
+                self._history_manager = DeleteMyHistory(log_callback=self.log_to_gui,
+                                                        progress_callback=self.progress_to_gui)
+            return self._history_manager
+
+    def preload(self):
+        try:
+            self.history_manager
+        except Exception as e:
+            self.log_to_gui(f"加载失败: {e}")
+
+    def call_in_main(self, func, *args):
+        """让 Tk 主线程执行 func, 可以在任意线程中调用"""
+        self.call_queue.put((func, args))
 
     def log_to_gui(self, message):
-        """直接将日志输出到 GUI 的日志窗口"""
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
+        """将日志放入队列, 可以在任意线程中调用"""
+        self.log_queue.put(message)
+
+    def drain_log_queue(self):
+        """在 Tk 主线程中批量写入队列中的日志, 并删除超出 max_log_lines 的旧日志"""
+        messages = []
+        try:
+            while len(messages) < self.max_log_batch:
+                messages.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if messages:
+            text = "\n".join(messages) + "\n"
+            self.log_text.insert(tk.END, text)
+
+            # 最后一行是空行, 实际行数要减一
+            excess = int(self.log_text.index('end-1c').split('.')[0]) - 1 - self.max_log_lines
+            if excess > 0:
+                self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.log_text.see(tk.END)
+
+            if self.log_file:
+                try:
+                    with open(self.log_file, 'a', encoding='utf-8') as f:
+                        f.write(text)
+                except OSError as e:
+                    logger.error(f"写入日志文件失败: {e}")
+                    self.log_file = None
+
+        while not self.call_queue.empty():
+            func, args = self.call_queue.get_nowait()
+            func(*args)
+
+        # 队列中还有日志时尽快继续处理
+        self.root.after(1 if not self.log_queue.empty() else self.log_interval, self.drain_log_queue)
+
+    def progress_to_gui(self, event):
+        """将进度放入队列, 可以在任意线程中调用"""
+        self.progress_queue.put(event)
+
+    def drain_progress_queue(self):
+        """在 Tk 主线程中更新进度条, 同一个模块积压的多条进度只显示最新的"""
+        latest = {}
+        try:
+            while True:
+                event = self.progress_queue.get_nowait()
+                latest[event.module] = event
+        except queue.Empty:
+            pass
+
+        for event in latest.values():
+            self.show_progress(event)
+
+        self.root.after(self.progress_interval, self.drain_progress_queue)
+
+    def show_progress(self, event):
+        """显示一个模块的进度, 后面还有页面没收集时总数会继续增加, 剩余时间只是按当前速度估算"""
+        if event.module not in self.progress_rows:
+            row = len(self.progress_rows)
+            tk.Label(self.progress_frame, text=event.module).grid(row=row, column=0, padx=5, sticky="w")
+            bar = ttk.Progressbar(self.progress_frame, length=200, mode="determinate")
+            bar.grid(row=row, column=1, padx=5, sticky="we")
+            status = tk.Label(self.progress_frame, anchor="w")
+            status.grid(row=row, column=2, padx=5, sticky="w")
+            self.progress_rows[event.module] = (bar, status)
+
+        bar, status = self.progress_rows[event.module]
+        bar["maximum"] = max(event.found, 1)
+        bar["value"] = event.deleted + event.failed
+
+        if event.finished:
+            eta = "已结束"
+        elif event.eta is None:
+            eta = "剩余时间: --"
+        else:
+            minutes, seconds = divmod(int(event.eta), 60)
+            eta = f"剩余时间: {minutes}:{seconds:02d}"
+        status["text"] = (f"第 {event.page} 页, 已删除 {event.deleted}/{event.found}, 失败 {event.failed}, "
+                          f"{event.rate:.2f} 次/秒, {eta}")
+
+    def apply_speed(self):
+        """把速度和并发数应用到正在运行的模块"""
+        try:
+            rate = float(self.rate_var.get())
+            concurrency = int(self.concurrency_var.get())
+            if rate <= 0 or concurrency < 1:
+                raise ValueError("速度必须大于 0, 并发数至少为 1")
+        except ValueError as e:
+            messagebox.showerror("错误", f"速度或并发数无效: {e}")
+            return
+
+        if self._history_manager is None:
+            return  # 还没有运行过, 没有需要调整的模块
+        self.history_manager.set_rate(rate)
+        self.history_manager.set_concurrency(concurrency)
 
     def load_config(self):
         """加载配置文件，初始化复选框状态"""
@@ -105,6 +257,10 @@ class GUI:
                 if config_module in config and 'enable' in config[config_module]:
                     self.module_vars[gui_module].set(1 if config[config_module]['enable'] else 0)
 
+            gui_config = config.get('gui', {})
+            self.max_log_lines = gui_config.get('max_log_lines', self.max_log_lines)
+            self.log_file = gui_config.get('log_file') or None
+
             self.log_to_gui("加载上次执行功能成功")
 
         except Exception as e:
@@ -148,10 +304,16 @@ class GUI:
             messagebox.showerror("错误", "请至少选择一个模块")
             return
 
-        try:
-            # 更新配置文件，确保用户选择的模块被启用
-            self.update_config(selected_modules)
+        # 更新配置文件，确保用户选择的模块被启用
+        self.update_config(selected_modules)
 
+        # 检查 Cookie 需要网络请求, 放到后台线程中, 不阻塞窗口
+        self.log_to_gui("正在检查 Cookie")
+        threading.Thread(target=self.start_task, args=(cookie, selected_modules), daemon=True).start()
+
+    def start_task(self, cookie, selected_modules):
+        """在后台线程中加载配置并检查 Cookie, 成功后运行用户选择的模块"""
+        try:
             # 加载更新后的配置文件
             self.history_manager.load_config(self.config_path, cookie)
             self.history_manager.start()
@@ -162,7 +324,7 @@ class GUI:
 
         except Exception as e:
             self.log_to_gui(f"任务启动失败: {e}")
-            messagebox.showerror("错误", f"任务启动失败: {e}")
+            self.call_in_main(messagebox.showerror, "错误", f"任务启动失败: {e}")
 
     def run_module(self, module_name):
         """运行指定的模块"""
@@ -175,7 +337,8 @@ class GUI:
 
     def stop(self):
         """终止执行"""
-        self.history_manager.stop()
+        if self._history_manager is not None:
+            self.history_manager.stop()
         self.log_to_gui("任务已终止")
 
 def main():
@@ -0,0 +1,337 @@
+"""
+分布式删除用的任务队列: 协调进程收集实体后写入队列, 一个或多个机器上的 worker 进程租用任务并执行删除
+
+默认使用 SQLite 文件, 适合同一台机器上的多个进程 (或者放在支持文件锁的共享目录中),
+地址以 redis:// 或 rediss:// 开头时使用 Redis (需要 pip install redis)
+
+任务至少执行一次: worker 租用任务后在 lease 时间内没有确认, 任务会重新分配给其他 worker, 同时计入一次失败
+任务 id 由账号, 模块和实体的 key 决定, 重复写入同一个实体不会产生新任务, 已经完成的任务不会再次执行
+"""
+import abc
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import typing
+
+statuses = ('pending', 'leased', 'done', 'failed')
+
+
+class Job(typing.NamedTuple):
+    id: str
+    account: str
+    module: str
+    entity: typing.Dict[str, str]
+    failures: int
+
+
+def job_id(account: str, module: str, key: str) -> str:
+    return hashlib.sha256(f'{account}\0{module}\0{key}'.encode()).hexdigest()[:32]
+
+
+class JobQueue(abc.ABC):
+    """
+    任务状态为 pending (等待租用), leased (已被 worker 租用), done (已完成) 或 failed (失败次数达到 max_attempts)
+    只有租用任务的 worker 可以放回任务, 确认完成不检查 worker, 租约过期后才完成的任务同样算作完成
+    """
+    _max_attempts: int
+
+    def __init__(self, max_attempts: int = 5):
+        self._max_attempts = max_attempts
+
+    @abc.abstractmethod
+    def put(self, jobs: typing.Iterable[typing.Tuple[str, str, str, typing.Dict[str, str]]]) -> int:
+        """写入 (账号, 模块, 实体的 key, 实体), 返回新增的任务数"""
+
+    @abc.abstractmethod
+    def lease(self, worker: str, count: int, lease_seconds: float,
+              accounts: typing.Optional[typing.Collection[str]] = None) -> typing.List[Job]:
+        """租用最多 count 个可以执行的任务, accounts 不为 None 时只租用这些账号的任务"""
+
+    @abc.abstractmethod
+    def ack(self, job: Job, worker: str):
+        """任务已经完成"""
+
+    @abc.abstractmethod
+    def release(self, job: Job, worker: str, delay: float = 0, failed: bool = False) -> str:
+        """
+        把租用的任务放回队列, delay 秒后才能再次租用, failed 为 True 时计入失败次数
+        返回任务的新状态, 租约已经过期被别人租用时不做修改
+        """
+
+    @abc.abstractmethod
+    def counts(self, accounts: typing.Optional[typing.Collection[str]] = None) -> typing.Dict[str, int]:
+        """各状态的任务数, accounts 不为 None 时只统计这些账号的任务"""
+
+    def close(self):
+        pass
+
+
+class SqliteJobQueue(JobQueue):
+    _path: str
+    _conn: sqlite3.Connection
+
+    def __init__(self, path: str, max_attempts: int = 5):
+        super().__init__(max_attempts)
+        self._path = path
+        self._lock = threading.Lock()
+        # 手动管理事务, 租用时用 BEGIN IMMEDIATE 避免多个进程租到同一个任务
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute('CREATE TABLE IF NOT EXISTS job ('
+                               'id TEXT NOT NULL PRIMARY KEY, account TEXT NOT NULL, module TEXT NOT NULL, '
+                               'entity TEXT NOT NULL, status TEXT NOT NULL, failures INTEGER NOT NULL, '
+                               'worker TEXT, available_at REAL NOT NULL, updated_at REAL NOT NULL)')
+            # pending 和 leased 的任务都按 available_at 查找, 分别为可以租用和租约过期的时间
+            self._conn.execute('CREATE INDEX IF NOT EXISTS job_available ON job (status, account, available_at)')
+
+    def _transaction(self, func: typing.Callable[[], typing.Any]):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func()
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def put(self, jobs: typing.Iterable[typing.Tuple[str, str, str, typing.Dict[str, str]]]) -> int:
+        now = time.time()
+        rows = [(job_id(account, module, key), account, module, json.dumps(entity, ensure_ascii=False), now, now)
+                for account, module, key, entity in jobs]
+
+        def insert() -> int:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO job VALUES (?, ?, ?, ?, 'pending', 0, NULL, ?, ?)", rows)
+            return self._conn.total_changes - before
+
+        return self._transaction(insert)
+
+    def lease(self, worker: str, count: int, lease_seconds: float,
+              accounts: typing.Optional[typing.Collection[str]] = None) -> typing.List[Job]:
+        if accounts is not None and not accounts:
+            return []
+
+        def take() -> typing.List[Job]:
+            now = time.time()
+            sql = ("SELECT id, account, module, entity, status, failures FROM job "
+                   "WHERE status IN ('pending', 'leased') AND available_at <= ?")
+            params: typing.List[typing.Any] = [now]
+            if accounts is not None:
+                sql += f" AND account IN ({', '.join('?' * len(accounts))})"
+                params.extend(accounts)
+            rows = self._conn.execute(sql + ' ORDER BY available_at LIMIT ?', [*params, count]).fetchall()
+
+            jobs = []
+            for id_, account, module, entity, status, failures in rows:
+                if status == 'leased':
+                    failures += 1  # 上一个 worker 没有在租约内完成
+                if failures >= self._max_attempts:
+                    self._conn.execute("UPDATE job SET status = 'failed', failures = ?, updated_at = ? WHERE id = ?",
+                                       (failures, now, id_))
+                    continue
+                self._conn.execute("UPDATE job SET status = 'leased', failures = ?, worker = ?, available_at = ?, "
+                                   "updated_at = ? WHERE id = ?", (failures, worker, now + lease_seconds, now, id_))
+                jobs.append(Job(id_, account, module, json.loads(entity), failures))
+            return jobs
+
+        return self._transaction(take)
+
+    def ack(self, job: Job, worker: str):
+        with self._lock:
+            self._conn.execute("UPDATE job SET status = 'done', worker = ?, updated_at = ? "
+                               "WHERE id = ? AND status != 'done'", (worker, time.time(), job.id))
+
+    def release(self, job: Job, worker: str, delay: float = 0, failed: bool = False) -> str:
+        def update() -> str:
+            row = self._conn.execute('SELECT status, worker, failures FROM job WHERE id = ?', (job.id,)).fetchone()
+            if row is None:
+                return 'done'
+            status, leased_by, failures = row
+            if status != 'leased' or leased_by != worker:
+                return status
+
+            now = time.time()
+            failures += 1 if failed else 0
+            status = 'failed' if failures >= self._max_attempts else 'pending'
+            self._conn.execute('UPDATE job SET status = ?, failures = ?, available_at = ?, updated_at = ? '
+                               'WHERE id = ?', (status, failures, now + delay, now, job.id))
+            return status
+
+        return self._transaction(update)
+
+    def counts(self, accounts: typing.Optional[typing.Collection[str]] = None) -> typing.Dict[str, int]:
+        sql, params = 'SELECT status, COUNT(*) FROM job', []
+        if accounts is not None:
+            sql += f" WHERE account IN ({', '.join('?' * len(accounts))})"
+            params.extend(accounts)
+        with self._lock:
+            rows = self._conn.execute(sql + ' GROUP BY status', params).fetchall()
+        return {**dict.fromkeys(statuses, 0), **dict(rows)}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# 每个任务是一个 hash, 每个账号的 pending 和 leased 任务按 available_at 放在一个有序集合中,
+# 各状态的数量放在 counts 中, 每个账号各状态的数量放在 counts:账号 中
+# 所有修改都在 Lua 脚本中完成, 多个 worker 同时操作也不会租到同一个任务
+_redis_put = """
+local key = ARGV[1] .. 'job:' .. ARGV[2]
+if redis.call('EXISTS', key) == 1 then
+  return 0
+end
+redis.call('HSET', key, 'account', ARGV[3], 'module', ARGV[4], 'entity', ARGV[5], 'status', 'pending', 'failures', 0)
+redis.call('ZADD', ARGV[1] .. 'available:' .. ARGV[3], ARGV[6], ARGV[2])
+redis.call('SADD', ARGV[1] .. 'accounts', ARGV[3])
+redis.call('HINCRBY', ARGV[1] .. 'counts', 'pending', 1)
+redis.call('HINCRBY', ARGV[1] .. 'counts:' .. ARGV[3], 'pending', 1)
+return 1
+"""
+
+_redis_lease = """
+local available = ARGV[1] .. 'available:' .. ARGV[2]
+local counts = ARGV[1] .. 'counts'
+local account_counts = ARGV[1] .. 'counts:' .. ARGV[2]
+local ids = redis.call('ZRANGEBYSCORE', available, '-inf', ARGV[3], 'LIMIT', 0, tonumber(ARGV[4]))
+local jobs = {}
+for _, id in ipairs(ids) do
+  local key = ARGV[1] .. 'job:' .. id
+  local status = redis.call('HGET', key, 'status')
+  local failures = tonumber(redis.call('HGET', key, 'failures'))
+  if status == 'leased' then
+    failures = failures + 1
+  end
+  redis.call('HINCRBY', counts, status, -1)
+  redis.call('HINCRBY', account_counts, status, -1)
+  if failures >= tonumber(ARGV[7]) then
+    redis.call('HSET', key, 'status', 'failed', 'failures', failures)
+    redis.call('HINCRBY', counts, 'failed', 1)
+    redis.call('HINCRBY', account_counts, 'failed', 1)
+    redis.call('ZREM', available, id)
+  else
+    redis.call('HSET', key, 'status', 'leased', 'failures', failures, 'worker', ARGV[5])
+    redis.call('HINCRBY', counts, 'leased', 1)
+    redis.call('HINCRBY', account_counts, 'leased', 1)
+    redis.call('ZADD', available, ARGV[6], id)
+    table.insert(jobs, {id, redis.call('HGET', key, 'module'), redis.call('HGET', key, 'entity'), failures})
+  end
+end
+return jobs
+"""
+
+_redis_ack = """
+local key = ARGV[1] .. 'job:' .. ARGV[2]
+local status = redis.call('HGET', key, 'status')
+if not status or status == 'done' then
+  return 0
+end
+local account = redis.call('HGET', key, 'account')
+redis.call('HINCRBY', ARGV[1] .. 'counts', status, -1)
+redis.call('HINCRBY', ARGV[1] .. 'counts', 'done', 1)
+redis.call('HINCRBY', ARGV[1] .. 'counts:' .. account, status, -1)
+redis.call('HINCRBY', ARGV[1] .. 'counts:' .. account, 'done', 1)
+redis.call('HSET', key, 'status', 'done', 'worker', ARGV[3])
+redis.call('ZREM', ARGV[1] .. 'available:' .. account, ARGV[2])
+return 1
+"""
+
+_redis_release = """
+local key = ARGV[1] .. 'job:' .. ARGV[2]
+local status = redis.call('HGET', key, 'status')
+if not status then
+  return 'done'
+end
+if status ~= 'leased' or redis.call('HGET', key, 'worker') ~= ARGV[3] then
+  return status
+end
+local failures = tonumber(redis.call('HGET', key, 'failures')) + tonumber(ARGV[5])
+local account = redis.call('HGET', key, 'account')
+local available = ARGV[1] .. 'available:' .. account
+status = 'pending'
+if failures >= tonumber(ARGV[6]) then
+  status = 'failed'
+  redis.call('ZREM', available, ARGV[2])
+else
+  redis.call('ZADD', available, ARGV[4], ARGV[2])
+end
+redis.call('HSET', key, 'status', status, 'failures', failures)
+redis.call('HINCRBY', ARGV[1] .. 'counts', 'leased', -1)
+redis.call('HINCRBY', ARGV[1] .. 'counts', status, 1)
+redis.call('HINCRBY', ARGV[1] .. 'counts:' .. account, 'leased', -1)
+redis.call('HINCRBY', ARGV[1] .. 'counts:' .. account, status, 1)
+return status
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """和 SqliteJobQueue 相同的语义, 适合多台机器共用一个队列, 脚本只使用基本命令, 兼容 Redis 协议的服务都可以使用"""
+    _prefix: str
+
+    def __init__(self, url: str, max_attempts: int = 5, prefix: str = 'dmh:'):
+        import redis
+
+        super().__init__(max_attempts)
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._put = self._client.register_script(_redis_put)
+        self._lease = self._client.register_script(_redis_lease)
+        self._ack = self._client.register_script(_redis_ack)
+        self._release = self._client.register_script(_redis_release)
+
+    def put(self, jobs: typing.Iterable[typing.Tuple[str, str, str, typing.Dict[str, str]]]) -> int:
+        now = time.time()
+        added = 0
+        for account, module, key, entity in jobs:
+            added += self._put(args=[self._prefix, job_id(account, module, key), account, module,
+                                     json.dumps(entity, ensure_ascii=False), now])
+        return added
+
+    def lease(self, worker: str, count: int, lease_seconds: float,
+              accounts: typing.Optional[typing.Collection[str]] = None) -> typing.List[Job]:
+        if accounts is None:
+            accounts = sorted(self._client.smembers(self._prefix + 'accounts'))
+
+        jobs = []
+        now = time.time()
+        for account in accounts:
+            if len(jobs) >= count:
+                break
+            rows = self._lease(args=[self._prefix, account, now, count - len(jobs), worker, now + lease_seconds,
+                                     self._max_attempts])
+            jobs.extend(Job(id_, account, module, json.loads(entity), int(failures))
+                        for id_, module, entity, failures in rows)
+        return jobs
+
+    def ack(self, job: Job, worker: str):
+        self._ack(args=[self._prefix, job.id, worker])
+
+    def release(self, job: Job, worker: str, delay: float = 0, failed: bool = False) -> str:
+        return self._release(args=[self._prefix, job.id, worker, time.time() + delay, 1 if failed else 0,
+                                   self._max_attempts])
+
+    def counts(self, accounts: typing.Optional[typing.Collection[str]] = None) -> typing.Dict[str, int]:
+        if accounts is None:
+            counts = self._client.hgetall(self._prefix + 'counts')
+            return {status: int(counts.get(status, 0)) for status in statuses}
+
+        total = dict.fromkeys(statuses, 0)
+        for account in accounts:
+            counts = self._client.hgetall(self._prefix + 'counts:' + account)
+            for status in statuses:
+                total[status] += int(counts.get(status, 0))
+        return total
+
+    def close(self):
+        self._client.close()
+
+
+def open_queue(url: str, max_attempts: int = 5) -> JobQueue:
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisJobQueue(url, max_attempts)
+    return SqliteJobQueue(url, max_attempts)
@@ -0,0 +1,229 @@
+"""
+运行指标: 计数器, 耗时直方图和瞬时值
+
+所有指标都记录在全局的 registry 中, 可以定期保存为 JSON, 也可以通过本地的 HTTP 端口以 Prometheus 格式导出
+"""
+import collections
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+default_buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    bounds: typing.Tuple[float, ...]
+
+    def __init__(self, bounds: typing.Tuple[float, ...] = default_buckets):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {str(bound): count for bound, count in zip(self.bounds, self.counts)},
+        }
+
+
+class RateMeter:
+    """最近 window 秒内每秒发生的次数, 刚开始运行不足 window 秒时按实际运行时间计算"""
+    _window: float
+
+    def __init__(self, window: float = 60):
+        self._window = window
+        self._started = time.monotonic()
+        self._events = collections.deque()
+        self._lock = threading.Lock()
+
+    def mark(self):
+        with self._lock:
+            now = time.monotonic()
+            self._events.append(now)
+            self._expire(now)
+
+    def rate(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            return len(self._events) / max(min(self._window, now - self._started), 1)
+
+    def _expire(self, now: float):
+        while self._events and now - self._events[0] > self._window:
+            self._events.popleft()
+
+
+class Registry:
+    """线程安全的指标集合, 同名指标按标签区分"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: typing.Dict[str, typing.Dict[Labels, float]] = {}
+        self._gauges: typing.Dict[str, typing.Dict[Labels, float]] = {}
+        self._histograms: typing.Dict[str, typing.Dict[Labels, Histogram]] = {}
+        self._help: typing.Dict[str, str] = {}
+
+    @staticmethod
+    def _labels(labels: typing.Dict[str, str]) -> Labels:
+        return tuple(sorted(labels.items()))
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = self._labels(labels)
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: str):
+        with self._lock:
+            self._gauges.setdefault(name, {})[self._labels(labels)] = value
+
+    def observe(self, name: str, value: float, **labels: str):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = self._labels(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            def flatten(series: dict, convert=lambda v: v) -> list:
+                return [{'labels': dict(labels), 'value': convert(value)} for labels, value in series.items()]
+
+            return {
+                'timestamp': time.time(),
+                'counters': {name: flatten(series) for name, series in self._counters.items()},
+                'gauges': {name: flatten(series) for name, series in self._gauges.items()},
+                'histograms': {name: flatten(series, Histogram.to_dict) for name, series in self._histograms.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        def format_labels(labels: Labels, extra: Labels = ()) -> str:
+            labels = labels + extra
+            if not labels:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for name, series in metrics.items():
+                    if name in self._help:
+                        lines.append(f'# HELP {name} {self._help[name]}')
+                    lines.append(f'# TYPE {name} {kind}')
+                    for labels, value in series.items():
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+
+            for name, series in self._histograms.items():
+                if name in self._help:
+                    lines.append(f'# HELP {name} {self._help[name]}')
+                lines.append(f'# TYPE {name} histogram')
+                for labels, histogram in series.items():
+                    for bound, count in zip(histogram.bounds, histogram.counts):
+                        lines.append(f'{name}_bucket{format_labels(labels, (("le", str(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{format_labels(labels, (("le", "+Inf"),))} {histogram.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {histogram.sum}')
+                    lines.append(f'{name}_count{format_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+registry.describe('tieba_collect_seconds', 'Time spent fetching and parsing one listing page')
+registry.describe('tieba_delete_seconds', 'Time spent on one delete request')
+registry.describe('tieba_tbs_fetch_seconds', 'Time spent fetching the tbs token')
+registry.describe('tieba_pages_scanned_total', 'Listing pages fetched')
+registry.describe('tieba_deletes_total', 'Delete results by outcome')
+registry.describe('tieba_limit_hits_total', 'Deletes rejected with the 220034 limit code')
+registry.describe('tieba_delete_rate', 'Successful deletes per second over the last minute')
+registry.describe('tieba_adaptive_rate', 'Current request rate chosen by the adaptive controller')
+registry.describe('tieba_page_cache_total', 'Listing pages served from the page cache (hit, not_modified) or parsed (miss)')
+
+
+class JsonReporter:
+    """每隔 interval 秒把指标快照写入 path, 先写临时文件再替换, 读取方不会读到写了一半的文件"""
+    _path: str
+    _interval: float
+
+    def __init__(self, path: str, interval: float = 10):
+        self._path = path
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-json', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.write()
+
+    def write(self):
+        temp_path = self._path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(temp_path, self._path)
+        except OSError as e:
+            logger.error(f'failed to write metrics to [{self._path}]: {e}')
+
+    def stop(self):
+        # 等后台线程结束再写最后一次, 两次写入同一个临时文件会互相覆盖
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+
+class _PrometheusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        data = registry.to_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_prometheus_server(port: int, host: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """在后台线程中启动 /metrics 接口, 默认只监听本机"""
+    server = ThreadingHTTPServer((host, port), _PrometheusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f'metrics available at http://{host}:{server.server_port}/metrics')
+    return server
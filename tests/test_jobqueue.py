@@ -0,0 +1,90 @@
+"""
+SqliteJobQueue 的租用, 确认和释放
+
+    python -m unittest discover tests
+"""
+import os
+import tempfile
+import time
+import unittest
+
+from jobqueue import SqliteJobQueue
+
+
+class SqliteJobQueueTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.queue = SqliteJobQueue(os.path.join(directory.name, 'queue.db'), max_attempts=3)
+        self.addCleanup(self.queue.close)
+
+    def put(self, account: str = 'a', key: str = '1') -> int:
+        return self.queue.put([(account, 'reply', key, {'tid': key})])
+
+    def expire(self):
+        # 租约时间为 0 的任务在下一次租用时已经过期
+        time.sleep(0.01)
+
+    def test_put_dedupe(self):
+        self.assertEqual(self.put(), 1)
+        self.assertEqual(self.put(), 0)
+        self.assertEqual(self.queue.counts()['pending'], 1)
+
+    def test_lease_expiry_counts_as_failure(self):
+        self.put()
+        self.assertEqual(self.queue.lease('w1', 10, 0)[0].failures, 0)
+        self.expire()
+        jobs = self.queue.lease('w2', 10, 60)
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].failures, 1)
+        # 没有过期的租约不会被别的 worker 租走
+        self.assertEqual(self.queue.lease('w3', 10, 60), [])
+
+    def test_release_by_non_holder_is_ignored(self):
+        self.put()
+        job, = self.queue.lease('w1', 10, 60)
+        self.assertEqual(self.queue.release(job, 'w2', failed=True), 'leased')
+        self.assertEqual(self.queue.counts()['leased'], 1)
+        self.assertEqual(self.queue.release(job, 'w1'), 'pending')
+        self.assertEqual(self.queue.lease('w2', 10, 60)[0].failures, 0)
+
+    def test_max_attempts_reaches_failed(self):
+        self.put()
+        for attempt in range(3):
+            job, = self.queue.lease('w1', 10, 60)
+            status = self.queue.release(job, 'w1', failed=True)
+        self.assertEqual(status, 'failed')
+        self.assertEqual(self.queue.lease('w1', 10, 60), [])
+        self.assertEqual(self.queue.counts()['failed'], 1)
+
+    def test_lease_expiry_reaches_failed(self):
+        self.put()
+        for attempt in range(3):
+            self.assertEqual(len(self.queue.lease('w1', 10, 0)), 1)
+            self.expire()
+        self.assertEqual(self.queue.lease('w1', 10, 0), [])
+        self.assertEqual(self.queue.counts()['failed'], 1)
+
+    def test_ack_after_lease_expired(self):
+        self.put()
+        job, = self.queue.lease('w1', 10, 0)
+        self.expire()
+        self.queue.ack(job, 'w1')
+        self.assertEqual(self.queue.counts()['done'], 1)
+        self.assertEqual(self.queue.lease('w2', 10, 60), [])
+        # 过期后的释放不会把完成的任务改回去
+        self.assertEqual(self.queue.release(job, 'w1'), 'done')
+
+    def test_counts_by_account(self):
+        self.put('a', '1')
+        self.put('a', '2')
+        self.put('b', '3')
+        self.queue.lease('w1', 1, 60, ['b'])
+        self.assertEqual(self.queue.counts(['a']), {'pending': 2, 'leased': 0, 'done': 0, 'failed': 0})
+        self.assertEqual(self.queue.counts(['b']), {'pending': 0, 'leased': 1, 'done': 0, 'failed': 0})
+        self.assertEqual(self.queue.counts(['a', 'b'])['pending'], 2)
+        self.assertEqual(self.queue.counts(['c'])['pending'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+"""
+列表页面解析的对照测试, 页面由 bench/fixtures 下保存的模板生成, parse_*_page 和 *_page_stream 的结果都要和预期完全一致,
+删除时提交的字段还要和原来用 BeautifulSoup 实现的 _collect 完全一致 (需要 requirements-test.txt 中的 beautifulsoup4)
+
+    python -m unittest discover tests
+"""
+import hashlib
+import re
+import unittest
+
+import bs4
+
+import DeleteMyHistory
+from bench.mock_server import MockTieba
+
+chunk_sizes = (1, 7, 64, DeleteMyHistory.stream_chunk_size)
+
+
+def post_meta(index: int) -> dict:
+    return {'forum': f'模拟吧{index}', 'time': f'{2015 + index}-05-01 12:00'}
+
+
+expected = {
+    '/i/i/my_tie': [
+        {'tid': f'700000000{i}', 'pid': f'13000000000{i}', **post_meta(i), 'title': f'模拟主题帖 700000000{i}'}
+        for i in range(3)
+    ],
+    '/i/i/my_reply': [
+        # 第一条是楼中楼, pid 为 cid
+        {'tid': '8000000000', 'pid': '150000000000', **post_meta(0), 'title': '模拟回复内容 140000000000'},
+        {'tid': '8000000001', 'pid': '140000000001', **post_meta(1), 'title': '模拟回复内容 140000000001'},
+        {'tid': '8000000002', 'pid': '140000000002', **post_meta(2), 'title': '模拟回复内容 140000000002'},
+    ],
+    '/f/like/mylike': [
+        {'fid': f'10000{i}', 'tbs': 'mocklongtbs0123456789', 'fname': f'模拟吧{i}',
+         'forum': f'模拟吧{i}', 'time': '', 'title': f'模拟吧{i}'}
+        for i in range(3)
+    ],
+    '/i/i/concern': [
+        {'cmd': 'unfollow', 'tbs': 'mocklongtbs0123456789', 'id': f'tb.1.concern0000000{i}'} for i in range(3)
+    ],
+    '/i/i/fans': [
+        {'cmd': 'add_black_list', 'tbs': 'mockshorttbs0123', 'portrait': f'tb.1.fan0000000{i}'} for i in range(3)
+    ],
+}
+
+parsers = {
+    '/i/i/my_tie': (DeleteMyHistory.parse_thread_page, DeleteMyHistory.thread_page_stream),
+    '/i/i/my_reply': (DeleteMyHistory.parse_reply_page, DeleteMyHistory.reply_page_stream),
+    '/f/like/mylike': (DeleteMyHistory.parse_followed_ba_page, DeleteMyHistory.followed_ba_page_stream),
+    '/i/i/concern': (DeleteMyHistory.parse_concern_page, DeleteMyHistory.concern_page_stream),
+    '/i/i/fans': (DeleteMyHistory.parse_fan_page, DeleteMyHistory.fan_page_stream),
+}
+
+
+# 原来各模块 _collect 中用 BeautifulSoup 解析页面的部分, 只把请求换成了传入的页面内容
+def bs4_thread_page(text: str) -> list:
+    tid_exp = re.compile(r"/([0-9]+)")
+    pid_exp = re.compile(r"pid=([0-9]+)")
+
+    html = bs4.BeautifulSoup(text, "lxml")
+    elements = html.find_all(name="a", attrs={"class": "thread_title"})
+
+    current_page_thread = []
+    for element in elements:
+        thread = element.get("href")
+        thread_dict = dict()
+        thread_dict["tid"] = tid_exp.findall(thread)[0]
+        thread_dict["pid"] = pid_exp.findall(thread)[0]
+        current_page_thread.append(thread_dict)
+    return current_page_thread
+
+
+def bs4_reply_page(text: str) -> list:
+    tid_exp = re.compile(r"/([0-9]+)")
+    pid_exp = re.compile(r"pid=([0-9]+)")  # 主题贴和回复都为 pid
+    cid_exp = re.compile(r"cid=([0-9]+)")  # 楼中楼为 cid
+
+    html = bs4.BeautifulSoup(text, "lxml")
+    elements = html.find_all(name="a", attrs={"class": "b_reply"})
+    current_page_reply = []
+
+    for element in elements:
+        reply = element.get("href")
+        if reply.find("pid") != -1:
+            tid = tid_exp.findall(reply)
+            pid = pid_exp.findall(reply)
+            cid = cid_exp.findall(reply)
+            reply_dict = dict()
+            reply_dict["tid"] = tid[0]
+
+            if cid and cid[0] != "0":  # 如果 cid != 0, 这个回复是楼中楼, 否则是一整楼的回复
+                reply_dict["pid"] = cid[0]
+            else:
+                reply_dict["pid"] = pid[0]
+            current_page_reply.append(reply_dict)
+    return current_page_reply
+
+
+def bs4_followed_ba_page(text: str) -> list:
+    ba_list = []
+    html = bs4.BeautifulSoup(text, "lxml")
+    elements = html.find_all(name="span")
+    for element in elements:
+        ba_dict = dict()
+        ba_dict["fid"] = element.get("balvid")
+        ba_dict["tbs"] = element.get("tbs")
+        ba_dict["fname"] = element.get("balvname")
+        ba_list.append(ba_dict)
+    return ba_list
+
+
+def bs4_concern_page(text: str) -> list:
+    concern_list = []
+    html = bs4.BeautifulSoup(text, "lxml")
+    elements = html.find_all(name="input", attrs={"class": "btn_unfollow"})
+    for element in elements:
+        concern_dict = dict()
+        concern_dict["cmd"] = "unfollow"
+        concern_dict["tbs"] = element.get("tbs")
+        concern_dict["id"] = element.get("portrait")
+        concern_list.append(concern_dict)
+    return concern_list
+
+
+def bs4_fan_page(text: str) -> list:
+    fan_list = []
+    tbs_exp = re.compile(r"tbs : '([0-9a-zA-Z]{16})'")  # 居然还有一个短版 tbs.... 绝了
+
+    tbs = tbs_exp.findall(text)[0]
+    html = bs4.BeautifulSoup(text, "lxml")
+    elements = html.find_all(name="input", attrs={"class": "btn_follow"})
+    for element in elements:
+        fan_dict = dict()
+        fan_dict["cmd"] = "add_black_list"
+        fan_dict["tbs"] = tbs
+        fan_dict["portrait"] = element.get("portrait")
+        fan_list.append(fan_dict)
+    return fan_list
+
+
+baseline = {
+    '/i/i/my_tie': bs4_thread_page,
+    '/i/i/my_reply': bs4_reply_page,
+    '/f/like/mylike': bs4_followed_ba_page,
+    '/i/i/concern': bs4_concern_page,
+    '/i/i/fans': bs4_fan_page,
+}
+
+# 不规范的页面: 多个 class, class 中有换行和制表符, 只有前缀相同的 class, 没有 balvid 的 span, 没有 pid 的回复链接
+awkward_pages = {
+    '/i/i/my_tie': '<div class="simple_block_container"><a class="thread_title" href="/p/1?pid=11">a</a>'
+                   '<a class=" top\tthread_title\n" href="/p/2?pid=22">b</a><a class="thread_title_x" href="/p/3?pid=33">'
+                   'c</a><a class="xthread_title" href="/p/4?pid=44">d</a><span class="time">05-01</span></div>'
+                   '<a class="thread_title" href="/p/5?pid=55&see_lz=1">e</a>',
+    '/i/i/my_reply': '<div class="simple_block_container"><a class="b_reply" href="/p/1?pid=11&cid=0#11">a</a>'
+                     '<a class="b_reply j_reply" href="/p/2?pid=22&cid=23#23">b</a><a class="b_reply" href="/p/3">c</a>'
+                     '<a class="b_replyx" href="/p/4?pid=44">d</a></div><a class="b_reply" href="/p/5?pid=55&cid=">e</a>',
+    '/f/like/mylike': '<table><tr><td><a href="/f?kw=a">a</a></td><td><span class="btn_unlike j_unlike" balvid="1" '
+                      'tbs="t1" balvname="a">取消</span><span class="time">2020-01-01</span></td></tr>'
+                      '<tr><td><span balvid="2" tbs="t2">缺少吧名</span><span></span></td></tr></table>'
+                      '<p><span class="pager"><span balvid="3" balvname="c" tbs="t3">嵌套</span></span></p>',
+    '/i/i/concern': '<div><input class="btn_unfollow" tbs="t" portrait="p1"><input class="btn btn_unfollow j_unfollow" '
+                    'tbs="t" portrait="p2"><input class="btn_unfollow_disabled" tbs="t" portrait="p3">'
+                    '<input class="btn_unfollow" portrait="p4"></div>',
+    '/i/i/fans': "<script>var PageData = {tbs : 'abcdefgh01234567'};</script><div><input class=\"btn_follow\" "
+                 'portrait="p1"><input class="btn  btn_follow\tj_follow" portrait="p2"><input class="btn_followed" '
+                 'portrait="p3"><input class="btn_follow"></div>',
+}
+
+
+def submitted(entities: list) -> list:
+    """去掉只用于索引和筛选的字段, 剩下的是删除时提交的字段"""
+    return [{key: value for key, value in entity.items() if key not in DeleteMyHistory.index_fields}
+            for entity in entities]
+
+
+def parse_stream(stream: DeleteMyHistory.PageStream, content: bytes, chunk_size: int) -> list:
+    for i in range(0, len(content), chunk_size):
+        stream.feed(content[i:i + chunk_size])
+    return stream.close()
+
+
+class ParseTest(unittest.TestCase):
+    def setUp(self):
+        self.state = MockTieba(count=3, per_page=3)
+
+    def test_parse_page(self):
+        for path, (parse, _) in parsers.items():
+            content = self.state.render(path, 1).encode('utf-8')
+            for encoding in ('utf-8', None):
+                with self.subTest(path=path, encoding=encoding):
+                    self.assertEqual(parse(content, encoding), expected[path])
+
+    def test_page_stream(self):
+        for path, (_, page_stream) in parsers.items():
+            content = self.state.render(path, 1).encode('utf-8')
+            for chunk_size in chunk_sizes:
+                with self.subTest(path=path, chunk_size=chunk_size):
+                    self.assertEqual(parse_stream(page_stream('utf-8'), content, chunk_size), expected[path])
+
+    def test_empty_page(self):
+        for path, (parse, page_stream) in parsers.items():
+            if path == '/i/i/fans':
+                continue
+            with self.subTest(path=path):
+                self.assertEqual(parse(self.state.render(path, 2).encode('utf-8'), 'utf-8'), [])
+                self.assertEqual(parse(b'  \n', None), [])
+                self.assertEqual(parse_stream(page_stream(None), b'  \n', 1), [])
+
+    def test_meta_charset(self):
+        # 响应头没有 charset 时按页面中的 meta 解码
+        content = ('<html><head><meta charset="gbk"></head><body><div class="simple_block_container">'
+                   '<a class="thread_title" href="/p/1?pid=2" title="中文标题"></a>'
+                   '<a href="/f?kw=%E4%B8%AD%E6%96%87">中文吧</a></div></body></html>').encode('gbk')
+        want = [{'tid': '1', 'pid': '2', 'forum': '中文', 'time': '', 'title': '中文标题'}]
+        self.assertEqual(DeleteMyHistory.parse_thread_page(content), want)
+        for chunk_size in chunk_sizes:
+            self.assertEqual(parse_stream(DeleteMyHistory.thread_page_stream(), content, chunk_size), want)
+
+    def test_bs4_parity(self):
+        pages = {path: [self.state.render(path, 1), awkward_pages[path]] for path in parsers}
+        # mock_server 生成的每页多于一条的页面
+        state = MockTieba(count=25, per_page=10)
+        for path in parsers:
+            pages[path].append(state.render(path, 2))
+
+        for path, (parse, page_stream) in parsers.items():
+            for index, text in enumerate(pages[path]):
+                content = text.encode('utf-8')
+                want = baseline[path](text)
+                with self.subTest(path=path, page=index):
+                    self.assertTrue(want)
+                    self.assertEqual(submitted(parse(content, 'utf-8')), want)
+                    for chunk_size in chunk_sizes:
+                        self.assertEqual(submitted(parse_stream(page_stream('utf-8'), content, chunk_size)), want)
+
+    def test_fan_page_without_tbs(self):
+        content = self.state.render('/i/i/fans', 1).encode('utf-8').replace(b"tbs : '", b"tbs: '")
+        with self.assertRaises(ValueError):
+            DeleteMyHistory.parse_fan_page(content)
+        with self.assertRaises(ValueError):
+            parse_stream(DeleteMyHistory.fan_page_stream(), content, 64)
+
+    def test_page_stream_digest(self):
+        # 和 PageCache 对完整内容计算的摘要相同
+        content = self.state.render('/i/i/my_tie', 1).encode('utf-8')
+        stream = DeleteMyHistory.thread_page_stream('utf-8')
+        parse_stream(stream, content, 7)
+        self.assertEqual(stream.digest(), hashlib.blake2b(content, digest_size=16).digest())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+TokenBucket 和 AdaptiveRate 遇到上限后的暂停
+
+    python -m unittest discover tests
+"""
+import time
+import unittest
+
+import DeleteMyHistory
+
+
+def adaptive(bucket: DeleteMyHistory.TokenBucket, **config) -> DeleteMyHistory.AdaptiveRate:
+    return DeleteMyHistory.AdaptiveRate('test', bucket, {**DeleteMyHistory.default_adaptive_config, **config}, 4.0)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_wait(self):
+        bucket = DeleteMyHistory.TokenBucket(10, burst=2)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1, delta=0.02)
+
+    def test_pause_is_not_extended_by_a_shorter_pause(self):
+        bucket = DeleteMyHistory.TokenBucket(10, burst=2)
+        bucket.pause(10)
+        bucket.pause(1)
+        self.assertAlmostEqual(bucket.try_acquire(), 10, delta=0.1)
+
+    def test_penalize_and_reward(self):
+        bucket = DeleteMyHistory.TokenBucket(10, max_backoff=0.4)
+        for backoff in (0.1, 0.2, 0.4, 0.4):
+            bucket.penalize()
+            self.assertAlmostEqual(bucket.try_acquire(), backoff, delta=0.02)
+        bucket.reward()
+        bucket.penalize()
+        self.assertAlmostEqual(bucket.try_acquire(), 0.1, delta=0.02)
+
+
+class AdaptiveRateTest(unittest.TestCase):
+    def test_limit_during_cooldown_counts_once(self):
+        bucket = DeleteMyHistory.TokenBucket(4.0, burst=4)
+        rate = adaptive(bucket, limit_cooldown=10, max_limit_waits=1)
+        self.assertTrue(rate.on_limit())
+        self.assertEqual(rate.rate, 2.0)
+        paused = bucket.try_acquire()
+        self.assertAlmostEqual(paused, 10, delta=0.1)
+
+        # 暂停前已经发出的请求也遇到上限, 不再降低速度, 不延长暂停, 也不占用暂停次数
+        for _ in range(3):
+            self.assertTrue(rate.on_limit())
+        self.assertEqual(rate.rate, 2.0)
+        self.assertEqual(bucket.rate, 2.0)
+        self.assertLessEqual(bucket.try_acquire(), paused)
+
+    def test_limit_waits_after_cooldown(self):
+        bucket = DeleteMyHistory.TokenBucket(4.0, burst=4)
+        rate = adaptive(bucket, limit_cooldown=0.05, max_limit_waits=2)
+        self.assertTrue(rate.on_limit())
+        self.assertTrue(rate.on_limit())
+        time.sleep(0.1)
+        self.assertTrue(rate.on_limit())
+        self.assertEqual(rate.rate, 1.0)
+        time.sleep(0.1)
+        self.assertFalse(rate.on_limit())
+        self.assertEqual(rate.safe_rate, 1.0)
+
+    def test_success_and_error_stay_in_range(self):
+        bucket = DeleteMyHistory.TokenBucket(4.0)
+        rate = adaptive(bucket, min_rate=1.0, max_rate=4.5, increase=0.25, decrease=0.5)
+        for _ in range(4):
+            rate.on_success()
+        self.assertEqual(rate.rate, 4.5)
+        for _ in range(4):
+            rate.on_error()
+        self.assertEqual(rate.rate, 1.0)
+        self.assertEqual(bucket.rate, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
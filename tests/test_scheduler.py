@@ -0,0 +1,112 @@
+"""
+ThreadPoolScheduler 运行中调整线程数和关闭
+
+    python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+
+import DeleteMyHistory
+
+timeout = 5
+
+
+def wait_until(predicate, seconds: float = timeout) -> bool:
+    deadline = time.monotonic() + seconds
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class BlockingHandler:
+    """在 release 之前一直阻塞工作线程, 记录开始处理的实体"""
+
+    def __init__(self):
+        self.started = []
+        self.lock = threading.Lock()
+        self.released = threading.Event()
+
+    def __call__(self, batch):
+        with self.lock:
+            self.started.extend(batch)
+        self.released.wait(timeout)
+
+    def count(self) -> int:
+        with self.lock:
+            return len(self.started)
+
+
+class ThreadPoolSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.handler = BlockingHandler()
+        self.scheduler = DeleteMyHistory.ThreadPoolScheduler(self.handler, concurrency=2, queue_size=2)
+        self.addCleanup(self.scheduler.close)
+        self.addCleanup(self.handler.released.set)
+
+    def fill(self):
+        """两个线程都在处理中, 队列也已经满了"""
+        for i in range(2):
+            self.scheduler.submit({'id': str(i)})
+        self.assertTrue(wait_until(lambda: self.handler.count() == 2))
+        for i in range(2, 4):
+            self.scheduler.submit({'id': str(i)})
+
+    def in_thread(self, func, *args) -> threading.Thread:
+        thread = threading.Thread(target=func, args=args, daemon=True)
+        thread.start()
+        thread.join(1)
+        return thread
+
+    def test_shrink_with_full_queue_does_not_block(self):
+        self.fill()
+        self.assertFalse(self.in_thread(self.scheduler.resize, 1).is_alive())
+
+        self.handler.released.set()
+        self.scheduler.wait(0)
+        self.assertEqual(self.handler.count(), 4)
+        self.assertTrue(wait_until(lambda: len(self.scheduler._workers) == 1))
+
+    def test_grow_cancels_pending_retirement(self):
+        self.fill()
+        workers = list(self.scheduler._workers)
+        self.scheduler.resize(1)
+        self.scheduler.resize(2)
+
+        self.handler.released.set()
+        self.scheduler.wait(0)
+        # 没有启动新的线程, 原来的线程也都没有退出
+        time.sleep(0.1)
+        self.assertEqual(self.scheduler._workers, workers)
+        self.assertTrue(all(worker.is_alive() for worker in workers))
+
+    def test_close_joins_every_worker(self):
+        self.scheduler.resize(4)
+        self.scheduler.resize(1)
+        workers = list(self.scheduler._workers)
+        self.assertEqual(len(workers), 4)
+
+        self.handler.released.set()
+        for i in range(8):
+            self.scheduler.submit({'id': str(i)})
+        self.scheduler.join()
+        self.assertEqual(self.handler.count(), 8)
+        self.assertFalse(self.in_thread(self.scheduler.close).is_alive())
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+    def test_close_with_full_queue_does_not_block(self):
+        # 出错时 close 在 finally 中调用, 队列中可能还有没处理的实体
+        self.fill()
+        workers = list(self.scheduler._workers)
+        closing = threading.Thread(target=self.scheduler.close, daemon=True)
+        closing.start()
+        self.handler.released.set()
+        closing.join(timeout)
+        self.assertFalse(closing.is_alive())
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+
+
+if __name__ == '__main__':
+    unittest.main()